@@ -0,0 +1,175 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import asyncio
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from autolos_kabali.gemini.gemini_buy_logic import buy_trade_logic
+from autolos_kabali.gemini.gemini_cadence import GEMINI_CADENCE, update_cadence
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_helper import GEMINI_STOPPING, symbol_lock, has_open_order, refresh_balances, \
+    trigger_crossed
+from autolos_kabali.gemini.gemini_http_pool import GEMINI_HTTP_POOL
+from autolos_kabali.gemini.gemini_market_snapshot import async_refresh_market_snapshot
+from autolos_kabali.gemini.gemini_market_stream import GeminiMarketStream
+from autolos_kabali.gemini.gemini_metrics import GEMINI_METRICS
+from autolos_kabali.gemini.gemini_sell_logic import sell_logic_hybrid
+from autolos_kabali.gemini.gemini_stats import print_state
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT
+
+
+def evaluate_symbol(symbol):
+    if GEMINI_STOPPING.is_set() or has_open_order(symbol):
+        # the order tracker books the result, the lot book is not final until then
+        return
+    if GEMINI_TRIGGER_INDEX and not trigger_crossed(symbol):
+        return
+    with GEMINI_METRICS.timer('symbol_seconds', symbol=symbol), symbol_lock(symbol):
+        # Run the buy algorithm
+        buy_trade_logic(symbol)
+
+        # Run the sell algorithm
+        sell_logic_hybrid(symbol)
+
+
+def evaluate_and_reschedule(symbol):
+    evaluate_symbol(symbol)
+    if GEMINI_POLL_CADENCE:
+        update_cadence(symbol)
+
+
+class GeminiEngine:
+    """ Evaluates every symbol of a cycle as its own task.
+
+    Market data is refreshed with async HTTP once per cycle, on connections opened before the first cycle and
+    kept alive, then each symbol's buy and sell logic runs on a worker thread with at most
+    GEMINI_ENGINE_CONCURRENCY symbols in flight. Order placement and polling still go through robin_stocks, one
+    signed call at a time (GEMINI_SIGNED_CALLS). A failing symbol backs off on its own while the rest trade.
+    With GEMINI_POLL_CADENCE a cycle only refreshes and evaluates the symbols GEMINI_CADENCE has due, and waits
+    when none is.
+
+    With GEMINI_MARKET_STREAM the engine is driven by the websocket instead: a symbol is evaluated as soon as
+    a quote for it arrives that crossed one of its triggers (with GEMINI_TRIGGER_INDEX, any quote otherwise; at
+    most one evaluation per symbol in flight), every symbol is swept when the
+    stream is quiet for GEMINI_STREAM_IDLE_CYCLE, and it falls back to REST cycles while disconnected.
+    """
+
+    def __init__(self, symbols=GEMINI_CRYPTO_LIST, concurrency=GEMINI_ENGINE_CONCURRENCY):
+        self.symbols = list(symbols)
+        self.concurrency = concurrency
+        self.backoff_until = {}
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="gemini-symbol")
+        self.semaphore = None
+        self.stream = None
+        self.dirty = set()
+        self.running = set()
+        self.wakeup = None
+
+    async def run_symbol(self, symbol):
+        if self.backoff_until.get(symbol, 0.0) > time.monotonic():
+            return
+        async with self.semaphore:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, evaluate_and_reschedule, symbol)
+            except Exception as e:
+                print("Engine:", symbol, e)
+                print(traceback.format_exc())
+                self.backoff_until[symbol] = time.monotonic() + GEMINI_SYMBOL_ERROR_BACKOFF
+
+    async def run_cycle(self, client):
+        symbols = self.symbols
+        if GEMINI_POLL_CADENCE:
+            symbols = GEMINI_CADENCE.due()
+            if not symbols:
+                await asyncio.sleep(GEMINI_CADENCE.wait())
+                return
+        started = time.monotonic()
+        await async_refresh_market_snapshot(client, symbols)
+        await self.refresh_balances()
+        await asyncio.gather(*(self.run_symbol(symbol) for symbol in symbols))
+        GEMINI_METRICS.end_cycle(time.monotonic() - started)
+        if GEMINI_VERBOSE:
+            print("Engine: cycle took", round(time.monotonic() - started, 3), "s")
+
+    async def refresh_balances(self):
+        # one balance fetch for every symbol, and only when the ledger is due to reconcile
+        await asyncio.get_running_loop().run_in_executor(self.executor, refresh_balances)
+
+    async def print_state(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, print_state)
+
+    def on_quote(self, symbol, quote):
+        # a quote that crossed no trigger would be evaluated for nothing
+        if GEMINI_TRIGGER_INDEX and not trigger_crossed(symbol, quote):
+            return
+        self.dirty.add(symbol)
+        self.wakeup.set()
+
+    async def run_dirty_symbol(self, symbol):
+        try:
+            await self.run_symbol(symbol)
+        finally:
+            self.running.discard(symbol)
+            if symbol in self.dirty:
+                self.wakeup.set()
+
+    def dispatch_dirty_symbols(self):
+        for symbol in self.dirty - self.running:
+            self.dirty.discard(symbol)
+            self.running.add(symbol)
+            asyncio.get_running_loop().create_task(self.run_dirty_symbol(symbol))
+
+    async def run_streaming(self, client):
+        self.stream = GeminiMarketStream(self.symbols)
+        self.stream.add_listener(self.on_quote)
+        stream_task = asyncio.get_running_loop().create_task(self.stream.run())
+        ticker_refreshed_at = 0.0
+        printed_at = 0.0
+        try:
+            while True:
+                if not self.stream.connected:
+                    await self.run_cycle(client)
+                    ticker_refreshed_at = time.monotonic()
+                else:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), GEMINI_STREAM_IDLE_CYCLE)
+                    except asyncio.TimeoutError:
+                        self.dirty.update(self.symbols)
+                    self.wakeup.clear()
+                    # the stream carries bid, ask and last trade, the 24h high/low/open still come from tickers
+                    if time.monotonic() - ticker_refreshed_at > GEMINI_STREAM_TICKER_REFRESH:
+                        # streamed evaluations have no cycle, the ticker refreshes delimit one for the metrics
+                        GEMINI_METRICS.end_cycle(time.monotonic() - ticker_refreshed_at)
+                        await async_refresh_market_snapshot(client, self.symbols)
+                        await self.refresh_balances()
+                        ticker_refreshed_at = time.monotonic()
+                    self.dispatch_dirty_symbols()
+                if time.monotonic() - printed_at > GEMINI_STREAM_PRINT_INTERVAL:
+                    await self.print_state()
+                    printed_at = time.monotonic()
+        finally:
+            stream_task.cancel()
+
+    async def run(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.wakeup = asyncio.Event()
+        async with GEMINI_HTTP_POOL.async_client(GEMINI_PRICEFEED_TIMEOUT, GEMINI_SNAPSHOT_BATCH_SIZE) as client:
+            if GEMINI_HTTP_PREWARM and GEMINI_PRICEFEED_URL is not None:
+                await GEMINI_HTTP_POOL.async_prewarm(client, [GEMINI_PRICEFEED_URL])
+            if GEMINI_MARKET_STREAM:
+                await self.run_streaming(client)
+            run_count = 0
+            while True:
+                await self.run_cycle(client)
+                if run_count % 10 == 0:
+                    print("Run count:", run_count)
+                    if GEMINI_TRANSPORT_MODE != "live":
+                        print(GEMINI_TRANSPORT.summary())
+                    await self.print_state()
+                run_count = run_count + 1
+
+
+def run_engine(symbols=GEMINI_CRYPTO_LIST):
+    asyncio.run(GeminiEngine(symbols).run())
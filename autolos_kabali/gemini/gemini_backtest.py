@@ -0,0 +1,494 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import contextlib
+import csv
+import heapq
+import itertools
+import json
+import math
+import time
+from collections import deque
+
+from prettytable import PrettyTable
+
+from autolos_kabali.gemini import gemini_helper, gemini_sell_logic
+from autolos_kabali.gemini.gemini_async_engine import evaluate_symbol
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_helper import GEMINI_TRIGGERS, fetch_balances
+from autolos_kabali.gemini.gemini_stats import GEMINI_STATE_REPORTER
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT
+from autolos_kabali.main.balance_ledger import BalanceLedger
+from autolos_kabali.main.lot_store import MemoryLotStore
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def read_candles(candles_file):
+    """ Yields (time, open, high, low, close, volume) from a CSV in the layout of the Gemini candles endpoint.
+        Times may be in seconds or milliseconds, a header row is skipped, rows must be in ascending time.
+    """
+    previous = None
+    with open(candles_file, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0][:1].isdigit():
+                continue
+            timestamp = float(row[0])
+            if timestamp > 1e11:
+                timestamp = timestamp / 1000.0
+            if previous is not None and timestamp <= previous:
+                raise ValueError(candles_file + ": candles must be in ascending time order")
+            previous = timestamp
+            yield (timestamp,
+                   float(row[1]),
+                   float(row[2]),
+                   float(row[3]),
+                   float(row[4]),
+                   float(row[5]) if len(row) > 5 else 0.0)
+
+
+def with_next_candle(candles, index):
+    previous = None
+    for candle in candles:
+        if previous is not None:
+            yield previous[0], index, previous, candle
+        previous = candle
+    if previous is not None:
+        yield previous[0], index, previous, None
+
+
+def load_backtest_symbol_details(details_file=GEMINI_SYMBOL_DETAILS_FILE):
+    """ Reads the symbol details cache written by gemini_symbol_details, an empty dict when there is none. """
+    if not os.path.exists(details_file):
+        return {}
+    with open(details_file) as f:
+        return json.load(f)['symbols']
+
+
+class VirtualClock:
+    """ Stands in for the time module, sleeping only moves the clock forward. """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now = self.now + seconds
+
+    def set(self, now):
+        self.now = max(self.now, now)
+
+
+class SymbolFeed:
+    """ Candle replay state of one symbol: the current and next candle and a 24h window for the ticker. """
+
+    __slots__ = ('symbol', 'candle', 'next_candle', 'window', 'highs', 'close')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.candle = None
+        self.next_candle = None
+        self.window = deque()
+        # 24h highs kept decreasing, the first one is the ticker high
+        self.highs = deque()
+        self.close = None
+
+
+class SimulatedExchange:
+    """ Replays candles behind the robin_stocks.gemini calls the trading logic makes.
+
+    Quotes are built from the current candle: the bid is the close on the price grid and the ask spread_ticks
+    above it, the 24h high, low and open come from the candles of the last day. Maker-or-cancel orders that
+    would cross the book are cancelled on arrival. A resting order is matched against the next candle: it
+    fills completely when the candle trades through its price, partial_fill_ratio of it when the candle only
+    touches the price, and never more than participation of the candle volume. The fill shows on the first
+    order_status poll, what is left rests until the order times out and is cancelled.
+    """
+
+    def __init__(self, clock, symbols, starting_cash=GEMINI_BACKTEST_STARTING_CASH,
+                 maker_fee_bps=GEMINI_BACKTEST_MAKER_FEE_BPS, spread_ticks=GEMINI_BACKTEST_SPREAD_TICKS,
+                 partial_fill_ratio=GEMINI_BACKTEST_PARTIAL_FILL_RATIO, participation=GEMINI_BACKTEST_PARTICIPATION,
+                 symbol_details=None):
+        self.clock = clock
+        self.symbols = list(symbols)
+        self.fee_rate = maker_fee_bps / 10000.0
+        self.spread_ticks = spread_ticks
+        self.partial_fill_ratio = partial_fill_ratio
+        self.participation = participation
+        symbol_details = dict(GEMINI_BACKTEST_SYMBOL_DETAILS, **(symbol_details or {}))
+        missing = [symbol for symbol in self.symbols if symbol not in symbol_details]
+        if missing:
+            raise ValueError("No symbol details for " + ", ".join(missing) + ", pass a symbol details file")
+        self.details = {symbol: dict(symbol_details[symbol]) for symbol in self.symbols}
+        self.feeds = {symbol: SymbolFeed(symbol) for symbol in self.symbols}
+        self.balances = {'usd': starting_cash}
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.fills = 0
+        self.stats = {symbol: {'buys': 0, 'sells': 0, 'partial_fills': 0, 'cancelled': 0, 'rejected': 0,
+                               'fees': 0.0, 'cash_flow': 0.0}
+                      for symbol in self.symbols}
+
+    # robin_stocks.gemini
+
+    def check_available_balances(self, jsonify=None):
+        return [{'currency': currency.upper(), 'amount': str(amount), 'available': str(amount), 'type': "exchange"}
+                for currency, amount in self.balances.items()], None
+
+    def order(self, symbol, quantity, side, price=None, options=None, jsonify=None):
+        quantity = float(quantity)
+        price = float(price)
+        order_id = str(next(self.order_ids))
+        order = {'order_id': order_id,
+                 'client_order_id': "",
+                 'symbol': symbol,
+                 'side': side,
+                 'type': "exchange limit",
+                 'price': str(price),
+                 'original_amount': str(quantity),
+                 'options': options or [],
+                 'is_live': True,
+                 'is_cancelled': False,
+                 'executed': 0.0,
+                 'planned_fill': None}
+        self.orders[order_id] = order
+        quote = self.get_quote(symbol)
+        currency = gemini_helper.get_base_currency(symbol)
+        if "maker-or-cancel" in order['options'] and \
+                (price >= float(quote['ask']) if side == "buy" else price <= float(quote['bid'])):
+            self.reject(order, "MakerOrCancelWouldTake")
+        elif side == "buy" and quantity * price * (1.0 + self.fee_rate) > self.balances['usd'] + 1e-9:
+            self.reject(order, "InsufficientFunds")
+        elif side == "sell" and quantity > self.balances.get(currency, 0.0) + 1e-12:
+            self.reject(order, "InsufficientFunds")
+        else:
+            order['planned_fill'] = self.plan_fill(symbol, side, quantity, price)
+        return self.order_status_json(order), None
+
+    def order_status(self, order_id, jsonify=None):
+        order = self.orders[order_id]
+        if order['planned_fill'] is not None:
+            self.fill(order, order['planned_fill'])
+            order['planned_fill'] = None
+        return self.order_status_json(order), None
+
+    def cancel_order(self, order_id, jsonify=None):
+        order = self.orders[order_id]
+        if order['is_live']:
+            order['is_live'] = False
+            order['is_cancelled'] = True
+            order['reason'] = "Requested"
+            self.stats[order['symbol']]['cancelled'] += 1
+        return self.order_status_json(order), None
+
+    # market data
+
+    def get_quote(self, symbol, max_age=None):
+        feed = self.feeds[symbol]
+        increment = float(self.details[symbol]['quote_increment'])
+        decimals = max(int(round(-math.log10(increment))), 0)
+        bid = math.floor(feed.close / increment + 1e-9) * increment
+        ask = bid + self.spread_ticks * increment
+        return {'symbol': symbol.upper(),
+                'open': str(feed.window[0][1]),
+                'high': str(feed.highs[0][1]),
+                'low': str(min(candle[3] for candle in feed.window)),
+                'close': str(feed.close),
+                'changes': [],
+                'bid': '{:.{}f}'.format(bid, decimals),
+                'ask': '{:.{}f}'.format(ask, decimals)}
+
+    def get_symbol_details(self, symbol):
+        return self.details[symbol]
+
+    # matching
+
+    def plan_fill(self, symbol, side, quantity, price):
+        candle = self.feeds[symbol].next_candle
+        if candle is None:
+            return 0.0
+        _, _, high, low, _, volume = candle
+        touched = low <= price if side == "buy" else high >= price
+        if not touched:
+            return 0.0
+        crossed = low < price if side == "buy" else high > price
+        filled = quantity if crossed else quantity * self.partial_fill_ratio
+        if self.participation > 0.0 and volume > 0.0:
+            filled = min(filled, volume * self.participation)
+        if filled < quantity:
+            tick_size = float(self.details[symbol]['tick_size'])
+            filled = math.floor(filled / tick_size + 1e-9) * tick_size
+        return filled
+
+    def fill(self, order, quantity):
+        if quantity <= 0.0:
+            return
+        symbol = order['symbol']
+        currency = gemini_helper.get_base_currency(symbol)
+        price = float(order['price'])
+        dollars = quantity * price
+        fee = dollars * self.fee_rate
+        stats = self.stats[symbol]
+        if order['side'] == "buy":
+            self.balances['usd'] = self.balances['usd'] - dollars - fee
+            self.balances[currency] = self.balances.get(currency, 0.0) + quantity
+            stats['cash_flow'] -= dollars + fee
+            stats['buys'] += 1
+        else:
+            self.balances['usd'] = self.balances['usd'] + dollars - fee
+            self.balances[currency] = self.balances.get(currency, 0.0) - quantity
+            stats['cash_flow'] += dollars - fee
+            stats['sells'] += 1
+        stats['fees'] += fee
+        order['executed'] = quantity
+        if math.isclose(quantity, float(order['original_amount'])):
+            order['executed'] = float(order['original_amount'])
+            order['is_live'] = False
+        else:
+            stats['partial_fills'] += 1
+        self.fills = self.fills + 1
+
+    def reject(self, order, reason):
+        order['is_live'] = False
+        order['is_cancelled'] = True
+        order['reason'] = reason
+        self.stats[order['symbol']]['rejected'] += 1
+
+    def order_status_json(self, order):
+        original = float(order['original_amount'])
+        executed = order['executed']
+        status = {key: order[key] for key in ('order_id', 'client_order_id', 'symbol', 'side', 'type', 'price',
+                                              'original_amount', 'options', 'is_live', 'is_cancelled')}
+        status.update({'executed_amount': str(executed),
+                       'remaining_amount': str(original - executed),
+                       'avg_execution_price': order['price'] if executed > 0.0 else "0.00",
+                       'timestamp': str(int(self.clock.time())),
+                       'timestampms': int(self.clock.time() * 1000)})
+        if 'reason' in order:
+            status['reason'] = order['reason']
+        return status
+
+
+class GeminiBacktest:
+    """ Replays candles of every symbol, in time order, through the live buy and sell logic.
+
+    The exchange (behind GEMINI_TRANSPORT), market data, symbol details, clock, balance ledger and lot store
+    the trading logic uses are swapped for simulated ones while run() executes, and orders are placed in the
+    blocking mode, so order polling runs on the virtual clock. The logic only runs for a candle that can reach
+    a buy or sell trigger: the trigger prices are recomputed from the lot book after every evaluation, so the
+    candles in between cost a few comparisons. Shared cash means the symbols are replayed merged, not one
+    after another.
+    """
+
+    def __init__(self, candle_files, starting_cash=GEMINI_BACKTEST_STARTING_CASH, log_file=os.devnull, **exchange_args):
+        self.candle_files = dict(candle_files)
+        self.symbols = list(self.candle_files)
+        self.starting_cash = starting_cash
+        self.log_file = log_file
+        self.clock = VirtualClock()
+        self.exchange = SimulatedExchange(self.clock, self.symbols, starting_cash, **exchange_args)
+        self.store = MemoryLotStore(book_factory=GEMINI_OUTSTANDING_TRADE_LOTS.default_factory)
+        self.ledger = BalanceLedger(fetch_balances, float('inf'), "Backtest")
+        self.evaluations = 0
+
+    @contextlib.contextmanager
+    def simulated(self):
+        """ Points the trading logic at the simulation and restores the live setup afterwards. """
+        swaps = [(gemini_helper, 'time', self.clock),
+                 (gemini_helper, 'get_snapshot_quote', self.exchange.get_quote),
+                 (gemini_helper, 'get_symbol_details', self.exchange.get_symbol_details),
+                 (gemini_helper, 'GEMINI_ASYNC_ORDERS', False),
+                 (gemini_helper, 'GEMINI_LOT_STORE', self.store),
+                 (gemini_helper, 'GEMINI_BALANCES', self.ledger),
+                 (GEMINI_STATE_REPORTER, 'request', lambda print_stdout=True: None),
+                 (gemini_sell_logic, 'print_state', lambda print_stdout=True: None)]
+        saved = [(module, name, getattr(module, name)) for module, name, _ in swaps]
+        live_lots = dict(GEMINI_OUTSTANDING_TRADE_LOTS)
+        # the modules share this dict, the simulated store books into it
+        GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+        self.store.lots = GEMINI_OUTSTANDING_TRADE_LOTS
+        try:
+            for module, name, value in swaps:
+                setattr(module, name, value)
+            with GEMINI_TRANSPORT.using(self.exchange):
+                yield
+        finally:
+            for module, name, value in saved:
+                setattr(module, name, value)
+            GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+            GEMINI_OUTSTANDING_TRADE_LOTS.update(live_lots)
+
+    def trigger_prices(self, symbol):
+        """ The symbol's GeminiTriggers, shared with the live bot through GEMINI_TRIGGERS. """
+        return GEMINI_TRIGGERS.get(symbol)
+
+    def run(self):
+        started = time.monotonic()
+        with self.simulated(), open(self.log_file, 'a') as log, contextlib.redirect_stdout(log):
+            report = self.replay()
+        report['elapsed'] = round(time.monotonic() - started, 2)
+        return report
+
+    def replay(self):
+        exchange = self.exchange
+        ledger = self.ledger
+        feeds = [exchange.feeds[symbol] for symbol in self.symbols]
+        candles = heapq.merge(*(with_next_candle(read_candles(self.candle_files[symbol]), index)
+                                for index, symbol in enumerate(self.symbols)))
+        ledger.load()
+        triggers = [self.trigger_prices(symbol) for symbol in self.symbols]
+        holdings = [0.0] * len(self.symbols)
+        max_lots = {symbol: 0 for symbol in self.symbols}
+        position_value = 0.0
+        peak_equity = self.starting_cash
+        max_drawdown = 0.0
+        max_drawdown_pct = 0.0
+        deployed = 0.0
+        max_deployed = 0.0
+        deployed_sum = 0.0
+        min_cash = self.starting_cash
+        first_time = None
+        last_time = None
+        count = 0
+
+        for timestamp, index, candle, next_candle in candles:
+            feed = feeds[index]
+            cutoff = timestamp - DAY_SECONDS
+            window = feed.window
+            window.append(candle)
+            while window[0][0] <= cutoff:
+                window.popleft()
+            highs = feed.highs
+            high = candle[2]
+            while highs and highs[-1][1] <= high:
+                highs.pop()
+            highs.append((timestamp, high))
+            while highs[0][0] <= cutoff:
+                highs.popleft()
+            close = candle[4]
+            if holdings[index]:
+                position_value = position_value + holdings[index] * (close - feed.close)
+            feed.close = close
+            feed.candle = candle
+            feed.next_candle = next_candle
+
+            buy_cost, buy_factor, can_buy, trading_amount, sell_at, _, _ = triggers[index]
+            buy_at = (highs[0][1] if buy_cost is None else buy_cost) * buy_factor
+            if ((can_buy and close <= buy_at and ledger.available('usd') >= trading_amount) or
+                    (sell_at is not None and close > sell_at)):
+                symbol = feed.symbol
+                self.clock.set(timestamp)
+                fills = exchange.fills
+                evaluate_symbol(symbol)
+                self.evaluations = self.evaluations + 1
+                if exchange.fills != fills:
+                    ledger.load()
+                    currency = gemini_helper.get_base_currency(symbol)
+                    holdings[index] = exchange.balances.get(currency, 0.0)
+                    position_value = sum(quantity * feeds[i].close for i, quantity in enumerate(holdings) if quantity)
+                    deployed = sum(book.total_amount for book in GEMINI_OUTSTANDING_TRADE_LOTS.values())
+                    max_deployed = max(max_deployed, deployed)
+                    max_lots[symbol] = max(max_lots[symbol], len(GEMINI_OUTSTANDING_TRADE_LOTS[symbol]))
+                    min_cash = min(min_cash, exchange.balances['usd'])
+                triggers[index] = self.trigger_prices(symbol)
+
+            equity = exchange.balances['usd'] + position_value
+            if equity > peak_equity:
+                peak_equity = equity
+            elif peak_equity - equity > max_drawdown:
+                max_drawdown = peak_equity - equity
+                max_drawdown_pct = max(max_drawdown_pct, max_drawdown / peak_equity * 100.0)
+            deployed_sum = deployed_sum + deployed
+            count = count + 1
+            if first_time is None:
+                first_time = timestamp
+            last_time = timestamp
+
+        final_equity = exchange.balances['usd'] + position_value
+        symbols = {}
+        for index, symbol in enumerate(self.symbols):
+            stats = exchange.stats[symbol]
+            value = holdings[index] * (feeds[index].close or 0.0)
+            symbols[symbol] = dict(stats,
+                                   pnl=round(stats['cash_flow'] + value, 2),
+                                   fees=round(stats['fees'], 2),
+                                   cash_flow=round(stats['cash_flow'], 2),
+                                   holdings=holdings[index],
+                                   value=round(value, 2),
+                                   lots=len(GEMINI_OUTSTANDING_TRADE_LOTS[symbol]),
+                                   max_lots=max_lots[symbol])
+        return {'start': first_time,
+                'end': last_time,
+                'candles': count,
+                'evaluations': self.evaluations,
+                'starting_cash': self.starting_cash,
+                'final_equity': round(final_equity, 2),
+                'pnl': round(final_equity - self.starting_cash, 2),
+                'pnl_pct': round((final_equity - self.starting_cash) / self.starting_cash * 100.0, 4),
+                'max_drawdown': round(max_drawdown, 2),
+                'max_drawdown_pct': round(max_drawdown_pct, 4),
+                'max_capital_deployed': round(max_deployed, 2),
+                'avg_capital_deployed': round(deployed_sum / count, 2) if count else 0.0,
+                'min_cash': round(min_cash, 2),
+                'fees': round(sum(stats['fees'] for stats in exchange.stats.values()), 2),
+                'symbols': symbols}
+
+
+def print_report(report):
+    symbol_stats = PrettyTable()
+    symbol_stats.field_names = ["Coin", "PnL", "Fees", "Buys", "Sells", "Partial", "Cancelled", "Rejected",
+                                "Lots", "Max Lots", "Value"]
+    for symbol, stats in report['symbols'].items():
+        symbol_stats.add_row([symbol, stats['pnl'], stats['fees'], stats['buys'], stats['sells'],
+                              stats['partial_fills'], stats['cancelled'], stats['rejected'], stats['lots'],
+                              stats['max_lots'], stats['value']])
+    print(symbol_stats.get_string())
+    print("Candles:", report['candles'], "Evaluations:", report['evaluations'], "Elapsed s:", report['elapsed'])
+    print("Starting cash $$:", report['starting_cash'],
+          "Final equity $$:", report['final_equity'],
+          "PnL $$:", report['pnl'], "(" + str(report['pnl_pct']) + "%)")
+    print("Max drawdown $$:", report['max_drawdown'], "(" + str(report['max_drawdown_pct']) + "%)",
+          "Max capital deployed $$:", report['max_capital_deployed'],
+          "Avg. capital deployed $$:", report['avg_capital_deployed'],
+          "Min cash $$:", report['min_cash'],
+          "Fees $$:", report['fees'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest the Gemini ladders on historical candles")
+    parser.add_argument("candles_dir", help="directory with one <symbol>.csv of candles per symbol")
+    parser.add_argument("--symbols", nargs="+", default=GEMINI_CRYPTO_LIST)
+    parser.add_argument("--cash", type=float, default=GEMINI_BACKTEST_STARTING_CASH)
+    parser.add_argument("--fee-bps", type=float, default=GEMINI_BACKTEST_MAKER_FEE_BPS)
+    parser.add_argument("--spread-ticks", type=int, default=GEMINI_BACKTEST_SPREAD_TICKS)
+    parser.add_argument("--partial-fill-ratio", type=float, default=GEMINI_BACKTEST_PARTIAL_FILL_RATIO)
+    parser.add_argument("--participation", type=float, default=GEMINI_BACKTEST_PARTICIPATION)
+    parser.add_argument("--symbol-details", default=GEMINI_SYMBOL_DETAILS_FILE)
+    parser.add_argument("--log", default=os.devnull, help="file for the trading logic's output")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    candle_files = {symbol: os.path.join(args.candles_dir, symbol + ".csv") for symbol in args.symbols
+                    if os.path.exists(os.path.join(args.candles_dir, symbol + ".csv"))}
+    try:
+        backtest = GeminiBacktest(candle_files,
+                                  starting_cash=args.cash,
+                                  log_file=args.log,
+                                  maker_fee_bps=args.fee_bps,
+                                  spread_ticks=args.spread_ticks,
+                                  partial_fill_ratio=args.partial_fill_ratio,
+                                  participation=args.participation,
+                                  symbol_details=load_backtest_symbol_details(args.symbol_details))
+    except ValueError as e:
+        parser.error(str(e))
+    backtest_report = backtest.run()
+    print_report(backtest_report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(backtest_report, f, indent=2)
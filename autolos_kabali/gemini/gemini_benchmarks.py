@@ -0,0 +1,283 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from prettytable import PrettyTable
+
+from autolos_kabali.gemini import gemini_helper, gemini_market_snapshot
+from autolos_kabali.gemini.gemini_async_engine import evaluate_symbol
+from autolos_kabali.gemini.gemini_backtest import VirtualClock
+from autolos_kabali.gemini.gemini_buy_logic import aggressive_ask, gemini_round
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_helper import create_trade_details, evaluate_break_even_and_profit, \
+    fetch_balances, get_lowest_outstanding_trade, get_order_execution_state, get_signals
+from autolos_kabali.gemini.gemini_mock_exchange import MockGeminiExchange
+from autolos_kabali.gemini.gemini_sell_logic import aggressive_bid
+from autolos_kabali.gemini.gemini_stats import print_state
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT
+from autolos_kabali.main.balance_ledger import BalanceLedger
+from autolos_kabali.main.lot_book import LotBook
+from autolos_kabali.main.lot_store import LotJournal, MemoryLotStore
+
+GEMINI_BENCHMARK_FILE = "benchmarks_gemini.json"
+GEMINI_BENCHMARK_THRESHOLD = 0.10
+GEMINI_BENCHMARK_LOT_COUNTS = [1, 20, 200]
+GEMINI_BENCHMARK_ROUNDS = 5
+GEMINI_BENCHMARK_MIN_ROUND_TIME = 0.05
+GEMINI_BENCHMARK_CYCLES = 20
+GEMINI_BENCHMARK_SEED = 7
+
+
+def load_fixtures(fixtures_file=None, symbols=GEMINI_CRYPTO_LIST):
+    """ Tickers, symbol details and order statuses to benchmark on.
+
+    From a file recorded with GEMINI_TRANSPORT=record the last ticker and details of every symbol and the
+    recorded order statuses are used, without one they come from the mock exchange with a fixed seed.
+    """
+    tickers = {}
+    details = {}
+    statuses = []
+    if fixtures_file is not None:
+        with open(fixtures_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                if 'result' not in entry or not entry['result']:
+                    continue
+                result = entry['result'][0]
+                if entry['method'] == 'get_ticker':
+                    tickers[entry['args'][0].lower()] = result
+                elif entry['method'] == 'get_symbol_details':
+                    details[entry['args'][0].lower()] = result
+                elif entry['method'] in ('order', 'order_status', 'cancel_order'):
+                    statuses.append(result)
+    exchange = MockGeminiExchange(symbols, seed=GEMINI_BENCHMARK_SEED)
+    for symbol in symbols:
+        if symbol not in tickers:
+            tickers[symbol], _ = exchange.get_ticker(symbol)
+        if symbol not in details:
+            details[symbol], _ = exchange.get_symbol_details(symbol)
+    if not statuses:
+        # live, filled and cancelled
+        exchange.balances['usd'] = float('inf')
+        placed, _ = exchange.order(symbols[0], 1.0, "buy", price=1.0, options=["maker-or-cancel"])
+        statuses.append(placed)
+        filled, _ = exchange.order_status(placed['order_id'])
+        statuses.append(filled)
+        cancelled, _ = exchange.order(symbols[0], 1.0, "buy", price=1e9, options=["maker-or-cancel"])
+        statuses.append(cancelled)
+    return tickers, details, statuses
+
+
+def make_lots(symbol, ticker, count):
+    """ count lots laddered down from the ask, the way the buy logic leaves them. """
+    ask = float(ticker['ask'])
+    lots = []
+    for index in range(count):
+        cost = ask * 0.99 ** index
+        amount = GEMINI_PURCHASE_AMOUNTS[min(index, len(GEMINI_PURCHASE_AMOUNTS) - 1)]
+        lots.append(create_trade_details(symbol, str(index + 1), "", amount / cost, cost, amount,
+                                         str(1640995200 + index), (1640995200 + index) * 1000))
+    return LotBook(lots)
+
+
+@contextlib.contextmanager
+def benchmark_setup(tickers, details, lot_count=0):
+    """ Serves the fixtures to the trading logic, with lot_count lots per symbol, and restores it afterwards. """
+    swaps = [(gemini_helper, 'get_snapshot_quote', lambda symbol, max_age=None: tickers[symbol]),
+             (gemini_helper, 'get_symbol_details', lambda symbol: details[symbol])]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in swaps]
+    live_lots = dict(GEMINI_OUTSTANDING_TRADE_LOTS)
+    GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+    for symbol in tickers:
+        GEMINI_OUTSTANDING_TRADE_LOTS[symbol] = make_lots(symbol, tickers[symbol], lot_count)
+    try:
+        for module, name, value in swaps:
+            setattr(module, name, value)
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+        GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+        GEMINI_OUTSTANDING_TRADE_LOTS.update(live_lots)
+
+
+def bench(fn, rounds=GEMINI_BENCHMARK_ROUNDS, min_round_time=GEMINI_BENCHMARK_MIN_ROUND_TIME):
+    """ Times fn() in rounds of a calibrated number of calls, returns microseconds per call. """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_time:
+            break
+        number = number * 10 if elapsed < min_round_time / 10 else number * 2
+    timings = [elapsed / number]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    return {'us': round(min(timings) * 1e6, 3),
+            'median_us': round(statistics.median(timings) * 1e6, 3),
+            'number': number,
+            'rounds': rounds}
+
+
+def run_micro_benchmarks(tickers, details, statuses):
+    results = {}
+    symbol = GEMINI_CRYPTO_LIST[0]
+    ticker = tickers[symbol]
+    for count in GEMINI_BENCHMARK_LOT_COUNTS:
+        with benchmark_setup(tickers, details, count):
+            results['get_signals[' + str(count) + ']'] = bench(lambda: get_signals(symbol))
+            results['evaluate_break_even_and_profit[' + str(count) + ']'] = \
+                bench(lambda: evaluate_break_even_and_profit(symbol, ticker))
+            results['get_lowest_outstanding_trade[' + str(count) + ']'] = \
+                bench(lambda: get_lowest_outstanding_trade(symbol))
+
+    with benchmark_setup(tickers, details):
+        results['aggressive_ask'] = bench(lambda: aggressive_ask(symbol, ticker['ask']))
+        results['aggressive_bid'] = bench(lambda: aggressive_bid(symbol, ticker['bid']))
+        results['gemini_round'] = bench(lambda: gemini_round(symbol, 0.123456789))
+        results['get_order_execution_state'] = \
+            bench(lambda: [get_order_execution_state(status) for status in statuses])
+
+    # the lot book as the journal snapshots it: pickled, written and fsync'd
+    book = make_lots(symbol, ticker, 200)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = LotJournal(os.path.join(directory, "lots"), book_factory=LotBook)
+        journal.lots[symbol] = book
+        results['lot_store_compact[200]'] = bench(journal.compact)
+        lot = book.lowest
+        results['lot_store_insert_remove'] = bench(lambda: (journal.insert(symbol, lot), journal.remove(symbol, lot)))
+
+    with benchmark_setup(tickers, details, 20), contextlib.redirect_stdout(io.StringIO()) as output:
+        def render():
+            output.seek(0)
+            output.truncate()
+            print_state()
+        results['print_state[20]'] = bench(render)
+    return results
+
+
+def run_cycle_benchmark(details, cycles=GEMINI_BENCHMARK_CYCLES):
+    """ Blocking trading cycles of every symbol against the mock transport, timed and with calls counted.
+
+    The mock prices move on a virtual clock, one step per cycle, so the call counts repeat from run to run.
+    """
+    clock = VirtualClock()
+    exchange = MockGeminiExchange(seed=GEMINI_BENCHMARK_SEED, volatility=0.01, clock=clock.monotonic)
+    store = MemoryLotStore(book_factory=LotBook)
+    ledger = BalanceLedger(fetch_balances, float('inf'), "Benchmark")
+    swaps = [(gemini_helper, 'get_symbol_details', lambda symbol: details[symbol]),
+             (gemini_helper, 'GEMINI_ASYNC_ORDERS', False),
+             (gemini_helper, 'GEMINI_ORDER_POLL_INTERVAL', 0.0),
+             (gemini_helper, 'GEMINI_LOT_STORE', store),
+             (gemini_helper, 'GEMINI_BALANCES', ledger),
+             (gemini_market_snapshot, 'GEMINI_PRICEFEED_URL', None)]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in swaps]
+    live_lots = dict(GEMINI_OUTSTANDING_TRADE_LOTS)
+    GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+    store.lots = GEMINI_OUTSTANDING_TRADE_LOTS
+    cycle_times = []
+    try:
+        for module, name, value in swaps:
+            setattr(module, name, value)
+        with GEMINI_TRANSPORT.using(exchange), contextlib.redirect_stdout(io.StringIO()):
+            ledger.load()
+            GEMINI_TRANSPORT.reset_stats()
+            for _ in range(cycles):
+                clock.sleep(1.0)
+                started = time.perf_counter()
+                gemini_market_snapshot.refresh_market_snapshot(GEMINI_CRYPTO_LIST)
+                for symbol in GEMINI_CRYPTO_LIST:
+                    evaluate_symbol(symbol)
+                cycle_times.append(time.perf_counter() - started)
+            stats = GEMINI_TRANSPORT.stats()
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+        GEMINI_OUTSTANDING_TRADE_LOTS.clear()
+        GEMINI_OUTSTANDING_TRADE_LOTS.update(live_lots)
+    return {'cycles': cycles,
+            'cycle_ms': round(statistics.median(cycle_times) * 1000.0, 3),
+            'max_cycle_ms': round(max(cycle_times) * 1000.0, 3),
+            'api_calls': {method: count for method, (count, _, _) in sorted(stats.items())},
+            'api_calls_per_cycle': round(sum(count for count, _, _ in stats.values()) / cycles, 2)}
+
+
+def compare(results, baseline, threshold=GEMINI_BENCHMARK_THRESHOLD):
+    """ Prints the change of every benchmark against baseline, returns the names slower by more than threshold. """
+    comparison = PrettyTable()
+    comparison.field_names = ["Benchmark", "Baseline us", "Current us", "Change %", ""]
+    regressions = []
+    timings = dict(results['benchmarks'], cycle={'us': results['cycle']['cycle_ms'] * 1000.0})
+    baseline_timings = dict(baseline['benchmarks'], cycle={'us': baseline['cycle']['cycle_ms'] * 1000.0})
+    for name, timing in timings.items():
+        if name not in baseline_timings:
+            continue
+        before = baseline_timings[name]['us']
+        change = (timing['us'] - before) / before if before > 0 else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        comparison.add_row([name, round(before, 3), round(timing['us'], 3), round(change * 100.0, 1),
+                            "REGRESSION" if regressed else ""])
+    for method, count in results['cycle']['api_calls'].items():
+        before = baseline['cycle']['api_calls'].get(method, 0)
+        if count > before:
+            regressions.append("api_calls " + method)
+            comparison.add_row(["api_calls " + method, before, count, "", "MORE CALLS"])
+    print(comparison.get_string())
+    return regressions
+
+
+def print_results(results):
+    benchmark_stats = PrettyTable()
+    benchmark_stats.field_names = ["Benchmark", "us / call", "Median us", "Calls / round"]
+    for name, timing in results['benchmarks'].items():
+        benchmark_stats.add_row([name, timing['us'], timing['median_us'], timing['number']])
+    print(benchmark_stats.get_string())
+    cycle = results['cycle']
+    print("Cycle ms:", cycle['cycle_ms'], "Max cycle ms:", cycle['max_cycle_ms'],
+          "API calls / cycle:", cycle['api_calls_per_cycle'], cycle['api_calls'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the Gemini bot's hot paths offline")
+    parser.add_argument("--fixtures", help="transport recording (GEMINI_TRANSPORT=record) to take quotes from")
+    parser.add_argument("--out", default=GEMINI_BENCHMARK_FILE)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=GEMINI_BENCHMARK_THRESHOLD,
+                        help="slowdown counted as a regression, 0.10 is 10%%")
+    parser.add_argument("--cycles", type=int, default=GEMINI_BENCHMARK_CYCLES)
+    args = parser.parse_args()
+
+    fixture_tickers, fixture_details, fixture_statuses = load_fixtures(args.fixtures)
+    benchmark_results = {'python': platform.python_version(),
+                         'platform': platform.platform(),
+                         'time': time.time(),
+                         'fixtures': args.fixtures,
+                         'benchmarks': run_micro_benchmarks(fixture_tickers, fixture_details, fixture_statuses),
+                         'cycle': run_cycle_benchmark(fixture_details, args.cycles)}
+    print_results(benchmark_results)
+    with open(args.out, 'w') as f:
+        json.dump(benchmark_results, f, indent=2)
+    print("Results in", args.out)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_results = json.load(f)
+        found_regressions = compare(benchmark_results, baseline_results, args.threshold)
+        if found_regressions:
+            print("Regressions over", str(args.threshold * 100.0) + "%:", ", ".join(found_regressions))
+            sys.exit(1)
@@ -1,44 +1,80 @@
 # Gemini Trading bot
 # Author: Deepak Dasarathan
-import math
 from pprint import pformat
 
 from autolos_kabali.gemini.gemini_constants import *
-from autolos_kabali.gemini.gemini_helper import insert_recent_trade, place_and_check_order_executed_or_cancel, \
-    create_trade_details, get_signals, get_account_balance, get_tick_size, get_quote_increment,\
-    evaluate_exponential_trading_closeness_values
-from autolos_kabali.gemini.gemini_stats import print_state
+from autolos_kabali.gemini.gemini_helper import insert_recent_trade, submit_order, symbol_lock, \
+    create_trade_details, get_signals, get_account_balance, get_price_grid, get_quantity_grid, \
+    evaluate_exponential_trading_closeness_values, get_current_quote
+from autolos_kabali.gemini.gemini_stats import GEMINI_STATE_REPORTER
+from autolos_kabali.gemini.gemini_ticks import quantity_ticks
 
 
 def gemini_round(symbol, value):
-    value_f = float(value)
-    tick_size = get_tick_size(symbol)
-    if math.isclose(tick_size, 1e-8):
-        return_value = round(value_f, 8)
-    elif math.isclose(tick_size, 1e-6):
-        return_value = round(value_f, 6)
-    elif math.isclose(tick_size, 1e-5):
-        return_value = round(value_f, 5)
-    else:
-        return_value = round(value_f, 2)
-
-    return return_value
+    return get_quantity_grid(symbol).round(value)
 
 
 def aggressive_ask(symbol, ask):
-    if '.' in ask:
-        exponent, mantissa = ask.split('.')
-        quote_increment = get_quote_increment(symbol)
-        mantissa_size = int(round(1/quote_increment))
-        mantissa_max = mantissa_size - 1
-        mantissa_len = len(str(mantissa_max))
-        mantissa_int = int(mantissa)
-        if mantissa_int > 0:
-            aggressive_mantissa = int(float('0.' + mantissa) * mantissa_size) - 1
-            return exponent + '.' + str(aggressive_mantissa).zfill(mantissa_len)
-        elif mantissa_int == 0:
-            return str(int(exponent) - 1) + '.' + str(mantissa_max).zfill(mantissa_len)
-    return ask
+    prices = get_price_grid(symbol)
+    ask_ticks = prices.below(ask)
+    return None if ask_ticks is None else prices.to_string(ask_ticks)
+
+
+def place_buy_order(symbol, signal, trading_amount_dollars, on_done):
+    available_balance = get_account_balance()
+    if trading_amount_dollars > available_balance:
+        print("Buy:", symbol, "Insufficient funds, Available Balance:", available_balance,
+              "Trading Amount:", trading_amount_dollars, "Current Ask Price:", signal.ask)
+        return None
+
+    # the signal came from the cycle snapshot, price the order off a fresh ticker
+    ask = get_current_quote(symbol, 0)['ask']
+    if float(ask) > signal.buy_at:
+        print("Buy:", symbol, "Ask moved away from trigger, Snapshot Ask:", signal.ask, "Current Ask:", ask)
+        return None
+
+    prices = get_price_grid(symbol)
+    quantities = get_quantity_grid(symbol)
+    ask_ticks = prices.below(ask)
+    if ask_ticks is None:
+        # no price under the ask, a maker-or-cancel buy at or above it would not rest
+        print("Buy:", symbol, "No price under the ask to bid at, Current Ask:", ask)
+        return None
+    aggressive_ask_f = prices.to_string(ask_ticks)
+    print("Buy:", symbol, "Current Ask Price:", ask, "Aggressive ask", aggressive_ask_f)
+    order_quantity = quantity_ticks(trading_amount_dollars, ask_ticks, prices, quantities)
+    return submit_order(symbol,
+                        quantities.to_float(order_quantity),
+                        "buy",
+                        aggressive_ask_f,
+                        on_done)
+
+
+def complete_buy_order(symbol, signal, trading_amount_dollars, closeness_percentage, buy_order):
+    executed_amount = float(buy_order['executed_amount'])
+    if executed_amount > 0.0:
+        avg_execution_price = float(buy_order['avg_execution_price'])
+        dollar_amount = executed_amount * avg_execution_price
+        placed_buy_trade = create_trade_details(symbol,
+                                                buy_order['order_id'],
+                                                buy_order['client_order_id'],
+                                                executed_amount,
+                                                avg_execution_price,
+                                                dollar_amount,
+                                                buy_order['timestamp'],
+                                                buy_order['timestampms'])
+        with symbol_lock(symbol):
+            insert_recent_trade(symbol, placed_buy_trade)
+    GEMINI_STATE_REPORTER.request()
+
+    try:
+        if bool(signal.lowest_outstanding_lot):
+            print("Buy:", symbol, "Lowest lot", signal.lowest_outstanding_lot)
+            print("Buy:", symbol, "Closeness to lowest trade", signal.closeness_to_lowest_trade)
+        print("Buy:", symbol, "Trading Amount:", trading_amount_dollars, "Closeness:", closeness_percentage)
+        print("Buy:", symbol, "Order placed", pformat(buy_order))
+    except Exception as e:
+        print("Buy:", symbol, "Caught exception when printing", e)
 
 
 def buy_trade_logic(symbol):
@@ -57,40 +93,7 @@ def buy_trade_logic(symbol):
             buy = True
 
         if buy:
-            available_balance = get_account_balance()
-            if trading_amount_dollars > available_balance:
-                print("Buy:", symbol, "Insufficient funds, Available Balance:", available_balance,
-                      "Trading Amount:", trading_amount_dollars, "Current Ask Price:", signal.ask)
-                return
-
-            aggressive_ask_f = aggressive_ask(symbol, signal.ask)
-            print("Buy:", symbol, "Current Ask Price:", signal.ask, "Aggressive ask", aggressive_ask_f)
-            order_quantity = trading_amount_dollars / float(aggressive_ask_f)
-            buy_order = place_and_check_order_executed_or_cancel(symbol,
-                                                                 gemini_round(symbol, order_quantity),
-                                                                 "buy",
-                                                                 aggressive_ask_f)
-
-            executed_amount = float(buy_order['executed_amount'])
-            if executed_amount > 0.0:
-                avg_execution_price = float(buy_order['avg_execution_price'])
-                dollar_amount = executed_amount * avg_execution_price
-                placed_buy_trade = create_trade_details(symbol,
-                                                        buy_order['order_id'],
-                                                        buy_order['client_order_id'],
-                                                        executed_amount,
-                                                        avg_execution_price,
-                                                        dollar_amount,
-                                                        buy_order['timestamp'],
-                                                        buy_order['timestampms'])
-                insert_recent_trade(symbol, placed_buy_trade)
-            print_state(True)
-
-            try:
-                if bool(signal.lowest_outstanding_lot):
-                    print("Buy:", symbol, "Lowest lot", signal.lowest_outstanding_lot)
-                    print("Buy:", symbol, "Closeness to lowest trade", signal.closeness_to_lowest_trade)
-                print("Buy:", symbol, "Trading Amount:", trading_amount_dollars, "Closeness:", closeness_percentage)
-                print("Buy:", symbol, "Order placed", pformat(buy_order))
-            except Exception as e:
-                print("Buy:", symbol, "Caught exception when printing", e)
+            def on_done(buy_order):
+                complete_buy_order(symbol, signal, trading_amount_dollars, closeness_percentage, buy_order)
+
+            place_buy_order(symbol, signal, trading_amount_dollars, on_done)
@@ -0,0 +1,30 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_helper import GEMINI_TRIGGERS, get_buy_at, get_current_quote, get_high_price, \
+    has_open_order
+from autolos_kabali.gemini.gemini_metrics import GEMINI_METRICS
+from autolos_kabali.main.poll_cadence import PollCadence, trigger_distance
+
+GEMINI_CADENCE = PollCadence(GEMINI_CRYPTO_LIST, GEMINI_POLL_FAST, GEMINI_POLL_SLOW, GEMINI_POLL_BUDGET,
+                             GEMINI_POLL_BATCH)
+
+
+def quote_distance(symbol, quote):
+    """ Distance of the quote to the triggers buy_trade_logic and sell_logic_hybrid act on. """
+    triggers = GEMINI_TRIGGERS.get(symbol)
+    buy_at = get_buy_at(symbol, triggers, quote) if triggers.can_buy else None
+    return trigger_distance(float(quote['ask']), buy_at, float(quote['bid']), triggers.sell_at)
+
+
+def update_cadence(symbol):
+    """ Reschedules symbol after its evaluation, an order in flight keeps it at the fastest cadence. """
+    if has_open_order(symbol):
+        interval = GEMINI_CADENCE.update(symbol, 0.0, 0.0)
+    else:
+        quote = get_current_quote(symbol)
+        close = float(quote['close'])
+        volatility = (get_high_price(symbol, quote) - float(quote['low'])) / close if close > 0.0 else 0.0
+        interval = GEMINI_CADENCE.update(symbol, quote_distance(symbol, quote), volatility)
+    GEMINI_METRICS.set_gauge('poll_interval_seconds', interval, symbol=symbol)
@@ -0,0 +1,186 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import math
+import threading
+from collections import deque
+
+from autolos_kabali.gemini.gemini_constants import *
+
+
+class RingBuffer:
+    """ The last capacity items appended, indexed from the oldest (negative from the newest) in O(1). """
+
+    def __init__(self, capacity):
+        self.items = [None] * capacity
+        self.first = 0
+        self.count = 0
+
+    def append(self, item):
+        capacity = len(self.items)
+        if self.count < capacity:
+            self.items[(self.first + self.count) % capacity] = item
+            self.count = self.count + 1
+        else:
+            self.items[self.first] = item
+            self.first = (self.first + 1) % capacity
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index = index + self.count
+        if not 0 <= index < self.count:
+            raise IndexError("ring buffer index out of range")
+        return self.items[(self.first + index) % len(self.items)]
+
+    def __iter__(self):
+        return (self[index] for index in range(self.count))
+
+
+class WindowExtreme:
+    """ Highest (sign 1) or lowest (sign -1) value of the bars starting within span seconds of the newest bar.
+
+    A monotonic deque of (bar start, value): pushing pops every entry the new value beats, so the front is the
+    extreme and pushes are O(1) amortised. Pushing the forming bar again as it changes replaces its entry.
+    """
+
+    def __init__(self, span, sign):
+        self.span = span
+        self.sign = sign
+        self.entries = deque()
+
+    def push(self, start, value):
+        while self.entries and self.sign * self.entries[-1][1] <= self.sign * value:
+            self.entries.pop()
+        self.entries.append((start, value))
+        while self.entries[0][0] <= start - self.span:
+            self.entries.popleft()
+
+    @property
+    def value(self):
+        return self.entries[0][1] if self.entries else None
+
+
+class CandleWindow:
+    """ High, low and open of the last bars bars of a CandleSeries, kept current as bars are added. """
+
+    def __init__(self, bars, interval):
+        span = bars * interval
+        self.highs = WindowExtreme(span, 1)
+        self.lows = WindowExtreme(span, -1)
+        self.opens = deque()
+        self.span = span
+
+    def push(self, bar, new_bar):
+        start = bar[0]
+        self.highs.push(start, bar[2])
+        self.lows.push(start, bar[3])
+        if new_bar:
+            self.opens.append((start, bar[1]))
+            while self.opens[0][0] <= start - self.span:
+                self.opens.popleft()
+
+
+class CandleSeries:
+    """ OHLCV bars [start, open, high, low, close, volume] of one symbol at one interval, the last size kept. """
+
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.bars = RingBuffer(size)
+        self.windows = {}
+
+    def window(self, bars):
+        """ The CandleWindow of the last bars bars, built from the ring buffer the first time it is asked for. """
+        window = self.windows.get(bars)
+        if window is None:
+            window = self.windows[bars] = CandleWindow(bars, self.interval)
+            for bar in self.bars:
+                window.push(bar, True)
+        return window
+
+    def add_bar(self, start, open_price, high, low, close, volume):
+        last = self.bars[-1] if len(self.bars) else None
+        if last is not None and start < last[0]:
+            return
+        new_bar = last is None or start > last[0]
+        if new_bar:
+            last = [start, open_price, high, low, close, volume]
+            self.bars.append(last)
+        else:
+            last[2] = max(last[2], high)
+            last[3] = min(last[3], low)
+            last[4] = close
+            last[5] = last[5] + volume
+        for window in self.windows.values():
+            window.push(last, new_bar)
+
+    def add(self, timestamp, price, volume=0.0):
+        """ Adds a trade (or a quote's last price, with no volume) to the bar of its time. """
+        self.add_bar(math.floor(timestamp / self.interval) * self.interval, price, price, price, price, volume)
+
+
+class GeminiCandles:
+    """ Candles of every symbol at every frame of GEMINI_CANDLE_FRAMES, built in process.
+
+    The snapshot's tickers and the stream's trades are added as they arrive, so no call is made for them;
+    seed() loads a frame's history from the exchange's candle endpoint once at startup. high(), low() and
+    open() answer for a window in seconds from the finest frame whose bars cover it, in O(1), and None until
+    that frame is seeded, so callers fall back to the ticker's 24h values.
+    """
+
+    def __init__(self, symbols=GEMINI_CRYPTO_LIST, frames=GEMINI_CANDLE_FRAMES):
+        self.frames = frames
+        self.series = {symbol: {frame: CandleSeries(interval, size) for frame, (interval, size) in frames.items()}
+                       for symbol in symbols}
+        self.seeded = set()
+        self.lock = threading.Lock()
+        self.windows = {}
+
+    def frame(self, seconds):
+        """ Finest frame whose bars cover seconds, the coarsest when none does. """
+        frame = self.windows.get(seconds)
+        if frame is None:
+            frames = sorted(self.frames.items(), key=lambda item: item[1][0])
+            frame = next((name for name, (interval, size) in frames if interval * size >= seconds), frames[-1][0])
+            self.windows[seconds] = frame
+        return frame
+
+    def add(self, symbol, timestamp, price, volume=0.0):
+        series = self.series.get(symbol)
+        if series is None:
+            return
+        with self.lock:
+            for candles in series.values():
+                candles.add(timestamp, price, volume)
+
+    def seed(self, symbol, frame, candles):
+        """ candles as the exchange returns them, [time ms, open, high, low, close, volume] newest first. """
+        series = self.series[symbol][frame]
+        with self.lock:
+            for candle in sorted(candles, key=lambda candle: candle[0]):
+                time_ms, open_price, high, low, close, volume = candle[:6]
+                series.add_bar(time_ms / 1000.0, float(open_price), float(high), float(low), float(close),
+                               float(volume))
+            self.seeded.add((symbol, frame))
+
+    def read(self, symbol, seconds, value):
+        frame = self.frame(seconds)
+        if (symbol, frame) not in self.seeded:
+            return None
+        series = self.series[symbol][frame]
+        with self.lock:
+            return value(series.window(math.ceil(seconds / series.interval)))
+
+    def high(self, symbol, seconds):
+        return self.read(symbol, seconds, lambda window: window.highs.value)
+
+    def low(self, symbol, seconds):
+        return self.read(symbol, seconds, lambda window: window.lows.value)
+
+    def open(self, symbol, seconds):
+        return self.read(symbol, seconds, lambda window: window.opens[0][1] if window.opens else None)
+
+
+GEMINI_CANDLES = GeminiCandles()
@@ -1,12 +1,15 @@
 # Gemini Trading bot
 # Author: Deepak Dasarathan
 
+import json
 import os
-import pickle
-from collections import defaultdict
 
 from prettytable import PrettyTable
 
+from autolos_kabali.main.exchange_transport import MARKET, ORDER, REPORTING
+from autolos_kabali.main.lot_book import LotBook
+from autolos_kabali.main.lot_store import LOT_STORE_DB_FILE, open_lot_store
+
 # GEMINI #
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
@@ -14,6 +17,10 @@ GEMINI_SECRET_KEY = os.environ.get('GEMINI_SECRET_KEY')
 GEMINI_DRY_RUN = False
 GEMINI_VERBOSE = False
 GEMINI_MAX_RETRIES = 100
+GEMINI_ORDER_POLL_INTERVAL = 0.2
+GEMINI_ORDER_TIMEOUT = GEMINI_MAX_RETRIES * GEMINI_ORDER_POLL_INTERVAL
+GEMINI_ASYNC_ORDERS = True
+GEMINI_BALANCE_RECONCILE_INTERVAL = 5 * 60
 GEMINI_NO_OF_OUTSTANDING_TRADES = 20
 GEMINI_CRYPTO_LIST = ["btcusd",
                       "ethusd",
@@ -34,12 +41,157 @@ GEMINI_CRYPTO_LIST = ["btcusd",
                       "dogeusd",
                       "shibusd"]
 
+# gemini_supervisor splits GEMINI_CRYPTO_LIST over GEMINI_WORKERS processes by consistent hashing and starts each
+# with GEMINI_WORKER=<index>, GEMINI_SHARD=<its symbols> and GEMINI_WORKER_SHARE=<its fraction of the symbols>. A
+# worker trades only its shard, keeps its lots in the shared SQLite store, reserves USD in the cash table of
+# GEMINI_CASH_DB_FILE and takes its share of the request budgets. Its ports and files are its own. Gemini rejects
+# a nonce that is not above the last one of its API key and processes cannot order theirs, so live workers need a
+# key each: worker <index> logs in with GEMINI_API_KEY_<index> and GEMINI_SECRET_KEY_<index>.
+GEMINI_WORKER = os.environ.get('GEMINI_WORKER')
+GEMINI_WORKER_OWNER = None if GEMINI_WORKER is None else "worker" + GEMINI_WORKER + ":" + str(os.getpid())
+GEMINI_WORKER_SUFFIX = "" if GEMINI_WORKER is None else "_worker" + GEMINI_WORKER
+GEMINI_WORKER_SHARE = float(os.environ.get('GEMINI_WORKER_SHARE', 1.0))
+if os.environ.get('GEMINI_SHARD'):
+    GEMINI_CRYPTO_LIST = os.environ['GEMINI_SHARD'].split(",")
+GEMINI_WORKERS = 4
+GEMINI_HASH_REPLICAS = 64
+GEMINI_CASH_DB_FILE = LOT_STORE_DB_FILE
+GEMINI_WORKER_LOG_FILE = "gemini_worker_{}.log"
+GEMINI_WORKER_STOP_TIMEOUT = GEMINI_ORDER_TIMEOUT + 10.0
+GEMINI_SUPERVISOR_POLL_INTERVAL = 1.0
+
+# "live" calls Gemini, "record" also appends every call to GEMINI_TRANSPORT_FILE, "replay" serves the calls from
+# that file and "mock" trades against gemini_mock_exchange. Record and replay see only the robin_stocks calls, so
+# they run the blocking loop without the pricefeed, the streams or the async engine's direct ticker requests.
+GEMINI_TRANSPORT_MODE = os.environ.get('GEMINI_TRANSPORT', "live")
+GEMINI_TRANSPORT_FILE = os.environ.get('GEMINI_TRANSPORT_FILE', "transport_gemini.jsonl")
+GEMINI_REPLAY_LATENCY_SCALE = 1.0
+GEMINI_MOCK_PORT = 8767 if GEMINI_WORKER is None else 8770 + int(GEMINI_WORKER)
+GEMINI_MOCK_STARTING_CASH = 5000.0
+GEMINI_RECORDED_CALLS_ONLY = GEMINI_TRANSPORT_MODE in ("record", "replay")
+
+# Call latencies, symbol and cycle times, served as Prometheus text on GEMINI_METRICS_PORT (None to not serve) and
+# written per cycle to GEMINI_METRICS_FILE. GEMINI_METRICS=off turns every hook into a flag check.
+GEMINI_METRICS_ENABLED = os.environ.get('GEMINI_METRICS', "on") != "off"
+GEMINI_METRICS_PORT = 9108 if GEMINI_WORKER is None else 9120 + int(GEMINI_WORKER)
+GEMINI_METRICS_FILE = "metrics_gemini" + GEMINI_WORKER_SUFFIX + ".jsonl"
+
+# Request budgets after Gemini's limits, 120 requests a minute on the public endpoints and 600 (5 a second
+# recommended) on the private ones. Market data leaves headroom tokens for orders and reporting for market data,
+# reads already in flight with the same arguments are shared. Replay has no limits to keep to. The limits are per
+# account, a supervised worker gets GEMINI_WORKER_SHARE of each.
+GEMINI_REQUEST_SCHEDULER = GEMINI_TRANSPORT_MODE != "replay"
+GEMINI_RATE_LIMITS = {bucket: (rate * GEMINI_WORKER_SHARE, max(round(burst * GEMINI_WORKER_SHARE), 1))
+                      for bucket, (rate, burst) in {'public': (2.0, 5), 'private': (5.0, 10)}.items()}
+GEMINI_REQUEST_ROUTES = {'order': ('private', ORDER),
+                         'cancel_order': ('private', ORDER),
+                         'order_status': ('private', ORDER),
+                         'check_available_balances': ('private', MARKET),
+                         'get_ticker': ('public', MARKET),
+                         'get_symbol_details': ('public', MARKET),
+                         'pricefeed': ('public', MARKET),
+                         'candles': ('public', MARKET)}
+GEMINI_REQUEST_HEADROOM = {MARKET: 2, REPORTING: 3}
+GEMINI_SHARED_REQUESTS = ['order_status', 'check_available_balances', 'get_ticker', 'get_symbol_details']
+
+GEMINI_REST_URL = "http://localhost:" + str(GEMINI_MOCK_PORT) if GEMINI_TRANSPORT_MODE == "mock" else \
+    "https://api.gemini.com"
+GEMINI_PRICEFEED_URL = None if GEMINI_RECORDED_CALLS_ONLY else GEMINI_REST_URL + "/v1/pricefeed"
+GEMINI_TICKER_URL = GEMINI_REST_URL + "/v2/ticker/"
+GEMINI_PRICEFEED_TIMEOUT = 5.0
+GEMINI_SNAPSHOT_MAX_AGE = 5.0
+GEMINI_SNAPSHOT_BATCH_SIZE = 6
+
+# Candles built in process from the tickers and streamed trades, {frame: (seconds, bars kept)}, seeded from
+# GEMINI_CANDLES_URL at startup. The dip trigger measures from the high of the last GEMINI_DIP_WINDOW seconds,
+# GEMINI_DIP_WINDOWS overrides it per symbol, e.g. {"dogeusd": 4 * 60 * 60}.
+GEMINI_CANDLES_ENABLED = not GEMINI_RECORDED_CALLS_ONLY
+GEMINI_CANDLES_URL = GEMINI_REST_URL + "/v2/candles/"
+GEMINI_CANDLE_FRAMES = {'1m': (60, 360), '5m': (5 * 60, 288), '1hr': (60 * 60, 168)}
+GEMINI_DIP_WINDOW = 24 * 60 * 60
+GEMINI_DIP_WINDOWS = {}
+
+# Keep-alive connections per host for the exchange, market data and Notion traffic, opened before the first cycle.
+# HTTP/2 applies to the market data and Notion clients (robin_stocks is on requests) and needs the h2 package.
+GEMINI_HTTP2 = os.environ.get('GEMINI_HTTP2', "off") == "on"
+GEMINI_HTTP_POOL_SIZE = 20
+GEMINI_HTTP_PREWARM = GEMINI_TRANSPORT_MODE in ("live", "record")
+GEMINI_NOTION_URL = "https://api.notion.com/v1/"
+
+# Symbols far from their buy and sell triggers, relative to their 24h range, are evaluated less often, between
+# every GEMINI_POLL_FAST and GEMINI_POLL_SLOW seconds and at most GEMINI_POLL_BUDGET evaluations a second in all.
+# Record and replay evaluate every symbol every cycle, the recorded calls depend on it.
+GEMINI_POLL_CADENCE = os.environ.get('GEMINI_POLL_CADENCE', "on") != "off" and not GEMINI_RECORDED_CALLS_ONLY
+GEMINI_POLL_FAST = 5.0
+GEMINI_POLL_SLOW = 120.0
+GEMINI_POLL_BUDGET = 1.0 * GEMINI_WORKER_SHARE
+GEMINI_POLL_BATCH = 2.0
+
+# Buy and sell trigger prices are kept per symbol and recomputed only when its lot book changes. A symbol whose
+# quote has not crossed one is not evaluated, and a streamed quote only queues the symbol when it has.
+GEMINI_TRIGGER_INDEX = os.environ.get('GEMINI_TRIGGER_INDEX', "on") != "off"
+
+GEMINI_ASYNC_ENGINE = not GEMINI_RECORDED_CALLS_ONLY
+GEMINI_ENGINE_CONCURRENCY = 6
+GEMINI_SYMBOL_ERROR_BACKOFF = 10.0
+# robin_stocks signs these in the headers of its one session, the worker threads make them one at a time
+GEMINI_SIGNED_CALLS = ['order', 'cancel_order', 'order_status', 'check_available_balances']
+
+GEMINI_MARKET_STREAM = GEMINI_TRANSPORT_MODE == "live"
+GEMINI_MARKET_DATA_URL = os.environ.get('GEMINI_MARKET_DATA_URL', "wss://api.gemini.com/v2/marketdata")
+GEMINI_STREAM_RECORD_FILE = os.environ.get('GEMINI_STREAM_RECORD_FILE')
+GEMINI_STREAM_RECONNECT_DELAY = 1.0
+GEMINI_STREAM_MAX_RECONNECT_DELAY = 30.0
+GEMINI_STREAM_IDLE_CYCLE = 5.0
+GEMINI_STREAM_TICKER_REFRESH = 60.0
+GEMINI_STREAM_PRINT_INTERVAL = 60.0
+
+GEMINI_ORDER_EVENTS = GEMINI_TRANSPORT_MODE == "live"
+GEMINI_ORDER_EVENTS_URL = os.environ.get('GEMINI_ORDER_EVENTS_URL', "wss://api.gemini.com/v1/order/events")
+GEMINI_ORDER_EVENTS_RECORD_FILE = os.environ.get('GEMINI_ORDER_EVENTS_RECORD_FILE')
+
+GEMINI_BACKTEST_STARTING_CASH = 5000.0
+GEMINI_BACKTEST_MAKER_FEE_BPS = 20.0
+GEMINI_BACKTEST_SPREAD_TICKS = 1
+# Share of an order filled when the next candle only touches its price, and of the candle volume it may take
+GEMINI_BACKTEST_PARTIAL_FILL_RATIO = 0.5
+GEMINI_BACKTEST_PARTICIPATION = 0.1
+# Increments of the symbols as Gemini lists them, for backtests without a symbol details file. The file's entries
+# win, a symbol in neither is refused rather than priced on a grid that is not its own.
+GEMINI_BACKTEST_SYMBOL_DETAILS = {
+    symbol: {"tick_size": tick_size, "quote_increment": quote_increment, "min_order_size": min_order_size}
+    for symbol, (tick_size, quote_increment, min_order_size) in {"btcusd": (1e-8, 0.01, "0.00001"),
+                                                                "ethusd": (1e-6, 0.01, "0.001"),
+                                                                "bchusd": (1e-6, 0.01, "0.001"),
+                                                                "ltcusd": (1e-5, 0.01, "0.01"),
+                                                                "lunausd": (1e-6, 0.001, "0.1"),
+                                                                "solusd": (1e-6, 0.001, "0.01"),
+                                                                "axsusd": (1e-6, 0.01, "0.003"),
+                                                                "linkusd": (1e-6, 0.00001, "0.1"),
+                                                                "uniusd": (1e-6, 0.0001, "0.01"),
+                                                                "sushiusd": (1e-6, 0.0001, "0.01"),
+                                                                "sandusd": (1e-6, 0.00001, "0.1"),
+                                                                "manausd": (1e-6, 0.00001, "1"),
+                                                                "ftmusd": (1e-6, 0.0001, "0.03"),
+                                                                "maticusd": (1e-6, 0.00001, "0.1"),
+                                                                "batusd": (1e-6, 0.00001, "1"),
+                                                                "grtusd": (1e-6, 0.0001, "0.1"),
+                                                                "dogeusd": (1e-6, 0.00001, "0.1"),
+                                                                "shibusd": (1e-6, 1e-9, "1000")}.items()}
+# The mock exchange starts every symbol at the same price, one set of increments suits them all
+GEMINI_MOCK_SYMBOL_DETAILS = {"tick_size": 1e-8, "quote_increment": 0.01, "min_order_size": "0.00001"}
+
+GEMINI_SYMBOL_DETAILS_FILE = "symbol_details_gemini" + GEMINI_WORKER_SUFFIX
+GEMINI_SYMBOL_DETAILS_TTL = 6 * 60 * 60
+
 GEMINI_OUTSTANDING_TRADE_LOTS_FILE = "outstanding_lots_gemini"
 
-if os.path.exists(GEMINI_OUTSTANDING_TRADE_LOTS_FILE):
-    GEMINI_OUTSTANDING_TRADE_LOTS = pickle.load(open(GEMINI_OUTSTANDING_TRADE_LOTS_FILE, 'rb'))
-else:
-    GEMINI_OUTSTANDING_TRADE_LOTS = defaultdict(list)
+# "journal" appends to GEMINI_OUTSTANDING_TRADE_LOTS_FILE.journal, "sqlite" shares lots.db with the Robinhood bot
+# and, always for supervised workers, between the workers
+GEMINI_LOT_STORE_BACKEND = "journal" if GEMINI_WORKER is None else "sqlite"
+GEMINI_LOT_STORE = open_lot_store(GEMINI_LOT_STORE_BACKEND, GEMINI_OUTSTANDING_TRADE_LOTS_FILE, "gemini",
+                                  book_factory=LotBook)
+GEMINI_OUTSTANDING_TRADE_LOTS = GEMINI_LOT_STORE.load()
 
 GEMINI_PERCENTAGES = [1.0,
                       1.0,
@@ -74,6 +226,15 @@ GEMINI_PURCHASE_AMOUNTS = [5.0,
                            150.0,
                            200.0]
 
+# A ladder file written by gemini_sweep replaces the three ladders above
+GEMINI_LADDER_FILE = os.environ.get('GEMINI_LADDER_FILE')
+if GEMINI_LADDER_FILE is not None:
+    with open(GEMINI_LADDER_FILE) as f:
+        _ladder = json.load(f)
+    GEMINI_PERCENTAGES = _ladder['GEMINI_PERCENTAGES']
+    GEMINI_SELL_PERCENTAGES = _ladder['GEMINI_SELL_PERCENTAGES']
+    GEMINI_PURCHASE_AMOUNTS = _ladder['GEMINI_PURCHASE_AMOUNTS']
+
 GEMINI_LOT_STATS = PrettyTable()
 GEMINI_LOT_STATS.field_names = ["Coin",
                                 "Amount",
@@ -3,14 +3,50 @@
 
 import math
 import sys
+import threading
 import time
+from collections import defaultdict
 from enum import Enum
 from pprint import pprint, pformat
 
-from robin_stocks import gemini as g
+from robin_stocks import gemini as robin_gemini
 
+from autolos_kabali.gemini.gemini_candles import GEMINI_CANDLES
 from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_market_snapshot import get_snapshot_quote
 from autolos_kabali.gemini.gemini_signals import GeminiSignals
+from autolos_kabali.gemini.gemini_symbol_details import get_symbol_details
+from autolos_kabali.gemini.gemini_ticks import tick_grid
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT as g
+from autolos_kabali.gemini.gemini_trigger_index import GeminiTriggerIndex, GeminiTriggers
+from autolos_kabali.main.balance_ledger import BalanceLedger, SqliteCash
+from autolos_kabali.main.order_tracker import OrderTracker
+
+
+# Held while a symbol's lot book is read and changed, the engine evaluates symbols concurrently
+GEMINI_SYMBOL_LOCKS = defaultdict(threading.RLock)
+# Held around every signed call, robin_stocks writes the signature into its one session's headers and then posts
+GEMINI_SIGNED_LOCK = threading.Lock()
+
+
+def symbol_lock(symbol):
+    return GEMINI_SYMBOL_LOCKS[symbol]
+
+
+def signed_call(call):
+    def locked(*args, **kwargs):
+        with GEMINI_SIGNED_LOCK:
+            return call(*args, **kwargs)
+    return locked
+
+
+# Wrapped on robin_stocks.gemini itself, so the live and recording backends of g make these one at a time
+for signed in GEMINI_SIGNED_CALLS:
+    setattr(robin_gemini, signed, signed_call(getattr(robin_gemini, signed)))
+
+
+# Set when a supervised worker is stopping, no symbol is evaluated after that
+GEMINI_STOPPING = threading.Event()
 
 
 class OrderState(Enum):
@@ -22,29 +58,24 @@ class OrderState(Enum):
 
 
 def get_lowest_outstanding_trade(symbol):
-    outstanding_lots = GEMINI_OUTSTANDING_TRADE_LOTS[symbol]
-    lowest_outstanding_lot = {}
-    lowest_cost = float(sys.maxsize)
-    for lot in outstanding_lots:
-        if lot['cost'] < lowest_cost:
-            lowest_cost = lot['cost']
-            lowest_outstanding_lot = lot
-    return lowest_outstanding_lot
+    return GEMINI_OUTSTANDING_TRADE_LOTS[symbol].lowest
 
 
 def insert_recent_trade(symbol, trade_details):
-    GEMINI_OUTSTANDING_TRADE_LOTS[symbol].append(trade_details)
-    pickle.dump(GEMINI_OUTSTANDING_TRADE_LOTS, open(GEMINI_OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
+    GEMINI_LOT_STORE.insert(symbol, trade_details)
 
 
-def remove_recent_trade(symbol, trade_details):
-    GEMINI_OUTSTANDING_TRADE_LOTS[symbol].remove(trade_details)
-    pickle.dump(GEMINI_OUTSTANDING_TRADE_LOTS, open(GEMINI_OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
+def remove_recent_trade(symbol, trade_details, close_price=None):
+    GEMINI_LOT_STORE.remove(symbol, trade_details, close_price)
 
 
-def remove_coin(symbol):
-    del GEMINI_OUTSTANDING_TRADE_LOTS[symbol]
-    pickle.dump(GEMINI_OUTSTANDING_TRADE_LOTS, open(GEMINI_OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
+def remove_coin(symbol, close_price=None):
+    GEMINI_LOT_STORE.remove_coin(symbol, close_price)
+
+
+def close_trade(symbol, trade_details, remaining_trade=None, close_price=None):
+    # trade_details None closes every lot of the symbol, the unsold remainder is booked in the same update
+    GEMINI_LOT_STORE.partial_fill(symbol, trade_details, remaining_trade, close_price)
 
 
 def create_trade_details(symbol, order_id, client_order_id, quantity, cost, amount, created, created_ms):
@@ -75,8 +106,7 @@ def percentage_break_even(a, b):
 
 
 def evaluate_exponential_trading_closeness_values(symbol):
-    outstanding_lots = GEMINI_OUTSTANDING_TRADE_LOTS[symbol]
-    index = len(outstanding_lots)
+    index = GEMINI_OUTSTANDING_TRADE_LOTS[symbol].ladder_index
     if index < len(GEMINI_PURCHASE_AMOUNTS):
         trading_amount = GEMINI_PURCHASE_AMOUNTS[index]
         closeness_percentage = GEMINI_PERCENTAGES[index]
@@ -95,39 +125,68 @@ def get_sell_volatility_percentage_latest(symbol):
         return GEMINI_SELL_PERCENTAGES[-1]
 
 
-def get_account_balance():
-    balance = 0.0
-    positions, _ = g.check_notional_balances(True)
+def fetch_balances():
+    """  Gets a list of all available balances in every currency.
+    :Dictionary Keys: * currency - The currency code.
+                      * amount - The current balance
+                      * available - The amount that is available to trade
+                      * availableForWithdrawal - The amount that is available to withdraw
+                      * type - "exchange"
+   """
+    positions, _ = g.check_available_balances(True)
+    balances = {}
     for position in positions:
-        currency = position['currency'].lower()
-        if currency == 'usd':
-            amount = float(position['amount'])
-            available = float(position['available'])
-            if math.isclose(amount, available):
-                balance = amount
-            else:
-                print("Account balance mismatch", amount, available)
-                balance = available
-    return balance
+        amount = float(position['amount'])
+        available = float(position['available'])
+        if not math.isclose(amount, available):
+            # resting orders (ours from before a restart, or manual ones) hold the rest
+            print("Account balance mismatch", position['currency'], amount, available)
+        balances[position['currency']] = available
+    return balances
+
+
+# Supervised workers spend one USD balance, reserved through the shared cash table
+GEMINI_BALANCES = BalanceLedger(fetch_balances, GEMINI_BALANCE_RECONCILE_INTERVAL, "Gemini",
+                                None if GEMINI_WORKER is None else SqliteCash(GEMINI_CASH_DB_FILE, "gemini",
+                                                                              GEMINI_WORKER_OWNER))
+
+
+def refresh_balances():
+    GEMINI_BALANCES.reconcile()
+
+
+def get_base_currency(symbol):
+    # every traded symbol is quoted in usd
+    return symbol[:-len('usd')]
+
+
+def get_account_balance():
+    return GEMINI_BALANCES.available('usd')
 
 
 def get_min_quantity(symbol):
-    symbol_details, _ = g.get_symbol_details(symbol, True)
-    return float(symbol_details['min_order_size'])
+    return float(get_symbol_details(symbol)['min_order_size'])
 
 
 def get_tick_size(symbol):
-    symbol_details, _ = g.get_symbol_details(symbol, True)
-    return symbol_details['tick_size']
+    return get_symbol_details(symbol)['tick_size']
 
 
 def get_quote_increment(symbol):
-    symbol_details, _ = g.get_symbol_details(symbol, True)
-    return symbol_details['quote_increment']
+    return get_symbol_details(symbol)['quote_increment']
+
 
+def get_price_grid(symbol):
+    return tick_grid(get_symbol_details(symbol)['quote_increment'])
 
-def get_current_quote(symbol):
-    """ Gets the recent trading information for a crypto.
+
+def get_quantity_grid(symbol):
+    return tick_grid(get_symbol_details(symbol)['tick_size'])
+
+
+def get_current_quote(symbol, max_age=GEMINI_SNAPSHOT_MAX_AGE):
+    """ Gets the recent trading information for a crypto from the cycle snapshot.
+        Pass max_age=0 to force a fresh ticker, e.g. when pricing an order.
     :Dictionary Keys: * symbol - BTCUSD etc.
                       * open - Open price from 24 hours ago
                       * high - High price from 24 hours ago
@@ -137,48 +196,80 @@ def get_current_quote(symbol):
                       * bid - Current best bid
                       * ask - Current best offer
     """
-    quote, _ = g.get_ticker(symbol, True)
-    return quote
+    return get_snapshot_quote(symbol, max_age)
 
 
-def get_high_price(symbol):
-    current_quote = get_current_quote(symbol)
+def get_high_price(symbol, current_quote=None):
+    """ High of the symbol's dip window from the candles, the ticker's 24h high until they are seeded. """
+    high_price = GEMINI_CANDLES.high(symbol, GEMINI_DIP_WINDOWS.get(symbol, GEMINI_DIP_WINDOW))
+    if high_price is not None:
+        return high_price
+    if current_quote is None:
+        current_quote = get_current_quote(symbol)
     high_price = float(current_quote['high'])
     return high_price
 
 
 def get_quantity(symbol):
-    """  Gets a list of all available balances in every currency.
-    :Dictionary Keys: * currency - The currency code.
-                      * amount - The current balance
-                      * available - The amount that is available to trade
-                      * availableForWithdrawal - The amount that is available to withdraw
-                      * type - "exchange"
-   """
-    quantity = None
-    positions, _ = g.check_available_balances(True)
-    for position in positions:
-        currency = position['currency'].lower()
-        if currency in symbol and currency != 'usd':
-            amount = float(position['amount'])
-            available = float(position['available'])
-            if math.isclose(amount, available):
-                quantity = amount
-            else:
-                print("Sell:", symbol, "All quantity not available to trade", amount, available)
+    quantity = GEMINI_BALANCES.available(get_base_currency(symbol), None)
     if GEMINI_VERBOSE:
         print("Sell:", symbol, "Found symbol, quantity", quantity)
         print()
     return quantity
 
 
+def trigger_prices(symbol, book):
+    """ The GeminiTriggers of the symbol's lot book, see GEMINI_TRIGGERS. """
+    trading_amount, closeness_percentage = evaluate_exponential_trading_closeness_values(symbol)
+    lowest = book.lowest
+    buy_cost = float(lowest['cost']) if lowest else None
+    can_buy = not lowest or len(book) < GEMINI_NO_OF_OUTSTANDING_TRADES
+    sell_at = None
+    sell_at_total = 0.0
+    sell_at_recent_trade = 0.0
+    if len(book) > 0:
+        volatility_percentage = get_sell_volatility_percentage_latest(symbol)
+        sell_at_total = book.avg_cost * (1.0 + volatility_percentage / 100.0)
+        sell_at_recent_trade = float(lowest['cost']) * (1.0 + volatility_percentage / 100.0)
+        sell_at = sell_at_total if len(book) <= 6 else sell_at_recent_trade
+    return GeminiTriggers(buy_cost, 1.0 - closeness_percentage / 100.0, can_buy, trading_amount, sell_at,
+                          sell_at_total, sell_at_recent_trade)
+
+
+GEMINI_TRIGGERS = GeminiTriggerIndex(trigger_prices, GEMINI_OUTSTANDING_TRADE_LOTS)
+
+
+def get_buy_at(symbol, triggers, quote):
+    buy_cost = triggers.buy_cost if triggers.buy_cost is not None else get_high_price(symbol, quote)
+    return buy_cost * triggers.buy_factor
+
+
+def trigger_crossed(symbol, quote=None):
+    """ Whether the quote reached a price the buy or sell logic acts on, or the sell logic has lots to clean up.
+    False means evaluating the symbol would not trade, so it can be skipped.
+    """
+    if quote is None:
+        quote = get_current_quote(symbol)
+    triggers = GEMINI_TRIGGERS.get(symbol)
+    if triggers.can_buy and float(quote['ask']) <= get_buy_at(symbol, triggers, quote):
+        return True
+    if triggers.sell_at is None:
+        return False
+    if float(quote['bid']) >= triggers.sell_at:
+        return True
+    # sell_trade_logic removes the lots of a coin no longer held
+    quantity = get_quantity(symbol) if len(GEMINI_OUTSTANDING_TRADE_LOTS[symbol]) <= 6 else None
+    return isinstance(quantity, float) and math.isclose(quantity, 0.0)
+
+
 def get_signals(symbol):
-    high_price = get_high_price(symbol)
     quote = get_current_quote(symbol)
+    high_price = get_high_price(symbol, quote)
     ask_price = quote['ask']
     bid_price = quote['bid']
     percentage_dip = percentage_dip_expr(high_price, ask_price)
     lowest_outstanding_lot = get_lowest_outstanding_trade(symbol)
+    triggers = GEMINI_TRIGGERS.get(symbol)
 
     closeness_to_lowest_trade = 0.0
     percentage_up = 0.0
@@ -187,26 +278,16 @@ def get_signals(symbol):
     total_cost = 0.0
     total_quantity = 0.0
     break_even = 0.0
-    sell_at_recent_trade = 0.0
 
     if len(GEMINI_OUTSTANDING_TRADE_LOTS[symbol]) > 0:
         total_amount, total_cost, total_quantity, break_even = evaluate_break_even_and_profit(symbol, quote)
         percentage_up = percentage_break_even(total_cost, bid_price)
         percentage_up_from_last_trade = percentage_break_even(lowest_outstanding_lot['cost'], bid_price)
 
-    volatility_percentage = get_sell_volatility_percentage_latest(symbol)
-    sell_at = total_cost * (1.0 + volatility_percentage / 100.0)
-
     if bool(lowest_outstanding_lot):
         closeness_to_lowest_trade = percentage_dip_expr(lowest_outstanding_lot['cost'], ask_price)
-        sell_at_recent_trade = float(lowest_outstanding_lot['cost']) * (1.0 + volatility_percentage / 100.0)
 
-    trading_amount_dollars, closeness_percentage = evaluate_exponential_trading_closeness_values(symbol)
-
-    if bool(lowest_outstanding_lot):
-        buy_at = lowest_outstanding_lot['cost'] * (1.0 - closeness_percentage / 100.0)
-    else:
-        buy_at = high_price * (1.0 - closeness_percentage / 100.0)
+    buy_at = get_buy_at(symbol, triggers, quote)
 
     signal = GeminiSignals(symbol,
                            ask_price,
@@ -223,23 +304,18 @@ def get_signals(symbol):
                            total_cost,
                            total_quantity,
                            break_even,
-                           sell_at,
-                           sell_at_recent_trade,
+                           triggers.sell_at_total,
+                           triggers.sell_at_recent_trade,
                            buy_at,
                            lowest_outstanding_lot)
     return signal
 
 
 def evaluate_break_even_and_profit(symbol, current_quote):
-    outstanding_lots = GEMINI_OUTSTANDING_TRADE_LOTS[symbol]
-    total_amount = 0.0
-    total_quantity = 0.0
-    total_cost = 0.0
-    for lot in outstanding_lots:
-        total_amount = total_amount + lot['amount']
-        total_quantity = total_quantity + lot['quantity']
-    if total_quantity > 0.0:
-        total_cost = total_amount / total_quantity
+    lot_book = GEMINI_OUTSTANDING_TRADE_LOTS[symbol]
+    total_amount = lot_book.total_amount
+    total_quantity = lot_book.total_quantity
+    total_cost = lot_book.avg_cost
     current_bid_price = float(current_quote['bid'])
     break_even = percentage_break_even(current_bid_price, total_cost)
     return total_amount, total_cost, total_quantity, break_even
@@ -273,20 +349,37 @@ def get_order_execution_state(order_status):
         return OrderState.UNKNOWN
 
 
-def place_and_check_order_executed_or_cancel(symbol, quantity, side, price):
-    filled = False
-    canceled = False
-    order_in_placed_counter = 0
-
+def order_quantity(symbol, quantity, side):
+    # a buy below the exchange's minimum is raised to it, the cash reserved for it has to cover that
     min_quantity = get_min_quantity(symbol)
     if side == "buy" and quantity < min_quantity:
-        quantity = min_quantity
+        return min_quantity
+    return quantity
+
+
+def place_order(symbol, quantity, side, price):
+    min_quantity = get_min_quantity(symbol)
     if side == "sell" and quantity < min_quantity:
         print(side + ":", symbol, "Not sufficient quantity to sell", quantity, "needed", min_quantity)
         return None
 
     # Place an order
-    order_status, _ = g.order(symbol, quantity, side, price=price, options=["maker-or-cancel"], jsonify=True)
+    order_status, error = g.order(symbol, quantity, side, price=price, options=["maker-or-cancel"], jsonify=True)
+    if not isinstance(order_status, dict) or 'order_id' not in order_status:
+        # an HTTP error comes back as the error JSON ({'result': 'error', ...}), the order was not placed
+        print(side + ":", symbol, "Order not placed", error, pformat(order_status))
+        return None
+    return order_status
+
+
+def place_and_check_order_executed_or_cancel(symbol, quantity, side, price):
+    filled = False
+    canceled = False
+    order_in_placed_counter = 0
+
+    order_status = place_order(symbol, quantity, side, price)
+    if order_status is None:
+        return None
     order_id = order_status['order_id']
 
     while not filled and not canceled:
@@ -296,7 +389,7 @@ def place_and_check_order_executed_or_cancel(symbol, quantity, side, price):
             # do nothing, wait (cancel after a while)
             order_in_placed_counter = order_in_placed_counter + 1
             if order_in_placed_counter % GEMINI_MAX_RETRIES == 0:
-                print(side + ":", symbol, "Current quote", get_current_quote(symbol))
+                print(side + ":", symbol, "Current quote", get_current_quote(symbol, 0))
                 print(side + ":", symbol, GEMINI_MAX_RETRIES,
                       "attempts passed and the limit buy order still did not execute. Canceling!")
                 print(side + ":", symbol, "Order has Placed status", order_state, pformat(order_status))
@@ -315,9 +408,89 @@ def place_and_check_order_executed_or_cancel(symbol, quantity, side, price):
             print("Order has unknown status", order_state, order_status, symbol)
             sys.exit(-1)
 
-        time.sleep(0.2)
+        time.sleep(GEMINI_ORDER_POLL_INTERVAL)
 
         # refresh the order status
         order_status, _ = g.order_status(order_id, jsonify=True)
 
     return order_status
+
+
+# The tracker calls these from its thread while the strategy places orders, the calls are in GEMINI_SIGNED_CALLS so
+# GEMINI_SIGNED_LOCK makes them one at a time with the strategy's
+def refresh_order_status(order_id):
+    order_status, _ = g.order_status(order_id, jsonify=True)
+    return order_status
+
+
+def cancel_order(order_id):
+    order_status, _ = g.cancel_order(order_id, jsonify=True)
+    print("Attempted to cancel order", pformat(order_status))
+    return order_status
+
+
+GEMINI_ORDER_TRACKER = OrderTracker(get_order_execution_state,
+                                    [OrderState.FILLED, OrderState.CANCELLED],
+                                    GEMINI_ORDER_POLL_INTERVAL,
+                                    "Gemini")
+
+
+def has_open_order(symbol):
+    return GEMINI_ORDER_TRACKER.has_open_order(symbol)
+
+
+def reserve_order_balance(symbol, quantity, side, price):
+    if side == "buy":
+        return GEMINI_BALANCES.reserve('usd', float(quantity) * float(price))
+    return GEMINI_BALANCES.reserve(get_base_currency(symbol), float(quantity))
+
+
+def settle_order_balance(reservation, symbol, side, order_status):
+    executed_amount = float(order_status['executed_amount'])
+    executed_dollars = executed_amount * float(order_status['avg_execution_price'])
+    if side == "buy":
+        changes = {'usd': -executed_dollars, get_base_currency(symbol): executed_amount}
+    else:
+        changes = {'usd': executed_dollars, get_base_currency(symbol): -executed_amount}
+    GEMINI_BALANCES.settle(reservation, changes)
+
+
+def submit_order(symbol, quantity, side, price, on_done):
+    """ Places a maker-or-cancel order and hands its final status to on_done.
+        The cash (or coin) of the order is reserved in GEMINI_BALANCES until it completes, so concurrent orders
+        cannot spend the same balance, and the fill is booked locally before on_done runs.
+        With GEMINI_ASYNC_ORDERS the order rests in GEMINI_ORDER_TRACKER and on_done runs on its thread,
+        otherwise this blocks until the order is filled or cancelled.
+    """
+    quantity = order_quantity(symbol, quantity, side)
+    reservation = reserve_order_balance(symbol, quantity, side, price)
+    if reservation is None:
+        print(side + ":", symbol, "Insufficient balance for", quantity, "@", price)
+        return None
+
+    def on_order_done(order_status):
+        settle_order_balance(reservation, symbol, side, order_status)
+        on_done(order_status)
+
+    try:
+        if not GEMINI_ASYNC_ORDERS:
+            order_status = place_and_check_order_executed_or_cancel(symbol, quantity, side, price)
+        else:
+            order_status = place_order(symbol, quantity, side, price)
+    except Exception:
+        GEMINI_BALANCES.release(reservation)
+        raise
+
+    if order_status is None:
+        GEMINI_BALANCES.release(reservation)
+    elif not GEMINI_ASYNC_ORDERS:
+        on_order_done(order_status)
+    else:
+        GEMINI_ORDER_TRACKER.track(order_status['order_id'],
+                                   order_status,
+                                   symbol,
+                                   refresh_order_status,
+                                   cancel_order,
+                                   on_order_done,
+                                   GEMINI_ORDER_TIMEOUT)
+    return order_status
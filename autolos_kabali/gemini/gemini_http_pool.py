@@ -0,0 +1,25 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+from robin_stocks.gemini.globals import SESSION as ROBIN_GEMINI_SESSION
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.main.http_pool import HttpPool, origin
+
+# Market data and Notion clients, one per host, and the adapters on robin_stocks' session
+GEMINI_HTTP_POOL = HttpPool(GEMINI_HTTP2, GEMINI_HTTP_POOL_SIZE, name="Gemini HTTP")
+
+
+def init_http_pool(prewarm=GEMINI_HTTP_PREWARM):
+    """ Pools robin_stocks' Gemini connections and opens the exchange, market data and Notion connections. """
+    GEMINI_HTTP_POOL.mount(ROBIN_GEMINI_SESSION)
+    if not prewarm:
+        return GEMINI_HTTP_POOL
+    GEMINI_HTTP_POOL.prewarm([GEMINI_REST_URL + "/v1/symbols"], ROBIN_GEMINI_SESSION)
+    # the async engine opens its own market data connections
+    urls = [GEMINI_PRICEFEED_URL] if GEMINI_PRICEFEED_URL is not None and not GEMINI_ASYNC_ENGINE else []
+    # the Notion client only exists with a Notion API key
+    if origin(GEMINI_NOTION_URL) in GEMINI_HTTP_POOL.clients:
+        urls.append(GEMINI_NOTION_URL)
+    GEMINI_HTTP_POOL.prewarm(urls)
+    return GEMINI_HTTP_POOL
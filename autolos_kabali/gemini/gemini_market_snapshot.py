@@ -0,0 +1,181 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from autolos_kabali.gemini.gemini_candles import GEMINI_CANDLES
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_http_pool import GEMINI_HTTP_POOL
+from autolos_kabali.gemini.gemini_metrics import GEMINI_METRICS
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT as g
+
+# symbol -> (monotonic time fetched, ticker)
+_SNAPSHOT = {}
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def http_get(url, method, **kwargs):
+    """ GET of a public endpoint on its host's pooled connection, timed for the metrics like the transport calls. """
+    if g.scheduler is not None:
+        g.scheduler.acquire(method)
+    started = time.perf_counter()
+    error = None
+    try:
+        response = GEMINI_HTTP_POOL.client(url).get(url, **kwargs)
+        response.raise_for_status()
+        return response
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        GEMINI_METRICS.observe_call("Gemini", method, time.perf_counter() - started, error)
+
+
+def fetch_pricefeed():
+    """ Gets the last traded price of every pair in a single request.
+    :Dictionary Keys: * pair - BTCUSD etc.
+                      * price - Last traded price
+                      * percentChange24h - Change over the past 24 hours
+    """
+    if GEMINI_PRICEFEED_URL is None:
+        return {}
+    try:
+        response = http_get(GEMINI_PRICEFEED_URL, 'pricefeed', timeout=GEMINI_PRICEFEED_TIMEOUT)
+        return {entry['pair'].lower(): float(entry['price']) for entry in response.json()}
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        print("Snapshot: pricefeed unavailable, falling back to tickers", e)
+        return {}
+
+
+def fetch_ticker(symbol):
+    try:
+        quote, _ = g.get_ticker(symbol, True)
+    except Exception as e:
+        print("Snapshot:", symbol, "Ticker refresh failed", e)
+        return symbol, None
+    return symbol, quote
+
+
+def store_quote(symbol, quote):
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT[symbol] = (time.monotonic(), quote)
+    GEMINI_CANDLES.add(symbol, time.time(), float(quote['close']))
+
+
+def merge_quote(symbol, **fields):
+    """ Merges streamed fields (bid, ask, close) into the cached ticker, keeping its 24h high/low/open. """
+    with _SNAPSHOT_LOCK:
+        entry = _SNAPSHOT.get(symbol)
+        if entry is None:
+            return None
+        quote = dict(entry[1])
+        quote.update(fields)
+        if 'close' in fields:
+            close = float(fields['close'])
+            if close > float(quote['high']):
+                quote['high'] = fields['close']
+            if close < float(quote['low']):
+                quote['low'] = fields['close']
+        _SNAPSHOT[symbol] = (time.monotonic(), quote)
+    return quote
+
+
+def is_stale(symbol, prices, now):
+    entry = _SNAPSHOT.get(symbol)
+    if entry is None or now - entry[0] > GEMINI_SNAPSHOT_MAX_AGE:
+        return True
+    # A symbol that has not traded since the last ticker keeps its cached quote
+    price = prices.get(symbol)
+    return price is None or not math.isclose(price, float(entry[1]['close']))
+
+
+def refresh_market_snapshot(symbols=GEMINI_CRYPTO_LIST):
+    prices = fetch_pricefeed()
+    now = time.monotonic()
+    stale = [symbol for symbol in symbols if is_stale(symbol, prices, now)]
+    if stale:
+        with ThreadPoolExecutor(max_workers=GEMINI_SNAPSHOT_BATCH_SIZE) as executor:
+            for symbol, quote in executor.map(fetch_ticker, stale):
+                if quote is not None:
+                    store_quote(symbol, quote)
+    if GEMINI_VERBOSE:
+        print("Snapshot: refreshed", len(stale), "of", len(symbols), "tickers")
+    return stale
+
+
+async def async_http_get(client, url, method):
+    if g.scheduler is not None:
+        await g.scheduler.acquire_async(method)
+    started = time.perf_counter()
+    error = None
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        GEMINI_METRICS.observe_call("Gemini", method, time.perf_counter() - started, error)
+
+
+async def async_fetch_pricefeed(client):
+    if GEMINI_PRICEFEED_URL is None:
+        return {}
+    try:
+        response = await async_http_get(client, GEMINI_PRICEFEED_URL, 'pricefeed')
+        return {entry['pair'].lower(): float(entry['price']) for entry in response.json()}
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        print("Snapshot: pricefeed unavailable, falling back to tickers", e)
+        return {}
+
+
+async def async_fetch_ticker(client, symbol):
+    try:
+        response = await async_http_get(client, GEMINI_TICKER_URL + symbol, 'get_ticker')
+        return symbol, response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        print("Snapshot:", symbol, "Ticker refresh failed", e)
+        return symbol, None
+
+
+async def async_refresh_market_snapshot(client, symbols=GEMINI_CRYPTO_LIST):
+    prices = await async_fetch_pricefeed(client)
+    now = time.monotonic()
+    stale = [symbol for symbol in symbols if is_stale(symbol, prices, now)]
+    for symbol, quote in await asyncio.gather(*(async_fetch_ticker(client, symbol) for symbol in stale)):
+        if quote is not None:
+            store_quote(symbol, quote)
+    if GEMINI_VERBOSE:
+        print("Snapshot: refreshed", len(stale), "of", len(symbols), "tickers")
+    return stale
+
+
+def seed_candles(symbols=GEMINI_CRYPTO_LIST, windows=None):
+    """ Loads the candle history of the frames the dip windows read, one request per symbol and frame. """
+    if windows is None:
+        windows = [GEMINI_DIP_WINDOWS.get(symbol, GEMINI_DIP_WINDOW) for symbol in symbols]
+    frames = sorted({GEMINI_CANDLES.frame(seconds) for seconds in windows})
+    for symbol in symbols:
+        for frame in frames:
+            try:
+                candles = http_get(GEMINI_CANDLES_URL + symbol + "/" + frame, 'candles').json()
+                GEMINI_CANDLES.seed(symbol, frame, candles)
+            except (httpx.HTTPError, ValueError) as e:
+                print("Candles:", symbol, frame, "not seeded, using the ticker's 24h high", e)
+    print("Candles: seeded", ", ".join(frames), "for", len(symbols), "symbols")
+
+
+def get_snapshot_quote(symbol, max_age=GEMINI_SNAPSHOT_MAX_AGE):
+    entry = _SNAPSHOT.get(symbol)
+    if entry is not None and time.monotonic() - entry[0] <= max_age:
+        return entry[1]
+    quote, _ = g.get_ticker(symbol, True)
+    store_quote(symbol, quote)
+    return quote
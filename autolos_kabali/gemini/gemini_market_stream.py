@@ -0,0 +1,141 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import asyncio
+import json
+import time
+
+import websockets
+
+from autolos_kabali.gemini.gemini_candles import GEMINI_CANDLES
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_market_snapshot import merge_quote
+
+
+class TopOfBook:
+    """ Level 2 book of one symbol, only tracking enough to answer the best bid and ask. """
+
+    def __init__(self):
+        self.bids = {}
+        self.asks = {}
+        self.bid = None
+        self.ask = None
+
+    def apply(self, side, price, quantity):
+        levels = self.bids if side == "buy" else self.asks
+        if float(quantity) == 0.0:
+            levels.pop(price, None)
+        else:
+            levels[price] = quantity
+        if side == "buy":
+            if float(quantity) == 0.0 and price == self.bid:
+                self.bid = max(self.bids, key=float) if self.bids else None
+            elif float(quantity) > 0.0 and (self.bid is None or float(price) > float(self.bid)):
+                self.bid = price
+        else:
+            if float(quantity) == 0.0 and price == self.ask:
+                self.ask = min(self.asks, key=float) if self.asks else None
+            elif float(quantity) > 0.0 and (self.ask is None or float(price) < float(self.ask)):
+                self.ask = price
+
+
+class GeminiMarketStream:
+    """ Streams top of book and trades for every symbol from the v2 market data websocket.
+
+    Every update is merged into the market snapshot, so get_current_quote serves streamed prices, and then
+    pushed to the listeners as listener(symbol, quote). On disconnect the books are dropped and rebuilt from
+    the full book Gemini sends on subscribe, reconnecting with exponential backoff. With record_file set every
+    raw message is appended to it with its arrival time, for replay through gemini_market_stream_server.
+    """
+
+    def __init__(self, symbols=GEMINI_CRYPTO_LIST, url=GEMINI_MARKET_DATA_URL, record_file=GEMINI_STREAM_RECORD_FILE):
+        self.symbols = list(symbols)
+        self.url = url
+        self.record_file = record_file
+        self.record_out = None
+        self.books = {}
+        self.listeners = []
+        self.connected = False
+        self.last_message_at = 0.0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def subscription(self):
+        return {"type": "subscribe",
+                "subscriptions": [{"name": "l2", "symbols": [symbol.upper() for symbol in self.symbols]}]}
+
+    async def run(self):
+        delay = GEMINI_STREAM_RECONNECT_DELAY
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=20, max_size=None) as websocket:
+                    await websocket.send(json.dumps(self.subscription()))
+                    # the subscribe response carries the whole book, rebuild from it
+                    self.books.clear()
+                    self.connected = True
+                    delay = GEMINI_STREAM_RECONNECT_DELAY
+                    print("Stream: connected to", self.url)
+                    async for message in websocket:
+                        self.last_message_at = time.time()
+                        try:
+                            message = json.loads(message)
+                            self.record(message)
+                            self.handle(message)
+                        except Exception as e:
+                            # a malformed frame or a failing listener skips the message, the stream stays up
+                            print("Stream: skipped message", repr(e))
+            except Exception as e:
+                print("Stream: disconnected, retrying in", delay, "s", repr(e))
+            finally:
+                self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, GEMINI_STREAM_MAX_RECONNECT_DELAY)
+
+    def record(self, message):
+        if self.record_file is not None:
+            if self.record_out is None:
+                # opened once and line buffered, every message still lands whole
+                self.record_out = open(self.record_file, 'a', buffering=1)
+            self.record_out.write(json.dumps({'received_at': self.last_message_at, 'message': message}) + '\n')
+
+    def handle(self, message):
+        message_type = message.get('type')
+        if message_type == 'l2_updates':
+            symbol = message['symbol'].lower()
+            book = self.books.setdefault(symbol, TopOfBook())
+            for side, price, quantity in message['changes']:
+                book.apply(side, price, quantity)
+            trades = message.get('trades') or []
+            for trade in trades:
+                self.add_trade(symbol, trade)
+            close = trades[-1]['price'] if trades else None
+            self.publish(symbol, book, close)
+        elif message_type == 'trade':
+            symbol = message['symbol'].lower()
+            self.add_trade(symbol, message)
+            self.publish(symbol, self.books.setdefault(symbol, TopOfBook()), message['price'])
+
+    @staticmethod
+    def add_trade(symbol, trade):
+        timestamp = trade.get('timestamp')
+        GEMINI_CANDLES.add(symbol, time.time() if timestamp is None else timestamp / 1000.0, float(trade['price']),
+                           float(trade.get('quantity', 0.0)))
+
+    def publish(self, symbol, book, close=None):
+        fields = {}
+        if book.bid is not None:
+            fields['bid'] = book.bid
+        if book.ask is not None:
+            fields['ask'] = book.ask
+        if close is not None:
+            fields['close'] = close
+        # nothing to merge into until the REST snapshot has the ticker for its 24h high/low/open
+        quote = merge_quote(symbol, **fields)
+        if quote is None:
+            return
+        for listener in self.listeners:
+            try:
+                listener(symbol, quote)
+            except Exception as e:
+                print("Stream:", symbol, "listener failed", repr(e))
@@ -0,0 +1,68 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import asyncio
+import json
+
+import websockets
+
+
+def load_ticks(ticks_file):
+    """ Reads a stream recorded by GeminiMarketStream, one {'received_at', 'message'} per line. """
+    with open(ticks_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class MarketStreamServer:
+    """ Local stand-in for the v2 market data websocket.
+
+    Every client that subscribes gets the recorded messages of its symbols replayed with the recorded spacing
+    divided by speed (speed 0 sends as fast as possible), then the connection is held open, or the recording
+    starts over with loop set. Point GEMINI_MARKET_DATA_URL at it to run the stream offline.
+    """
+
+    def __init__(self, ticks, speed=1.0, loop=False):
+        self.ticks = ticks
+        self.speed = speed
+        self.loop = loop
+
+    async def replay(self, websocket, symbols):
+        while True:
+            previous = None
+            for tick in self.ticks:
+                message = tick['message']
+                if 'symbol' in message and message['symbol'].upper() not in symbols:
+                    continue
+                if previous is not None and self.speed > 0:
+                    await asyncio.sleep(max(tick['received_at'] - previous, 0.0) / self.speed)
+                previous = tick['received_at']
+                await websocket.send(json.dumps(message))
+            if not self.loop:
+                break
+
+    async def handler(self, websocket, path=None):
+        subscription = json.loads(await websocket.recv())
+        symbols = {symbol.upper()
+                   for entry in subscription.get('subscriptions', [])
+                   for symbol in entry.get('symbols', [])}
+        await self.replay(websocket, symbols)
+        await websocket.wait_closed()
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handler, host, port):
+            print("Stand-in market data server on ws://" + host + ":" + str(port))
+            await asyncio.Future()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded Gemini market data stream")
+    parser.add_argument("ticks_file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    server = MarketStreamServer(load_ticks(args.ticks_file), args.speed, args.loop)
+    asyncio.run(server.serve(args.host, args.port))
@@ -0,0 +1,24 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_notion_helper import NOTION_SYNC
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT
+from autolos_kabali.main.metrics import Metrics
+
+# Disabled until init_metrics(), so the backtest and the benchmarks run without it
+GEMINI_METRICS = Metrics("gemini")
+
+
+def init_metrics(enabled=GEMINI_METRICS_ENABLED, port=GEMINI_METRICS_PORT, metrics_file=GEMINI_METRICS_FILE):
+    """ Times every Gemini and Notion call from now on, see GEMINI_METRICS_ENABLED. """
+    if not enabled:
+        return GEMINI_METRICS
+    GEMINI_METRICS.enable()
+    GEMINI_TRANSPORT.observers.append(GEMINI_METRICS.observe_call)
+    NOTION_SYNC.observers.append(GEMINI_METRICS.observe_call)
+    if metrics_file is not None:
+        GEMINI_METRICS.open_file(metrics_file)
+    if port is not None:
+        GEMINI_METRICS.serve(port=port)
+    return GEMINI_METRICS
@@ -0,0 +1,267 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import itertools
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests import exceptions
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.main.exchange_transport import MockExchange, MockMarket
+
+
+class MockGeminiExchange(MockExchange):
+    """ Local stand-in for the robin_stocks.gemini calls the bot makes and for the public market data endpoints.
+
+    Prices are a random walk per symbol (MockMarket) on clock, quotes put the bid on the price grid and the ask
+    spread_ticks above it. Orders follow the exchange rules the bot relies on: a maker-or-cancel order that
+    would cross is cancelled on arrival, a sell of more than the balance is rejected. A resting order fills on
+    an order_status poll with probability fill_probability, the first fill taking partial_fill_ratio of the
+    order when that is set, or with reject_rate it is cancelled on arrival. serve() answers
+    GET /v1/pricefeed, /v2/ticker/<symbol> and /v2/candles/<symbol>/<frame> over HTTP for the snapshot code,
+    which reads those directly.
+    """
+
+    def __init__(self, symbols=GEMINI_CRYPTO_LIST, prices=None, starting_cash=GEMINI_MOCK_STARTING_CASH,
+                 fee_bps=GEMINI_BACKTEST_MAKER_FEE_BPS, spread_ticks=GEMINI_BACKTEST_SPREAD_TICKS,
+                 fill_probability=1.0, partial_fill_ratio=0.0, reject_rate=0.0, volatility=0.001,
+                 step_interval=1.0, latency=0.0, jitter=0.0, error_rate=0.0, error_methods=None, seed=None,
+                 clock=time.monotonic):
+        super().__init__(latency, jitter, error_rate, error_methods, exceptions.ConnectionError, seed)
+        self.symbols = list(symbols)
+        self.market = MockMarket({symbol: (prices or {}).get(symbol, 100.0) for symbol in self.symbols},
+                                 volatility, step_interval, seed, clock)
+        self.details = {symbol: dict(GEMINI_MOCK_SYMBOL_DETAILS, symbol=symbol.upper(), status="open",
+                                     base_currency=symbol[:-3].upper(), quote_currency="USD")
+                        for symbol in self.symbols}
+        self.fee_rate = fee_bps / 10000.0
+        self.spread_ticks = spread_ticks
+        self.fill_probability = fill_probability
+        self.partial_fill_ratio = partial_fill_ratio
+        self.reject_rate = reject_rate
+        self.balances = {'usd': starting_cash}
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.http_requests = 0
+        self.server = None
+
+    # robin_stocks.gemini
+
+    def login(self, api_key, secret_key):
+        self.api_call('login')
+
+    def get_ticker(self, ticker, jsonify=None):
+        self.api_call('get_ticker')
+        return self.ticker(ticker.lower()), None
+
+    def get_symbol_details(self, ticker, jsonify=None):
+        self.api_call('get_symbol_details')
+        return dict(self.details[ticker.lower()]), None
+
+    def check_available_balances(self, jsonify=None):
+        self.api_call('check_available_balances')
+        with self.lock:
+            return [{'currency': currency.upper(), 'amount': str(amount), 'available': str(amount),
+                     'availableForWithdrawal': str(amount), 'type': "exchange"}
+                    for currency, amount in self.balances.items()], None
+
+    def order(self, ticker, quantity, side, price=None, stop_limit_price=None, min_amount=None, options=None,
+              jsonify=None):
+        self.api_call('order')
+        symbol = ticker.lower()
+        quantity = float(quantity)
+        price = float(price)
+        quote = self.ticker(symbol)
+        with self.lock:
+            order = {'order_id': str(next(self.order_ids)),
+                     'id': None,
+                     'client_order_id': "",
+                     'symbol': symbol,
+                     'exchange': "gemini",
+                     'side': side,
+                     'type': "exchange limit",
+                     'price': str(price),
+                     'original_amount': str(quantity),
+                     'options': options or [],
+                     'is_live': True,
+                     'is_cancelled': False,
+                     'executed': 0.0,
+                     'timestampms': int(time.time() * 1000)}
+            order['id'] = order['order_id']
+            self.orders[order['order_id']] = order
+            currency = symbol[:-3]
+            if "maker-or-cancel" in order['options'] and \
+                    (price >= float(quote['ask']) if side == "buy" else price <= float(quote['bid'])):
+                self.cancel(order, "MakerOrCancelWouldTake")
+            elif side == "buy" and quantity * price * (1.0 + self.fee_rate) > self.balances['usd'] + 1e-9:
+                self.cancel(order, "InsufficientFunds")
+            elif side == "sell" and quantity > self.balances.get(currency, 0.0) + 1e-12:
+                self.cancel(order, "InsufficientFunds")
+            elif self.reject_rate > 0.0 and self.fault_random.random() < self.reject_rate:
+                self.cancel(order, "MockRejected")
+            return self.order_status_json(order), None
+
+    def order_status(self, order_id, jsonify=None):
+        self.api_call('order_status')
+        with self.lock:
+            order = self.orders[str(order_id)]
+            if order['is_live'] and self.fault_random.random() < self.fill_probability:
+                self.fill(order)
+            return self.order_status_json(order), None
+
+    def cancel_order(self, order_id, jsonify=None):
+        self.api_call('cancel_order')
+        with self.lock:
+            order = self.orders[str(order_id)]
+            if order['is_live']:
+                self.cancel(order, "Requested")
+            return self.order_status_json(order), None
+
+    # matching
+
+    def ticker(self, symbol):
+        state = self.market.advance(symbol)
+        increment = float(self.details[symbol]['quote_increment'])
+        decimals = max(int(round(-math.log10(increment))), 0)
+        bid = math.floor(state['price'] / increment + 1e-9) * increment
+        ask = bid + self.spread_ticks * increment
+        return {'symbol': symbol.upper(),
+                'open': '{:.{}f}'.format(state['open'], decimals),
+                'high': '{:.{}f}'.format(state['high'], decimals),
+                'low': '{:.{}f}'.format(state['low'], decimals),
+                'close': '{:.{}f}'.format(state['price'], decimals),
+                'changes': ['{:.{}f}'.format(close, decimals) for close in reversed(state['hourly'][-24:])],
+                'bid': '{:.{}f}'.format(bid, decimals),
+                'ask': '{:.{}f}'.format(ask, decimals)}
+
+    def fill(self, order):
+        original = float(order['original_amount'])
+        remaining = original - order['executed']
+        quantity = remaining
+        if order['executed'] == 0.0 and self.partial_fill_ratio > 0.0:
+            tick_size = float(self.details[order['symbol']]['tick_size'])
+            quantity = math.floor(original * self.partial_fill_ratio / tick_size + 1e-9) * tick_size
+        if quantity <= 0.0:
+            return
+        currency = order['symbol'][:-3]
+        dollars = quantity * float(order['price'])
+        fee = dollars * self.fee_rate
+        if order['side'] == "buy":
+            self.balances['usd'] = self.balances['usd'] - dollars - fee
+            self.balances[currency] = self.balances.get(currency, 0.0) + quantity
+        else:
+            self.balances['usd'] = self.balances['usd'] + dollars - fee
+            self.balances[currency] = self.balances.get(currency, 0.0) - quantity
+        order['executed'] = order['executed'] + quantity
+        if math.isclose(order['executed'], original):
+            order['executed'] = original
+            order['is_live'] = False
+
+    def cancel(self, order, reason):
+        order['is_live'] = False
+        order['is_cancelled'] = True
+        order['reason'] = reason
+
+    def order_status_json(self, order):
+        original = float(order['original_amount'])
+        executed = order['executed']
+        status = {key: order[key] for key in ('order_id', 'id', 'client_order_id', 'symbol', 'exchange', 'side',
+                                              'type', 'price', 'original_amount', 'options', 'is_live',
+                                              'is_cancelled', 'timestampms')}
+        status.update({'executed_amount': str(executed),
+                       'remaining_amount': str(original - executed),
+                       'avg_execution_price': order['price'] if executed > 0.0 else "0.00",
+                       'timestamp': str(order['timestampms'] // 1000),
+                       'was_forced': False})
+        if 'reason' in order:
+            status['reason'] = order['reason']
+        return status
+
+    # public market data over HTTP
+
+    def pricefeed(self):
+        return [{'pair': symbol.upper(), 'price': self.ticker(symbol)['close'], 'percentChange24h': "0.0000"}
+                for symbol in self.symbols]
+
+    def candles(self, symbol, frame):
+        """ Candles newest first, the hourly closes for 1hr and the current price as one candle for other frames. """
+        state = self.market.advance(symbol)
+        if frame == '1hr':
+            interval, closes = 60 * 60, state['hourly']
+        else:
+            interval, closes = GEMINI_CANDLE_FRAMES.get(frame, (60, 0))[0], [state['price']]
+        now = math.floor(time.time() / interval) * interval
+        candles = []
+        for index, close in enumerate(closes):
+            open_price = closes[index - 1] if index > 0 else close
+            candles.append([int((now - (len(closes) - 1 - index) * interval) * 1000), open_price,
+                            max(open_price, close), min(open_price, close), close, 0.0])
+        return list(reversed(candles))
+
+    def serve(self, host="localhost", port=GEMINI_MOCK_PORT):
+        """ Serves the market data endpoints on a background thread, returns the server. """
+        exchange = self
+
+        class MockGeminiHandler(BaseHTTPRequestHandler):
+            # keep-alive like the exchange, without Nagle holding the body back behind the headers
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                exchange.http_requests = exchange.http_requests + 1
+                ticker = re.fullmatch(r"/v2/ticker/(\w+)", self.path)
+                candles = re.fullmatch(r"/v2/candles/(\w+)/(\w+)", self.path)
+                try:
+                    if self.path == "/v1/pricefeed":
+                        exchange.api_call('pricefeed')
+                        body = exchange.pricefeed()
+                    elif ticker is not None and ticker.group(1).lower() in exchange.details:
+                        exchange.api_call('get_ticker')
+                        body = exchange.ticker(ticker.group(1).lower())
+                    elif candles is not None and candles.group(1).lower() in exchange.details:
+                        exchange.api_call('candles')
+                        body = exchange.candles(candles.group(1).lower(), candles.group(2))
+                    else:
+                        self.send_error(404)
+                        return
+                except exceptions.ConnectionError:
+                    self.send_error(503)
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                if GEMINI_VERBOSE:
+                    print("Mock Gemini:", format % args)
+
+        self.server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+        threading.Thread(target=self.server.serve_forever, name="mock-gemini", daemon=True).start()
+        print("Mock Gemini: serving market data on http://" + host + ":" + str(self.server.server_port))
+        return self.server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve mock Gemini market data endpoints")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=GEMINI_MOCK_PORT)
+    parser.add_argument("--volatility", type=float, default=0.001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    MockGeminiExchange(volatility=args.volatility, latency=args.latency, error_rate=args.error_rate,
+                       seed=args.seed).serve(args.host, args.port)
+    while True:
+        time.sleep(60)
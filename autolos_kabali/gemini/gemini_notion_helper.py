@@ -4,6 +4,10 @@
 import os.path
 from notion_client import Client
 
+from autolos_kabali.gemini.gemini_constants import GEMINI_NOTION_URL
+from autolos_kabali.gemini.gemini_http_pool import GEMINI_HTTP_POOL
+from autolos_kabali.main.notion_sync import LocalNotionClient, NotionSyncWorker
+
 NOTION_PAGES = {
     "btcusd": "32783907e23341229029c599218580c8",
     "ethusd": "7b171b46c9f141f1858daad87329cb71",
@@ -26,7 +30,10 @@ NOTION_PAGES = {
 }
 
 _notion_api = os.environ.get('NOTION_API_KEY')
-NOTION = Client(auth=_notion_api)
+# without an API key the dashboard is kept in memory, so the bot runs offline
+NOTION = Client(auth=_notion_api, client=GEMINI_HTTP_POOL.client(GEMINI_NOTION_URL)) if _notion_api else \
+    LocalNotionClient()
+NOTION_SYNC = NotionSyncWorker(NOTION)
 
 
 def update_notion_stats(symbol,
@@ -57,7 +64,7 @@ def update_notion_stats(symbol,
             "Buy @": {"number": buy_at},
             "Break Even": {"number": break_even}
         }
-    NOTION.pages.update(page_id, properties=data)
+    NOTION_SYNC.submit(page_id, data)
 
 
 if __name__ == '__main__':
@@ -70,3 +77,4 @@ if __name__ == '__main__':
         cost = round(cost + 0.1, 2)
         # cost = '{:.9f}'.format(cost).rstrip('0').rstrip('.')
         update_notion_stats(crypto, cost, cost, cost, cost, cost, cost, cost, cost, cost, cost, cost, cost)
+    NOTION_SYNC.flush()
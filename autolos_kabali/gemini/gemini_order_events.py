@@ -0,0 +1,133 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+import websockets
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_helper import GEMINI_ORDER_TRACKER
+from autolos_kabali.gemini.gemini_transport import GEMINI_NONCE
+
+# Fields of an order event that mean the same as in the order_status response
+ORDER_STATUS_FIELDS = ['order_id',
+                       'client_order_id',
+                       'symbol',
+                       'side',
+                       'price',
+                       'avg_execution_price',
+                       'executed_amount',
+                       'remaining_amount',
+                       'original_amount',
+                       'is_live',
+                       'is_cancelled',
+                       'timestamp',
+                       'timestampms']
+
+
+def order_events_headers(api_key, secret_key):
+    payload = json.dumps({"request": "/v1/order/events", "nonce": GEMINI_NONCE.next()})
+    encoded_payload = base64.b64encode(payload.encode())
+    signature = hmac.new(secret_key.encode(), encoded_payload, hashlib.sha384).hexdigest()
+    return {"X-GEMINI-APIKEY": api_key,
+            "X-GEMINI-PAYLOAD": encoded_payload.decode(),
+            "X-GEMINI-SIGNATURE": signature,
+            "Cache-Control": "no-cache"}
+
+
+def event_to_order_status(event, previous_status=None):
+    """ Folds an order event into the order_status shape get_order_execution_state understands.
+        Events only carry what changed (a 'closed' event after a fill has no fill details), so fields
+        missing from the event keep their previous value.
+    """
+    order_status = dict(previous_status or {})
+    for field in ORDER_STATUS_FIELDS:
+        if field in event:
+            order_status[field] = event[field]
+    order_status.setdefault('is_live', True)
+    order_status.setdefault('is_cancelled', False)
+    order_status.setdefault('executed_amount', "0")
+    order_status.setdefault('avg_execution_price', "0")
+    if 'remaining_amount' not in order_status and 'original_amount' in order_status:
+        order_status['remaining_amount'] = order_status['original_amount']
+    if event['type'] in ('cancelled', 'rejected'):
+        order_status['is_cancelled'] = True
+        order_status['is_live'] = False
+    elif event['type'] == 'closed':
+        order_status['is_live'] = False
+    return order_status
+
+
+class GeminiOrderEvents:
+    """ Consumes the order events websocket and pushes every event into the order tracker.
+
+    accepted, booked, fill, cancelled and closed events are folded into order_status dicts, so the tracker
+    sees the same OrderState transitions as when polling. The tracker stops polling while the stream is up
+    and falls back to order_status polling when it drops.
+    """
+
+    def __init__(self, tracker=GEMINI_ORDER_TRACKER, url=GEMINI_ORDER_EVENTS_URL, api_key=GEMINI_API_KEY,
+                 secret_key=GEMINI_SECRET_KEY, record_file=GEMINI_ORDER_EVENTS_RECORD_FILE):
+        self.tracker = tracker
+        self.url = url
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.record_file = record_file
+        self.statuses = {}
+
+    async def run(self):
+        delay = GEMINI_STREAM_RECONNECT_DELAY
+        while True:
+            try:
+                headers = order_events_headers(self.api_key or "", self.secret_key or "")
+                async with websockets.connect(self.url, extra_headers=headers, ping_interval=20) as websocket:
+                    delay = GEMINI_STREAM_RECONNECT_DELAY
+                    async for message in websocket:
+                        self.record(message)
+                        self.handle(json.loads(message))
+            except (websockets.exceptions.WebSocketException, OSError, ValueError) as e:
+                print("Order events: disconnected, polling order status until reconnected", e)
+            finally:
+                self.tracker.set_push_connected(False)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, GEMINI_STREAM_MAX_RECONNECT_DELAY)
+
+    def record(self, message):
+        if self.record_file is not None:
+            with open(self.record_file, 'a') as f:
+                f.write(json.dumps({'received_at': time.time(), 'message': json.loads(message)}) + '\n')
+
+    def handle(self, message):
+        if isinstance(message, dict):
+            if message.get('type') == 'subscription_ack':
+                print("Order events: subscribed")
+                self.tracker.set_push_connected(True)
+            return
+        for event in message:
+            self.handle_event(event)
+
+    def handle_event(self, event):
+        order_id = event.get('order_id')
+        if order_id is None:
+            return
+        order_status = event_to_order_status(event, self.statuses.get(order_id))
+        if event['type'] == 'closed':
+            self.statuses.pop(order_id, None)
+        else:
+            self.statuses[order_id] = order_status
+        self.tracker.update(order_id, order_status)
+
+
+def start_order_events():
+    """ Runs the consumer on its own event loop thread, so it serves the engine and the sequential loop alike. """
+    order_events = GeminiOrderEvents()
+    thread = threading.Thread(target=asyncio.run, args=(order_events.run(),), name="gemini-order-events",
+                              daemon=True)
+    thread.start()
+    return order_events
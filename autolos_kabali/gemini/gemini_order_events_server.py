@@ -0,0 +1,64 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import asyncio
+import json
+
+import websockets
+
+from autolos_kabali.gemini.gemini_market_stream_server import load_ticks
+
+
+class OrderEventsServer:
+    """ Local stand-in for the order events websocket.
+
+    Every client gets a subscription_ack, the recorded events replayed with the recorded spacing divided by
+    speed, and then whatever is handed to publish(), so a test harness can fill or cancel orders it placed.
+    Point GEMINI_ORDER_EVENTS_URL at it to run order tracking offline.
+    """
+
+    def __init__(self, events=(), speed=1.0):
+        self.events = list(events)
+        self.speed = speed
+        self.clients = set()
+
+    async def replay(self, websocket):
+        previous = None
+        for event in self.events:
+            if previous is not None and self.speed > 0:
+                await asyncio.sleep(max(event['received_at'] - previous, 0.0) / self.speed)
+            previous = event['received_at']
+            await websocket.send(json.dumps(event['message']))
+
+    async def publish(self, events):
+        message = json.dumps(events)
+        for websocket in list(self.clients):
+            await websocket.send(message)
+
+    async def handler(self, websocket, path=None):
+        await websocket.send(json.dumps({"type": "subscription_ack", "accountId": 0, "subscriptionId": "stand-in",
+                                         "symbolFilter": [], "apiSessionFilter": [], "eventTypeFilter": []}))
+        await self.replay(websocket)
+        self.clients.add(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            self.clients.discard(websocket)
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handler, host, port):
+            print("Stand-in order events server on ws://" + host + ":" + str(port))
+            await asyncio.Future()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded Gemini order events stream")
+    parser.add_argument("events_file", nargs="?")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = OrderEventsServer(load_ticks(args.events_file) if args.events_file else (), args.speed)
+    asyncio.run(server.serve(args.host, args.port))
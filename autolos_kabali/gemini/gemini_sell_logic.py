@@ -5,29 +5,20 @@ import math
 from pprint import pformat
 
 from autolos_kabali.gemini.gemini_constants import *
-from autolos_kabali.gemini.gemini_helper import place_and_check_order_executed_or_cancel, remove_coin, get_quantity, \
-    get_signals, create_trade_details, insert_recent_trade, get_sell_volatility_percentage_latest, \
-    remove_recent_trade, get_min_quantity, get_quote_increment
-from autolos_kabali.gemini.gemini_stats import print_state
+from autolos_kabali.gemini.gemini_helper import submit_order, symbol_lock, remove_coin, get_quantity, \
+    get_signals, create_trade_details, close_trade, get_sell_volatility_percentage_latest, \
+    get_min_quantity, get_price_grid, get_current_quote, has_open_order
+from autolos_kabali.gemini.gemini_stats import print_state, GEMINI_STATE_REPORTER
 
 
 def aggressive_bid(symbol, bid):
-    if '.' in bid:
-        exponent, mantissa = bid.split('.')
-        quote_increment = get_quote_increment(symbol)
-        mantissa_size = int(round(1/quote_increment))
-        mantissa_max = mantissa_size - 1
-        mantissa_len = len(str(mantissa_max))
-        mantissa_int = int(mantissa)
-        if mantissa_int > 0:
-            if mantissa_int == mantissa_max:
-                return str(int(exponent) + 1) + '.' + '0'.zfill(mantissa_len)
-            aggressive_mantissa = int(float('0.' + mantissa) * mantissa_size) + 1
-            return exponent + '.' + str(aggressive_mantissa).zfill(mantissa_len)
-    return bid
+    prices = get_price_grid(symbol)
+    return prices.to_string(prices.above(bid))
 
 
 def sell_logic_hybrid(symbol):
+    if has_open_order(symbol):
+        return
     if len(GEMINI_OUTSTANDING_TRADE_LOTS[symbol]) > 0:
         signal = get_signals(symbol)
         # print("Sell:", symbol, "% up from total cost", signal.percentage_up,
@@ -63,6 +54,7 @@ def sell_trade_logic_last_lot(symbol, signal):
                                 sell_quantity,
                                 signal.bid,
                                 float(signal.lowest_outstanding_lot['cost']),
+                                signal.sell_at_recent_trade,
                                 signal.lowest_outstanding_lot)
 
 
@@ -83,7 +75,8 @@ def sell_trade_logic(symbol, signal):
                     sell_trade_impl(symbol,
                                     quantity,
                                     signal.bid,
-                                    signal.avg_cost)
+                                    signal.avg_cost,
+                                    signal.sell_at)
         else:
             if isinstance(quantity, float) and math.isclose(quantity, 0.0):
                 print("Sell:", symbol, "Quantity not found. Cleanup coin lot")
@@ -91,39 +84,50 @@ def sell_trade_logic(symbol, signal):
                 print_state(True)
 
 
-def sell_trade_impl(symbol, quantity, bid, cost, lowest_outstanding_trade=None):
+def sell_trade_impl(symbol, quantity, snapshot_bid, cost, sell_at, lowest_outstanding_trade=None):
+    # the signal came from the cycle snapshot, price the order off a fresh ticker
+    bid = get_current_quote(symbol, 0)['bid']
+    if float(bid) <= sell_at:
+        print("Sell:", symbol, "Bid moved away from trigger, Snapshot Bid:", snapshot_bid, "Current Bid:", bid,
+              "Sell At:", sell_at)
+        return
+
     aggressive_bid_f = aggressive_bid(symbol, bid)
     print("Sell:", symbol, "Current Bid Price:", bid, "Aggressive bid", aggressive_bid_f)
-    sell_order = place_and_check_order_executed_or_cancel(symbol,
-                                                          quantity,
-                                                          "sell",
-                                                          aggressive_bid_f)
-    if sell_order is not None:
-        executed_amount = float(sell_order['executed_amount'])
-        if executed_amount > 0.0:
-            if bool(lowest_outstanding_trade):
-                remove_recent_trade(symbol, lowest_outstanding_trade)
-            else:
-                remove_coin(symbol)
 
-            if not math.isclose(quantity, executed_amount):
-                # partially executed
-                min_quantity = get_min_quantity(symbol)
-                remaining_quantity = float(sell_order['remaining_amount'])
-                if remaining_quantity > min_quantity:
-                    dollar_amount = remaining_quantity * cost
-                    remaining_trade = create_trade_details(symbol,
-                                                           sell_order['order_id'],
-                                                           sell_order['client_order_id'],
-                                                           remaining_quantity,
-                                                           cost,
-                                                           dollar_amount,
-                                                           sell_order['timestamp'],
-                                                           sell_order['timestampms'])
-                    insert_recent_trade(symbol, remaining_trade)
-        print_state(True)
-
-        try:
-            print("Sell:", symbol, "Sell Order", pformat(sell_order))
-        except Exception as e:
-            print("Sell: Caught exception when printing", e)
+    def on_done(sell_order):
+        complete_sell_order(symbol, quantity, cost, lowest_outstanding_trade, sell_order)
+
+    submit_order(symbol, quantity, "sell", aggressive_bid_f, on_done)
+
+
+def complete_sell_order(symbol, quantity, cost, lowest_outstanding_trade, sell_order):
+    executed_amount = float(sell_order['executed_amount'])
+    if executed_amount > 0.0:
+        remaining_trade = None
+        if not math.isclose(quantity, executed_amount):
+            # partially executed
+            min_quantity = get_min_quantity(symbol)
+            remaining_quantity = float(sell_order['remaining_amount'])
+            if remaining_quantity > min_quantity:
+                dollar_amount = remaining_quantity * cost
+                remaining_trade = create_trade_details(symbol,
+                                                       sell_order['order_id'],
+                                                       sell_order['client_order_id'],
+                                                       remaining_quantity,
+                                                       cost,
+                                                       dollar_amount,
+                                                       sell_order['timestamp'],
+                                                       sell_order['timestampms'])
+
+        with symbol_lock(symbol):
+            close_trade(symbol,
+                        lowest_outstanding_trade if bool(lowest_outstanding_trade) else None,
+                        remaining_trade,
+                        float(sell_order['avg_execution_price']))
+    GEMINI_STATE_REPORTER.request()
+
+    try:
+        print("Sell:", symbol, "Sell Order", pformat(sell_order))
+    except Exception as e:
+        print("Sell: Caught exception when printing", e)
@@ -1,6 +1,7 @@
 # Gemini Trading bot
 # Author: Deepak Dasarathan
 import math
+import threading
 import time
 import traceback
 from datetime import datetime
@@ -9,6 +10,11 @@ from termcolor import colored
 from autolos_kabali.gemini.gemini_constants import *
 from autolos_kabali.gemini.gemini_helper import get_signals, get_account_balance
 from autolos_kabali.gemini.gemini_notion_helper import update_notion_stats
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT
+from autolos_kabali.main.state_reporter import StateReporter
+
+# The stats tables are module globals, only one symbol task may fill and print them at a time
+_PRINT_STATE_LOCK = threading.Lock()
 
 
 def print_signals(signal):
@@ -102,6 +108,16 @@ def print_lot_details(symbol):
 
 
 def print_state(print_stdout=True):
+    # the quotes print_state fetches wait behind the trading pass' requests
+    with _PRINT_STATE_LOCK, GEMINI_TRANSPORT.priority(REPORTING):
+        print_state_impl(print_stdout)
+
+
+# The order tracker's callbacks hand their report to this thread, so polling and cancelling never wait on it
+GEMINI_STATE_REPORTER = StateReporter(print_state, "gemini-state")
+
+
+def print_state_impl(print_stdout):
     try:
         total_crypto_bought_dollars = 0.0
         for c in GEMINI_CRYPTO_LIST:
@@ -0,0 +1,205 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import bisect
+import hashlib
+import signal
+import subprocess
+import sys
+import time
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT as g
+from autolos_kabali.main.balance_ledger import SqliteCash
+from autolos_kabali.main.lot_store import open_lot_store
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def worker_owner(worker, process):
+    # the GEMINI_WORKER_OWNER the worker process reserves cash as
+    return "worker" + str(worker) + ":" + str(process.pid)
+
+
+def worker_keys(worker):
+    # a key of its own per worker, nonces of one key across processes would not keep increasing
+    return os.environ.get('GEMINI_API_KEY_' + str(worker)), os.environ.get('GEMINI_SECRET_KEY_' + str(worker))
+
+
+class HashRing:
+    """ Consistent hashing of symbols onto workers.
+
+    Every worker owns replicas points of a 64 bit ring and a symbol belongs to the worker of the first point at
+    or after its hash. Removing a worker moves only its own symbols, spread over the others, and adding one
+    takes about 1 / workers of everyone's.
+    """
+
+    def __init__(self, workers=(), replicas=GEMINI_HASH_REPLICAS):
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+        for worker in workers:
+            self.add(worker)
+
+    def __len__(self):
+        return len(set(self.owners.values()))
+
+    def add(self, worker):
+        for replica in range(self.replicas):
+            point = ring_hash(str(worker) + "#" + str(replica))
+            self.owners[point] = worker
+            bisect.insort(self.points, point)
+
+    def remove(self, worker):
+        self.points = [point for point in self.points if self.owners[point] != worker]
+        self.owners = {point: self.owners[point] for point in self.points}
+
+    def owner(self, symbol):
+        index = bisect.bisect_left(self.points, ring_hash(symbol)) % len(self.points)
+        return self.owners[self.points[index]]
+
+    def assign(self, symbols):
+        """ {worker: its symbols} for every worker on the ring, in the order of symbols. """
+        shards = {worker: [] for worker in sorted(set(self.owners.values()))}
+        if self.points:
+            for symbol in symbols:
+                shards[self.owner(symbol)].append(symbol)
+        return shards
+
+
+class GeminiSupervisor:
+    """ Runs the bot as one gemini_trading_bot process per shard of the symbols.
+
+    Workers get their shard, a share of the request budgets in proportion to its symbols and, live, an API key
+    of their own through the GEMINI_WORKER environment (see gemini_constants), and write their output to
+    GEMINI_WORKER_LOG_FILE. When a worker exits, the orders it left resting on its shard are cancelled with its
+    key, then the cash it still had reserved is released, it leaves the ring and only the workers its symbols
+    move to are restarted, so no symbol is ever traded by two processes.
+    A restart is a SIGTERM that lets the worker's evaluations and orders in flight finish first. Dead workers
+    are not replaced, the supervisor stops once none is left.
+    """
+
+    def __init__(self, symbols=GEMINI_CRYPTO_LIST, workers=GEMINI_WORKERS, replicas=GEMINI_HASH_REPLICAS):
+        self.symbols = list(symbols)
+        self.ring = HashRing(range(workers), replicas)
+        self.shards = {}
+        self.processes = {}
+        self.cash = SqliteCash(GEMINI_CASH_DB_FILE, "gemini", "supervisor")
+
+    def spawn(self, worker, symbols):
+        # by symbols, the workers left after one dies then still add up to the whole budget
+        env = dict(os.environ, GEMINI_WORKER=str(worker), GEMINI_SHARD=",".join(symbols),
+                   GEMINI_WORKER_SHARE=repr(len(symbols) / len(self.symbols)))
+        api_key, secret_key = worker_keys(worker)
+        if api_key and secret_key:
+            env.update(GEMINI_API_KEY=api_key, GEMINI_SECRET_KEY=secret_key)
+        with open(GEMINI_WORKER_LOG_FILE.format(worker), 'a') as log:
+            # a session of its own, so a Ctrl-C reaches the supervisor only and the workers stop gracefully
+            process = subprocess.Popen([sys.executable, "-u", "-m", "autolos_kabali.gemini.gemini_trading_bot"],
+                                       env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self.processes[worker] = process
+        print("Supervisor: worker", worker, "pid", process.pid, "trading", len(symbols), "symbols",
+              ",".join(symbols))
+
+    def stop(self, workers):
+        processes = {worker: self.processes.pop(worker) for worker in workers if worker in self.processes}
+        for process in processes.values():
+            process.terminate()
+        for worker, process in processes.items():
+            try:
+                process.wait(GEMINI_WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                print("Supervisor: worker", worker, "did not stop in", GEMINI_WORKER_STOP_TIMEOUT, "s, killing it")
+                process.kill()
+                process.wait()
+            self.release(worker, process)
+
+    def cancel_orders(self, worker):
+        """ Cancels the orders worker left resting on its shard, returns False when they could not be. Their fills
+        would never be booked, and the cash reserved for them would be spent again once released.
+        """
+        if GEMINI_TRANSPORT_MODE != "live":
+            # a worker's mock exchange runs in the worker and is gone with it
+            return True
+        shard = set(self.shards.get(worker, ()))
+        try:
+            g.login(*worker_keys(worker))
+            orders, _ = g.active_orders(jsonify=True)
+            for order in orders:
+                if order['symbol'] not in shard:
+                    continue
+                status, _ = g.cancel_order(order['order_id'], jsonify=True)
+                print("Supervisor: cancelled order", order['order_id'], "of worker", worker, order['symbol'],
+                      order['side'], "at", order['price'])
+                if float(status.get('executed_amount', 0.0)) > 0.0:
+                    print("Supervisor: order", order['order_id'], "had filled", status['executed_amount'], "at",
+                          status.get('avg_execution_price'), "and was not booked in the lot store")
+        except Exception as e:
+            print("Supervisor: could not cancel the orders of worker", worker, e)
+            return False
+        return True
+
+    def release(self, worker, process):
+        if not self.cancel_orders(worker):
+            print("Supervisor: keeping the cash reservations of worker", worker)
+            return
+        released = self.cash.release_owner(worker_owner(worker, process))
+        if released > 0:
+            print("Supervisor: released", released, "cash reservations of worker", worker)
+
+    def rebalance(self):
+        """ Starts the workers whose shard changed, after stopping them if they were running. """
+        shards = self.ring.assign(self.symbols)
+        moved = [worker for worker, symbols in shards.items() if symbols != self.shards.get(worker)]
+        self.stop(moved)
+        self.shards = shards
+        for worker in moved:
+            if shards[worker]:
+                self.spawn(worker, shards[worker])
+
+    def poll(self):
+        """ Moves the shards of the workers that exited, returns False once no worker is left. """
+        for worker, process in list(self.processes.items()):
+            # a rebalance for an earlier exit may have restarted this worker already
+            code = process.poll() if self.processes.get(worker) is process else None
+            if code is None:
+                continue
+            del self.processes[worker]
+            self.release(worker, process)
+            self.ring.remove(worker)
+            self.shards.pop(worker, None)
+            print("Supervisor: worker", worker, "exited with", code, "moving its symbols to", len(self.ring), "workers")
+            if len(self.ring):
+                self.rebalance()
+        return bool(self.processes)
+
+    def run(self):
+        # migrate the lots file into the shared store once, before the workers open it
+        open_lot_store("sqlite", GEMINI_OUTSTANDING_TRADE_LOTS_FILE, "gemini")
+        self.rebalance()
+        try:
+            while self.poll():
+                time.sleep(GEMINI_SUPERVISOR_POLL_INTERVAL)
+        finally:
+            self.stop(list(self.processes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trade the Gemini symbols in worker processes, one shard each")
+    parser.add_argument("--workers", type=int, default=GEMINI_WORKERS)
+    parser.add_argument("--symbols", nargs="+", default=GEMINI_CRYPTO_LIST)
+    args = parser.parse_args()
+    if GEMINI_WORKER is not None:
+        parser.error("GEMINI_WORKER is set, the supervisor starts the workers itself")
+    if GEMINI_RECORDED_CALLS_ONLY:
+        parser.error("record and replay keep one transport file, run them without the supervisor")
+    missing_keys = [str(worker) for worker in range(args.workers) if not all(worker_keys(worker))]
+    if GEMINI_TRANSPORT_MODE == "live" and missing_keys:
+        parser.error("every worker needs an API key of its own, GEMINI_API_KEY_<n> and GEMINI_SECRET_KEY_<n> "
+                     "are missing for workers " + ", ".join(missing_keys))
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    GeminiSupervisor(args.symbols, args.workers).run()
@@ -0,0 +1,397 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from prettytable import PrettyTable
+
+from autolos_kabali.gemini.gemini_backtest import read_candles
+from autolos_kabali.gemini.gemini_constants import *
+
+GEMINI_SWEEP_GRID = {'purchase_base': [5.0, 10.0],
+                     'purchase_growth': [1.25, 1.5, 1.75, 2.0],
+                     'closeness_base': [0.5, 1.0, 1.5, 2.0, 2.5],
+                     'closeness_step': [0.0, 0.1, 0.25, 0.5],
+                     'sell_base': [1.5, 2.0, 2.5, 3.0, 3.5, 4.0],
+                     'sell_step': [0.0, 0.1, 0.25]}
+GEMINI_SWEEP_LADDER_LENGTH = len(GEMINI_PERCENTAGES)
+GEMINI_SWEEP_MAX_PURCHASE = max(GEMINI_PURCHASE_AMOUNTS)
+GEMINI_SWEEP_SELL_LAST_ABOVE = 6
+GEMINI_SWEEP_WINDOW = 24 * 60
+GEMINI_SWEEP_BLOCK = 24 * 60
+GEMINI_SWEEP_CHUNK = 1000
+GEMINI_SWEEP_SPREAD_BPS = 5.0
+GEMINI_SWEEP_FEE_BPS = GEMINI_BACKTEST_MAKER_FEE_BPS
+
+# Arrays filled in by worker_init in every pool process
+_WORKER = {}
+
+
+def rolling_max(values, window):
+    """ Max of the last window values at every index (fewer at the start), van Herk/Gil-Werman in O(n). """
+    n = len(values)
+    blocks = -(-n // window)
+    padded = np.full(blocks * window + window, -np.inf)
+    padded[window:window + n] = values
+    shaped = padded.reshape(-1, window)
+    prefix = np.maximum.accumulate(shaped, axis=1).ravel()
+    suffix = np.maximum.accumulate(shaped[:, ::-1], axis=1)[:, ::-1].ravel()
+    # the window ending at i starts at i - window + 1, in padded coordinates i + 1 .. i + window
+    index = np.arange(n)
+    return np.maximum(suffix[index + 1], prefix[index + window])
+
+
+def build_ladders(grid, ladder_length=GEMINI_SWEEP_LADDER_LENGTH, max_purchase=GEMINI_SWEEP_MAX_PURCHASE):
+    """ Expands the grid into ladders: purchase amounts grow geometrically up to max_purchase, the closeness
+        and sell percentages linearly. Returns the parameter dicts and three (configs x ladder_length) arrays.
+    """
+    names = list(grid)
+    params = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    steps = np.arange(ladder_length)
+    purchase = np.array([np.minimum(p['purchase_base'] * p['purchase_growth'] ** steps, max_purchase)
+                         for p in params])
+    closeness = np.array([p['closeness_base'] + p['closeness_step'] * steps for p in params])
+    sell = np.array([p['sell_base'] + p['sell_step'] * steps for p in params])
+    return params, purchase, closeness, sell
+
+
+def simulate(bid, ask, ratio, purchase, closeness, sell, max_lots, sell_last_above, fee_rate, block):
+    """ Runs the ladder strategy for every config (row of the ladder arrays) over one symbol's prices.
+
+    The lot book is a stack: every buy after the first is below the lowest lot, so the lowest lot is the last
+    one bought. While the book is unchanged a config's buy and sell triggers are fixed prices (for an empty
+    book, a fixed ask/24h-high ratio), so each block of candles is searched for the first crossing of every
+    config at once, the event is applied to the configs that have one, and the search continues after it.
+    Returns the per-config totals and the end-of-block PnL and max capital deployed curves.
+    """
+    configs, ladder_length = purchase.shape
+    rows = np.arange(configs)
+    lots = np.zeros(configs, dtype=np.int64)
+    costs = np.zeros((configs, max_lots + 1))
+    quantities = np.zeros((configs, max_lots + 1))
+    total_amount = np.zeros(configs)
+    total_quantity = np.zeros(configs)
+    cash_flow = np.zeros(configs)
+    fees = np.zeros(configs)
+    buys = np.zeros(configs, dtype=np.int64)
+    sells = np.zeros(configs, dtype=np.int64)
+    max_lots_seen = np.zeros(configs, dtype=np.int64)
+    max_deployed = np.zeros(configs)
+    blocks = -(-len(bid) // block)
+    pnl_curve = np.zeros((configs, blocks))
+    deployed_curve = np.zeros((configs, blocks))
+
+    def buy_thresholds(r):
+        n = lots[r]
+        factor = 1.0 - closeness[r, np.minimum(n, ladder_length - 1)] / 100.0
+        lowest = costs[r, np.maximum(n - 1, 0)]
+        threshold = np.where(n == 0, factor, lowest * factor)
+        return np.where(n < max_lots, threshold, -np.inf)
+
+    def sell_thresholds(r):
+        n = lots[r]
+        volatility = sell[r, np.where(n < ladder_length, np.maximum(n - 1, 0), ladder_length - 1)] / 100.0
+        lowest = costs[r, np.maximum(n - 1, 0)]
+        average = np.divide(total_amount[r], total_quantity[r], out=np.zeros(len(r)), where=total_quantity[r] > 0)
+        base = np.where(n <= sell_last_above, average, lowest)
+        return np.where(n > 0, base * (1.0 + volatility), np.inf)
+
+    def buy(r, j):
+        n = lots[r]
+        threshold = buy_thresholds(r)
+        price = np.where(n == 0, ratio[j], ask[j])
+        r = r[price < threshold]
+        if len(r) == 0:
+            return
+        n = lots[r]
+        amount = purchase[r, np.minimum(n, ladder_length - 1)]
+        quantity = amount / ask[j]
+        fee = amount * fee_rate
+        costs[r, n] = ask[j]
+        quantities[r, n] = quantity
+        lots[r] = n + 1
+        total_amount[r] += amount
+        total_quantity[r] += quantity
+        cash_flow[r] -= amount + fee
+        fees[r] += fee
+        buys[r] += 1
+        max_lots_seen[r] = np.maximum(max_lots_seen[r], lots[r])
+        max_deployed[r] = np.maximum(max_deployed[r], total_amount[r])
+
+    def sell_lots(r, j):
+        r = r[bid[j] > sell_thresholds(r)]
+        if len(r) == 0:
+            return
+        n = lots[r]
+        sell_all = n <= sell_last_above
+        top = n - 1
+        quantity = np.where(sell_all, total_quantity[r], quantities[r, top])
+        amount = np.where(sell_all, total_amount[r], quantities[r, top] * costs[r, top])
+        proceeds = quantity * bid[j]
+        fee = proceeds * fee_rate
+        cash_flow[r] += proceeds - fee
+        fees[r] += fee
+        sells[r] += 1
+        lots[r] = np.where(sell_all, 0, top)
+        total_amount[r] = np.where(sell_all, 0.0, total_amount[r] - amount)
+        total_quantity[r] = np.where(sell_all, 0.0, total_quantity[r] - quantity)
+
+    for b in range(blocks):
+        start = b * block
+        end = min(start + block, len(bid))
+        columns = np.arange(end - start)
+        block_deployed = total_amount.copy()
+        active = rows
+        offsets = np.zeros(configs, dtype=np.int64)
+        while len(active) > 0:
+            buy_at = buy_thresholds(active)[:, None]
+            sell_at = sell_thresholds(active)[:, None]
+            empty = (lots[active] == 0)[:, None]
+            prices = np.where(empty, ratio[None, start:end], ask[None, start:end])
+            hit = (prices < buy_at) | (bid[None, start:end] > sell_at)
+            hit &= columns[None, :] >= offsets[active][:, None]
+            has_event = hit.any(axis=1)
+            active = active[has_event]
+            if len(active) == 0:
+                break
+            events = start + hit[has_event].argmax(axis=1)
+            # configs meeting their event on the same candle are applied together
+            for j in np.unique(events):
+                r = active[events == j]
+                buy(r, j)
+                sell_lots(r, j)
+                block_deployed[r] = np.maximum(block_deployed[r], total_amount[r])
+            offsets[active] = events - start + 1
+            active = active[offsets[active] < end - start]
+        pnl_curve[:, b] = cash_flow + total_quantity * bid[end - 1]
+        deployed_curve[:, b] = block_deployed
+
+    return {'pnl': pnl_curve[:, -1],
+            'fees': fees,
+            'buys': buys,
+            'sells': sells,
+            'lots': lots,
+            'max_lots': max_lots_seen,
+            'max_deployed': max_deployed,
+            'pnl_curve': pnl_curve,
+            'deployed_curve': deployed_curve}
+
+
+def load_prices(candles_file, window=GEMINI_SWEEP_WINDOW, spread_bps=GEMINI_SWEEP_SPREAD_BPS):
+    """ (bid, ask, ask / 24h high) arrays of a candle file, the bid being the candle close. """
+    candles = np.array(list(read_candles(candles_file)))
+    bid = candles[:, 4]
+    ask = bid * (1.0 + spread_bps / 10000.0)
+    return np.stack([bid, ask, ask / rolling_max(candles[:, 2], window)])
+
+
+def worker_init(shared_prices, ladders, strategy):
+    _WORKER['shared'] = {}
+    _WORKER['prices'] = {}
+    for symbol, (name, shape) in shared_prices.items():
+        memory = shared_memory.SharedMemory(name=name)
+        _WORKER['shared'][symbol] = memory
+        _WORKER['prices'][symbol] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    _WORKER['ladders'] = ladders
+    _WORKER['strategy'] = strategy
+
+
+def worker_run(task):
+    symbol, first, last = task
+    bid, ask, ratio = _WORKER['prices'][symbol]
+    purchase, closeness, sell = (ladder[first:last] for ladder in _WORKER['ladders'])
+    return symbol, first, simulate(bid, ask, ratio, purchase, closeness, sell, **_WORKER['strategy'])
+
+
+def max_drawdown(curve):
+    peaks = np.maximum.accumulate(np.maximum(curve, 0.0), axis=1)
+    return (peaks - curve).max(axis=1)
+
+
+class LadderSweep:
+    """ Evaluates every ladder config on every symbol across a process pool.
+
+    The price arrays of all symbols are put in shared memory once, each task runs one chunk of configs on
+    one symbol. Symbols are traded with independent cash, so the capital figures are the sum of the
+    per-symbol peaks (an upper bound of what the bot needs) and the drawdown is taken on the summed
+    end-of-day PnL. Fills are assumed at the ask and bid, there is no maker-or-cancel or partial fill
+    model: gemini_backtest replays the chosen ladder through the real logic.
+    """
+
+    def __init__(self, candle_files, params, purchase, closeness, sell, max_lots=GEMINI_NO_OF_OUTSTANDING_TRADES,
+                 sell_last_above=GEMINI_SWEEP_SELL_LAST_ABOVE, fee_bps=GEMINI_SWEEP_FEE_BPS,
+                 spread_bps=GEMINI_SWEEP_SPREAD_BPS, window=GEMINI_SWEEP_WINDOW, block=GEMINI_SWEEP_BLOCK,
+                 chunk=GEMINI_SWEEP_CHUNK, processes=None):
+        self.candle_files = dict(candle_files)
+        self.params = params
+        self.ladders = (purchase, closeness, sell)
+        self.strategy = {'max_lots': max_lots, 'sell_last_above': sell_last_above, 'fee_rate': fee_bps / 10000.0,
+                         'block': block}
+        self.spread_bps = spread_bps
+        self.window = window
+        self.chunk = chunk
+        self.processes = processes or os.cpu_count()
+
+    def share_prices(self):
+        shared = {}
+        for symbol, candles_file in self.candle_files.items():
+            prices = load_prices(candles_file, self.window, self.spread_bps)
+            memory = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+            np.ndarray(prices.shape, dtype=np.float64, buffer=memory.buf)[:] = prices
+            shared[symbol] = memory, prices.shape
+        return shared
+
+    def run(self):
+        started = time.monotonic()
+        configs = len(self.params)
+        shared = self.share_prices()
+        try:
+            tasks = [(symbol, first, min(first + self.chunk, configs))
+                     for symbol in self.candle_files for first in range(0, configs, self.chunk)]
+            totals = {key: np.zeros(configs) for key in ('pnl', 'fees', 'buys', 'sells', 'lots', 'max_deployed')}
+            max_lots = np.zeros(configs)
+            pnl_curve = None
+            deployed_curve = None
+            names = {symbol: (memory.name, shape) for symbol, (memory, shape) in shared.items()}
+            with multiprocessing.Pool(self.processes, worker_init, (names, self.ladders, self.strategy)) as pool:
+                for symbol, first, result in pool.imap_unordered(worker_run, tasks):
+                    last = first + len(result['pnl'])
+                    for key in totals:
+                        totals[key][first:last] += result[key]
+                    max_lots[first:last] = np.maximum(max_lots[first:last], result['max_lots'])
+                    if pnl_curve is None:
+                        # symbols may cover different days, curves are summed over the shortest
+                        pnl_curve = np.zeros((configs, result['pnl_curve'].shape[1]))
+                        deployed_curve = np.zeros((configs, result['pnl_curve'].shape[1]))
+                    days = min(pnl_curve.shape[1], result['pnl_curve'].shape[1])
+                    pnl_curve = pnl_curve[:, :days]
+                    deployed_curve = deployed_curve[:, :days]
+                    pnl_curve[first:last] += result['pnl_curve'][:, :days]
+                    deployed_curve[first:last] += result['deployed_curve'][:, :days]
+        finally:
+            for memory, _ in shared.values():
+                memory.close()
+                memory.unlink()
+
+        drawdown = max_drawdown(pnl_curve)
+        capital = deployed_curve.max(axis=1)
+        results = []
+        for index, params in enumerate(self.params):
+            results.append(dict(params,
+                                config=index,
+                                pnl=round(float(totals['pnl'][index]), 2),
+                                return_on_capital=round(float(totals['pnl'][index] / capital[index] * 100.0), 4)
+                                if capital[index] > 0 else 0.0,
+                                max_drawdown=round(float(drawdown[index]), 2),
+                                max_capital=round(float(capital[index]), 2),
+                                fees=round(float(totals['fees'][index]), 2),
+                                buys=int(totals['buys'][index]),
+                                sells=int(totals['sells'][index]),
+                                open_lots=int(totals['lots'][index]),
+                                max_lots=int(max_lots[index]),
+                                purchase_amounts=[round(float(v), 2) for v in self.ladders[0][index]],
+                                percentages=[round(float(v), 4) for v in self.ladders[1][index]],
+                                sell_percentages=[round(float(v), 4) for v in self.ladders[2][index]]))
+        print("Sweep:", configs, "configs x", len(self.candle_files), "symbols in",
+              round(time.monotonic() - started, 1), "s on", self.processes, "processes")
+        return results
+
+
+def rank(results, rank_by):
+    if rank_by == "calmar":
+        def key(result):
+            return result['pnl'] / result['max_drawdown'] if result['max_drawdown'] > 0 else result['pnl']
+    else:
+        def key(result):
+            return result[rank_by]
+    return sorted(results, key=key, reverse=True)
+
+
+def write_ranked_csv(results, csv_file):
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["rank"] + list(results[0]))
+        writer.writeheader()
+        for position, result in enumerate(results, 1):
+            writer.writerow(dict(result, rank=position,
+                                 purchase_amounts=json.dumps(result['purchase_amounts']),
+                                 percentages=json.dumps(result['percentages']),
+                                 sell_percentages=json.dumps(result['sell_percentages'])))
+
+
+def ladder_file_contents(result, exchange):
+    """ The winning ladder in the form GEMINI_LADDER_FILE (or LADDER_FILE for main.py) loads. """
+    if exchange == "robinhood":
+        return {'PERCENTAGES': result['percentages'], 'PURCHASE_AMOUNTS': result['purchase_amounts']}
+    return {'GEMINI_PERCENTAGES': result['percentages'],
+            'GEMINI_SELL_PERCENTAGES': result['sell_percentages'],
+            'GEMINI_PURCHASE_AMOUNTS': result['purchase_amounts']}
+
+
+def print_ranked(results, top):
+    ranked_stats = PrettyTable()
+    ranked_stats.field_names = ["Rank", "Config", "PnL", "Return %", "Max DD", "Capital", "Fees", "Buys", "Sells",
+                                "Max Lots", "Buy %", "Sell %", "Amounts"]
+    for position, result in enumerate(results[:top], 1):
+        ranked_stats.add_row([position, result['config'], result['pnl'], result['return_on_capital'],
+                              result['max_drawdown'], result['max_capital'], result['fees'], result['buys'],
+                              result['sells'], result['max_lots'], result['percentages'][:3],
+                              result['sell_percentages'][:3], result['purchase_amounts'][:3]])
+    print(ranked_stats.get_string())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep purchase/percentage ladders over historical candles")
+    parser.add_argument("candles_dir", help="directory with one <symbol>.csv of minute candles per symbol")
+    parser.add_argument("--symbols", nargs="+", default=GEMINI_CRYPTO_LIST)
+    parser.add_argument("--exchange", choices=["gemini", "robinhood"], default="gemini")
+    parser.add_argument("--grid", help="JSON file overriding GEMINI_SWEEP_GRID")
+    parser.add_argument("--ladder-length", type=int, default=GEMINI_SWEEP_LADDER_LENGTH)
+    parser.add_argument("--max-lots", type=int)
+    parser.add_argument("--fee-bps", type=float, default=GEMINI_SWEEP_FEE_BPS)
+    parser.add_argument("--spread-bps", type=float, default=GEMINI_SWEEP_SPREAD_BPS)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--chunk", type=int, default=GEMINI_SWEEP_CHUNK)
+    parser.add_argument("--rank-by", choices=["return_on_capital", "pnl", "calmar"], default="return_on_capital")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--out", default="sweep_ranked.csv")
+    parser.add_argument("--winner", default="ladder.json")
+    args = parser.parse_args()
+
+    sweep_grid = dict(GEMINI_SWEEP_GRID)
+    if args.grid:
+        with open(args.grid) as f:
+            sweep_grid.update(json.load(f))
+    sweep_params, sweep_purchase, sweep_closeness, sweep_sell = build_ladders(sweep_grid, args.ladder_length)
+    if args.exchange == "robinhood":
+        # the Robinhood bot sells everything at its closeness percentage
+        sweep_sell = sweep_closeness
+        sweep_max_lots = args.max_lots or args.ladder_length
+        sweep_sell_last_above = sweep_max_lots
+    else:
+        # the ladders in gemini_constants run as config 0, the baseline to beat
+        sweep_params = [{name: None for name in sweep_grid}] + sweep_params
+        sweep_purchase = np.vstack([np.resize(GEMINI_PURCHASE_AMOUNTS, args.ladder_length), sweep_purchase])
+        sweep_closeness = np.vstack([np.resize(GEMINI_PERCENTAGES, args.ladder_length), sweep_closeness])
+        sweep_sell = np.vstack([np.resize(GEMINI_SELL_PERCENTAGES, args.ladder_length), sweep_sell])
+        sweep_max_lots = args.max_lots or GEMINI_NO_OF_OUTSTANDING_TRADES
+        sweep_sell_last_above = GEMINI_SWEEP_SELL_LAST_ABOVE
+
+    sweep_files = {symbol: os.path.join(args.candles_dir, symbol + ".csv") for symbol in args.symbols
+                   if os.path.exists(os.path.join(args.candles_dir, symbol + ".csv"))}
+    sweep = LadderSweep(sweep_files, sweep_params, sweep_purchase, sweep_closeness, sweep_sell,
+                        max_lots=sweep_max_lots, sell_last_above=sweep_sell_last_above, fee_bps=args.fee_bps,
+                        spread_bps=args.spread_bps, chunk=args.chunk, processes=args.processes)
+    ranked = rank(sweep.run(), args.rank_by)
+    print_ranked(ranked, args.top)
+    write_ranked_csv(ranked, args.out)
+    with open(args.winner, 'w') as f:
+        json.dump(ladder_file_contents(ranked[0], args.exchange), f, indent=2)
+    print("Ranked configs in", args.out, "winning ladder in", args.winner)
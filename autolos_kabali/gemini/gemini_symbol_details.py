@@ -0,0 +1,105 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT as g
+
+_SYMBOL_DETAILS = {}
+_SYMBOL_DETAILS_LOCK = threading.Lock()
+_SYMBOL_DETAILS_STATE = {'fetched_at': 0.0, 'refresher': None}
+
+
+def fetch_symbol_details(symbol):
+    """ Gets the trading rules of a symbol.
+    :Dictionary Keys: * symbol - BTCUSD etc.
+                      * tick_size - Smallest quantity increment
+                      * quote_increment - Smallest price increment
+                      * min_order_size - Smallest quantity that can be ordered
+                      * status - open, closed, cancel_only etc.
+    """
+    symbol_details, _ = g.get_symbol_details(symbol, True)
+    return symbol, symbol_details
+
+
+def fetch_all_symbol_details(symbols):
+    with ThreadPoolExecutor(max_workers=GEMINI_SNAPSHOT_BATCH_SIZE) as executor:
+        return dict(executor.map(fetch_symbol_details, symbols))
+
+
+def save_symbol_details():
+    with _SYMBOL_DETAILS_LOCK:
+        data = {'fetched_at': _SYMBOL_DETAILS_STATE['fetched_at'], 'symbols': dict(_SYMBOL_DETAILS)}
+    tmp_file = GEMINI_SYMBOL_DETAILS_FILE + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, GEMINI_SYMBOL_DETAILS_FILE)
+
+
+def load_symbol_details():
+    if not os.path.exists(GEMINI_SYMBOL_DETAILS_FILE):
+        return False
+    try:
+        with open(GEMINI_SYMBOL_DETAILS_FILE) as f:
+            data = json.load(f)
+    except ValueError as e:
+        print("Symbol details: ignoring unreadable", GEMINI_SYMBOL_DETAILS_FILE, e)
+        return False
+    with _SYMBOL_DETAILS_LOCK:
+        _SYMBOL_DETAILS.update(data['symbols'])
+        _SYMBOL_DETAILS_STATE['fetched_at'] = data['fetched_at']
+    return True
+
+
+def refresh_symbol_details(symbols=GEMINI_CRYPTO_LIST):
+    details = fetch_all_symbol_details(symbols)
+    with _SYMBOL_DETAILS_LOCK:
+        changed = [symbol for symbol in details if _SYMBOL_DETAILS.get(symbol) != details[symbol]]
+        _SYMBOL_DETAILS.update(details)
+        _SYMBOL_DETAILS_STATE['fetched_at'] = time.time()
+    for symbol in changed:
+        print("Symbol details:", symbol, "updated", details[symbol])
+    save_symbol_details()
+    return changed
+
+
+def symbol_details_age():
+    return time.time() - _SYMBOL_DETAILS_STATE['fetched_at']
+
+
+def _refresh_forever(symbols):
+    while True:
+        time.sleep(max(GEMINI_SYMBOL_DETAILS_TTL - symbol_details_age(), 0.0))
+        try:
+            refresh_symbol_details(symbols)
+        except Exception as e:
+            print("Symbol details: background refresh failed", e)
+            time.sleep(60)
+
+
+def init_symbol_details(symbols=GEMINI_CRYPTO_LIST):
+    loaded = load_symbol_details()
+    if not loaded or any(symbol not in _SYMBOL_DETAILS for symbol in symbols):
+        refresh_symbol_details(symbols)
+    if _SYMBOL_DETAILS_STATE['refresher'] is None:
+        refresher = threading.Thread(target=_refresh_forever, args=(symbols,), daemon=True)
+        refresher.start()
+        _SYMBOL_DETAILS_STATE['refresher'] = refresher
+
+
+def get_symbol_details(symbol):
+    if _SYMBOL_DETAILS_STATE['refresher'] is None and symbol_details_age() > GEMINI_SYMBOL_DETAILS_TTL:
+        refresh_symbol_details(sorted(set(_SYMBOL_DETAILS) | {symbol}))
+    symbol_details = _SYMBOL_DETAILS.get(symbol)
+    if symbol_details is None:
+        _, symbol_details = fetch_symbol_details(symbol)
+        with _SYMBOL_DETAILS_LOCK:
+            _SYMBOL_DETAILS[symbol] = symbol_details
+        save_symbol_details()
+    return symbol_details
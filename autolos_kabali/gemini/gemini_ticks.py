@@ -0,0 +1,125 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN
+
+import numpy as np
+
+ONE = Decimal(1)
+
+
+def scaled(value, places, step=1, rounding=ROUND_HALF_EVEN):
+    """ value * 10 ** places / step rounded to an integer, exactly. value is a decimal string or a float, taken
+    as its shortest repr. Plain strings that land on the grid are parsed as integers, the rest go through Decimal.
+    """
+    text = value if isinstance(value, str) else repr(float(value))
+    whole, point, fraction = text.partition('.')
+    if whole.isdigit() and len(fraction) <= places and (not point or fraction.isdigit()):
+        units = int(whole + fraction.ljust(places, '0'))
+        if step == 1:
+            return units
+        ticks, remainder = divmod(units, step)
+        if remainder == 0:
+            return ticks
+    return int((Decimal(text).scaleb(places) / step).quantize(ONE, rounding))
+
+
+class TickGrid:
+    """ Prices or quantities of one increment as integers counting increments.
+
+    The increment (a symbol's quote_increment or tick_size, as the symbol details have it) is step * 10 ** -places
+    with step an integer, so a value converts to ticks and back without any float rounding on the way. Stepping,
+    comparing and the notional math are integer arithmetic on the ticks, so it applies unchanged to numpy integer
+    arrays; strings are made only for the exchange, by to_string.
+
+    to_ticks, below and above parse one value, a string off the wire or a float. floor_ticks, ceil_ticks,
+    round_ticks, below_ticks and above_ticks do the same for a numpy array of floats at once, with the same
+    result as taking each float by its shortest repr.
+    """
+
+    def __init__(self, increment):
+        increment = Decimal(increment if isinstance(increment, str) else repr(float(increment))).normalize()
+        self.places = max(-increment.as_tuple().exponent, 0)
+        self.step = int(increment.scaleb(self.places))
+        self.scale = 10 ** self.places
+
+    def to_ticks(self, value, rounding=ROUND_HALF_EVEN):
+        return scaled(value, self.places, self.step, rounding)
+
+    def below(self, value):
+        """ Ticks of the highest price under value, None when value is one tick or less and there is none. """
+        ticks = scaled(value, self.places, self.step, ROUND_CEILING) - 1
+        return ticks if ticks >= 1 else None
+
+    def above(self, value):
+        """ Ticks of the lowest price over value. """
+        return scaled(value, self.places, self.step, ROUND_FLOOR) + 1
+
+    def floor_ticks(self, values):
+        """ Ticks of the highest price at or under each of values. """
+        values = np.asarray(values, dtype=float)
+        ticks = np.rint(values * self.scale / self.step).astype(np.int64)
+        # the product can miss by an ulp, the nearest tick decides against the correctly rounded float of it
+        return np.where(self.to_float(ticks) <= values, ticks, ticks - 1)
+
+    def ceil_ticks(self, values):
+        """ Ticks of the lowest price at or over each of values. """
+        values = np.asarray(values, dtype=float)
+        ticks = np.rint(values * self.scale / self.step).astype(np.int64)
+        return np.where(self.to_float(ticks) >= values, ticks, ticks + 1)
+
+    def round_ticks(self, values):
+        """ Ticks nearest each of values, ties to even like to_ticks. """
+        values = np.asarray(values, dtype=float)
+        floor = self.floor_ticks(values)
+        middle = (2 * floor + 1) * self.step / (2 * self.scale)
+        return np.where(values > middle, floor + 1, np.where(values < middle, floor, floor + floor % 2))
+
+    def below_ticks(self, values):
+        """ below for each of values, ticks under 1 where there is no price under the value. """
+        return self.ceil_ticks(values) - 1
+
+    def above_ticks(self, values):
+        """ above for each of values. """
+        return self.floor_ticks(values) + 1
+
+    def to_float(self, ticks):
+        # int / int is correctly rounded, the float nearest the exact value
+        return ticks * self.step / self.scale
+
+    def to_string(self, ticks):
+        units = ticks * self.step
+        digits = str(abs(units))
+        if self.places > 0:
+            digits = digits.rjust(self.places + 1, '0')
+            digits = digits[:-self.places] + '.' + digits[-self.places:]
+        return '-' + digits if units < 0 else digits
+
+    def round(self, value):
+        """ value rounded to the nearest tick, as a float. """
+        if self.step == 1 and not isinstance(value, str):
+            # the same tick, round() takes it from the float's exact value without going through a string
+            return round(float(value), self.places)
+        return self.to_float(self.to_ticks(value))
+
+
+GEMINI_TICK_GRIDS = {}
+
+
+def tick_grid(increment):
+    grid = GEMINI_TICK_GRIDS.get(increment)
+    if grid is None:
+        grid = GEMINI_TICK_GRIDS[increment] = TickGrid(increment)
+    return grid
+
+
+def quantity_ticks(amount, price_ticks, prices, quantities):
+    """ Quantity ticks closest to amount at price_ticks, halves rounded up. """
+    amount_units = scaled(amount, prices.places + quantities.places)
+    price_units = price_ticks * prices.step * quantities.step
+    return (2 * amount_units + price_units) // (2 * price_units)
+
+
+def notional(price_ticks, prices, quantity, quantities):
+    """ Price times quantity (in ticks of quantities) as a float, from the exact integer product. """
+    return price_ticks * prices.step * quantity * quantities.step / (prices.scale * quantities.scale)
@@ -1,24 +1,29 @@
 # Gemini Trading bot
 # Author: Deepak Dasarathan
 
+import signal
+import sys
+import threading
 import time
 import traceback
 
-from robin_stocks import gemini as g
-
-from autolos_kabali.gemini.gemini_buy_logic import buy_trade_logic
+from autolos_kabali.gemini.gemini_async_engine import evaluate_and_reschedule, run_engine
+from autolos_kabali.gemini.gemini_cadence import GEMINI_CADENCE
 from autolos_kabali.gemini.gemini_constants import *
-from autolos_kabali.gemini.gemini_sell_logic import sell_logic_hybrid
+from autolos_kabali.gemini.gemini_helper import GEMINI_BALANCES, GEMINI_STOPPING, has_open_order, refresh_balances, \
+    symbol_lock
+from autolos_kabali.gemini.gemini_http_pool import init_http_pool
+from autolos_kabali.gemini.gemini_market_snapshot import refresh_market_snapshot, seed_candles
+from autolos_kabali.gemini.gemini_metrics import GEMINI_METRICS, init_metrics
+from autolos_kabali.gemini.gemini_order_events import start_order_events
 from autolos_kabali.gemini.gemini_stats import print_state
+from autolos_kabali.gemini.gemini_symbol_details import init_symbol_details
+from autolos_kabali.gemini.gemini_transport import GEMINI_TRANSPORT as g, init_transport
 
 
 def crypto_trading_logic(symbol):
     try:
-        # Run the buy algorithm
-        buy_trade_logic(symbol)
-
-        # Run the sell algorithm
-        sell_logic_hybrid(symbol)
+        evaluate_and_reschedule(symbol)
 
     except Exception as e:
         print(e)
@@ -31,16 +36,62 @@ def login_to_gemini(api_key, secret_key):
     g.login(api_key, secret_key)
 
 
+def drain_and_exit():
+    """ Waits for the evaluations and orders in flight, so their fills are booked, then exits the worker. """
+    for symbol in GEMINI_CRYPTO_LIST:
+        with symbol_lock(symbol):
+            pass
+    deadline = time.monotonic() + GEMINI_ORDER_TIMEOUT
+    while any(has_open_order(symbol) for symbol in GEMINI_CRYPTO_LIST) and time.monotonic() < deadline:
+        time.sleep(GEMINI_ORDER_POLL_INTERVAL)
+    print("Worker", GEMINI_WORKER + ": stopped")
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def stop_worker(signum, frame):
+    if GEMINI_STOPPING.is_set():
+        return
+    print("Worker", GEMINI_WORKER + ": stopping")
+    GEMINI_STOPPING.set()
+    # drained on a thread, the main thread may be the one evaluating a symbol
+    threading.Thread(target=drain_and_exit, name="gemini-stop", daemon=True).start()
+
+
 if __name__ == '__main__':
 
+    if GEMINI_WORKER is not None:
+        signal.signal(signal.SIGTERM, stop_worker)
+    init_transport()
+    init_metrics()
+    init_http_pool()
     login_to_gemini(GEMINI_API_KEY, GEMINI_SECRET_KEY)
+    init_symbol_details(GEMINI_CRYPTO_LIST)
+    if GEMINI_CANDLES_ENABLED:
+        seed_candles(GEMINI_CRYPTO_LIST)
+    GEMINI_BALANCES.load()
+    if GEMINI_ORDER_EVENTS:
+        start_order_events()
+
+    if GEMINI_ASYNC_ENGINE:
+        run_engine(GEMINI_CRYPTO_LIST)
 
     run_count = 0
 
     while True:
-        for crypto in GEMINI_CRYPTO_LIST:
+        symbols = GEMINI_CADENCE.due() if GEMINI_POLL_CADENCE else GEMINI_CRYPTO_LIST
+        if not symbols:
+            time.sleep(GEMINI_CADENCE.wait())
+            continue
+        started = time.monotonic()
+        refresh_market_snapshot(symbols)
+        refresh_balances()
+        for crypto in symbols:
             crypto_trading_logic(crypto)
+        GEMINI_METRICS.end_cycle(time.monotonic() - started)
         if run_count % 10 == 0:
             print("Run count:", run_count)
+            if GEMINI_TRANSPORT_MODE != "live":
+                print(g.summary())
             print_state()
         run_count = run_count + 1
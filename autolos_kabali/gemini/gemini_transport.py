@@ -0,0 +1,83 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+import robin_stocks.gemini.account as robin_account
+import robin_stocks.gemini.authentication as robin_authentication
+import robin_stocks.gemini.crypto as robin_crypto
+import robin_stocks.gemini.helper as robin_helper
+import robin_stocks.gemini.orders as robin_orders
+from requests import exceptions
+from robin_stocks import gemini as robin_gemini
+
+from autolos_kabali.gemini.gemini_constants import *
+from autolos_kabali.main.exchange_transport import Transport, RecordingBackend, ReplayBackend, RequestScheduler
+
+
+class GeminiNonce:
+    """ Nonces of the API key, strictly increasing across every request signed in this process.
+
+    Gemini rejects a nonce that is not above the last one it saw for the key. The REST calls and the order events
+    handshake both take theirs here: the time in milliseconds, or one above the last nonce when calls come faster.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            self.last = max(self.last + 1, int(self.clock() * 1000))
+            return self.last
+
+
+GEMINI_NONCE = GeminiNonce()
+
+
+def generate_signature(payload):
+    """ robin_stocks' generate_signature with the nonce from GEMINI_NONCE. Its own is the time in whole seconds
+    plus a call counter, which runs ahead of the clock once the bot has made more than 1000 calls.
+    """
+    payload["nonce"] = str(GEMINI_NONCE.next())
+    encoded_payload = base64.b64encode(json.dumps(payload).encode())
+    signature = hmac.new(robin_helper.get_secret_key(), encoded_payload, hashlib.sha384).hexdigest()
+    robin_helper.update_session("X-GEMINI-PAYLOAD", encoded_payload)
+    robin_helper.update_session("X-GEMINI-SIGNATURE", signature)
+
+
+# the modules imported generate_signature by name, each gets the replacement
+for robin_module in (robin_account, robin_authentication, robin_crypto, robin_orders):
+    robin_module.generate_signature = generate_signature
+
+# Every robin_stocks.gemini call of the bot goes through here, modules import it as g
+GEMINI_TRANSPORT = Transport(robin_gemini, "Gemini")
+
+
+def init_transport(mode=GEMINI_TRANSPORT_MODE, transport_file=GEMINI_TRANSPORT_FILE):
+    """ Points GEMINI_TRANSPORT at the backend of the mode, see GEMINI_TRANSPORT_MODE. """
+    if mode == "record":
+        GEMINI_TRANSPORT.use(RecordingBackend(robin_gemini, transport_file))
+    elif mode == "replay":
+        GEMINI_TRANSPORT.use(ReplayBackend(transport_file, robin_gemini, GEMINI_REPLAY_LATENCY_SCALE,
+                                           exceptions.ConnectionError))
+    elif mode == "mock":
+        # imported here, the mock is not needed live
+        from autolos_kabali.gemini.gemini_mock_exchange import MockGeminiExchange
+        exchange = MockGeminiExchange()
+        exchange.serve()
+        GEMINI_TRANSPORT.use(exchange)
+    elif mode != "live":
+        raise ValueError("Unknown Gemini transport mode " + mode)
+    if GEMINI_REQUEST_SCHEDULER:
+        GEMINI_TRANSPORT.scheduler = RequestScheduler(GEMINI_RATE_LIMITS, GEMINI_REQUEST_ROUTES,
+                                                      GEMINI_REQUEST_HEADROOM, GEMINI_SHARED_REQUESTS,
+                                                      "Gemini scheduler")
+    print("Gemini transport:", mode)
+    return GEMINI_TRANSPORT.backend
@@ -0,0 +1,47 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import threading
+from typing import NamedTuple, Optional
+
+
+class GeminiTriggers(NamedTuple):
+    """ Prices a symbol's lot book triggers at. buy_cost is None without lots, the buy trigger then follows the
+    dip window's high: buy_at = (buy_cost or high) * buy_factor. sell_at is the price sell_logic_hybrid sells at,
+    on the average cost up to 6 lots and on the lowest lot above that, None without lots.
+    """
+    buy_cost: Optional[float]
+    buy_factor: float
+    can_buy: bool
+    trading_amount: float
+    sell_at: Optional[float]
+    sell_at_total: float
+    sell_at_recent_trade: float
+
+
+class GeminiTriggerIndex:
+    """ The GeminiTriggers of every symbol, recomputed only when its lot book changes.
+
+    compute(symbol, book) builds a symbol's triggers; books maps symbols to their LotBook. An entry stays valid
+    while the symbol has the same book at the same version, so checking a quote against the triggers costs a
+    couple of comparisons and no lot is looked at until a trade books or closes one.
+    """
+
+    def __init__(self, compute, books):
+        self.compute = compute
+        self.books = books
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, symbol):
+        book = self.books[symbol]
+        with self.lock:
+            entry = self.entries.get(symbol)
+        if entry is not None and entry[0] is book and entry[1] == book.version:
+            return entry[2]
+        # taken before computing, a change made meanwhile leaves the entry stale instead of wrong
+        version = book.version
+        triggers = self.compute(symbol, book)
+        with self.lock:
+            self.entries[symbol] = (book, version, triggers)
+        return triggers
@@ -0,0 +1,253 @@
+# Trading bot balance ledger
+# Author: Deepak Dasarathan
+
+import itertools
+import math
+import sqlite3
+import threading
+import time
+
+BALANCE_DRIFT_TOLERANCE = 1e-6
+CASH_BUSY_TIMEOUT_MS = 5000
+
+_CASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cash (
+    exchange TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    amount REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (exchange, currency)
+);
+CREATE TABLE IF NOT EXISTS cash_reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exchange TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    amount REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cash_reservations_owner ON cash_reservations (exchange, owner);
+"""
+
+
+class SqliteCash:
+    """ Balances of the currencies several processes trading one account spend, e.g. USD, and their
+    reservations, in SQLite (WAL) so a reservation sees every other process's.
+
+    reserve() checks the balance less every owner's reservations and inserts its own in one BEGIN IMMEDIATE
+    transaction, so two processes cannot both take the last dollars. settle() books a fill and drops the
+    reservation together. publish() adopts an exchange balance only while nothing is reserved, like
+    BalanceLedger.reconcile(). release_owner() drops what a process that died still held.
+    """
+
+    def __init__(self, db_file, exchange, owner, currencies=("usd",)):
+        self.exchange = exchange
+        self.owner = owner
+        self.currencies = set(currencies)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA busy_timeout=" + str(CASH_BUSY_TIMEOUT_MS))
+        self.connection.executescript(_CASH_SCHEMA)
+
+    def transaction(self, operation):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(cursor)
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            return result
+
+    def balance(self, cursor, currency):
+        row = cursor.execute("SELECT amount FROM cash WHERE exchange = ? AND currency = ?",
+                             (self.exchange, currency)).fetchone()
+        return None if row is None else row[0]
+
+    def reserved(self, cursor, currency):
+        return cursor.execute("SELECT COALESCE(SUM(amount), 0.0) FROM cash_reservations"
+                              " WHERE exchange = ? AND currency = ?", (self.exchange, currency)).fetchone()[0]
+
+    def amount(self, currency, default=0.0):
+        balance = self.transaction(lambda cursor: self.balance(cursor, currency))
+        return default if balance is None else balance
+
+    def available(self, currency, default=0.0):
+        def available(cursor):
+            balance = self.balance(cursor, currency)
+            return default if balance is None else balance - self.reserved(cursor, currency)
+        return self.transaction(available)
+
+    def reserve(self, currency, amount):
+        """ Returns the reservation's row id, or None when less than amount is available. """
+        def reserve(cursor):
+            available = (self.balance(cursor, currency) or 0.0) - self.reserved(cursor, currency)
+            if amount > available and not math.isclose(amount, available):
+                return None
+            cursor.execute("INSERT INTO cash_reservations (exchange, currency, owner, amount, created_at)"
+                           " VALUES (?, ?, ?, ?, ?)", (self.exchange, currency, self.owner, amount, time.time()))
+            return cursor.lastrowid
+        return self.transaction(reserve)
+
+    def release(self, reservation):
+        self.transaction(lambda cursor: cursor.execute("DELETE FROM cash_reservations WHERE id = ?", (reservation,)))
+
+    def settle(self, reservation, currency, change):
+        def settle(cursor):
+            if reservation is not None:
+                cursor.execute("DELETE FROM cash_reservations WHERE id = ?", (reservation,))
+            cursor.execute("UPDATE cash SET amount = amount + ?, updated_at = ? WHERE exchange = ? AND currency = ?",
+                           (change, time.time(), self.exchange, currency))
+        self.transaction(settle)
+
+    def publish(self, currency, amount):
+        """ Adopts the exchange's amount unless a reservation is outstanding. Returns the amount it replaced, None
+        when there was none or the table's was kept.
+        """
+        def publish(cursor):
+            previous = self.balance(cursor, currency)
+            if previous is not None and self.reserved(cursor, currency) > 0.0:
+                return None
+            cursor.execute("INSERT OR REPLACE INTO cash (exchange, currency, amount, updated_at) VALUES (?, ?, ?, ?)",
+                           (self.exchange, currency, amount, time.time()))
+            return previous
+        return self.transaction(publish)
+
+    def release_owner(self, owner):
+        """ Drops every reservation of owner, returns how many there were. """
+        return self.transaction(lambda cursor: cursor.execute("DELETE FROM cash_reservations"
+                                                              " WHERE exchange = ? AND owner = ?",
+                                                              (self.exchange, owner)).rowcount)
+
+
+class BalanceLedger:
+    """ Local view of the account balances, shared by every symbol.
+
+    fetch_fn() returns {currency: amount} for all currencies in one round trip. Balances are loaded once and
+    then kept current locally: reserve() holds cash (or coin) for an order being placed and fails instead of
+    over-committing, settle() books the fill of that order and frees what it did not use. reconcile() fetches
+    again at most every reconcile_interval seconds, prints any drift from the local balances (fees, deposits,
+    manual trades) and adopts the exchange values. Currencies with a reservation outstanding keep their local
+    value until the order settles, so a fill racing the fetch is not counted twice.
+
+    With shared (a SqliteCash) the balance and reservations of shared.currencies live in its table instead, for
+    processes trading disjoint symbols of one account against the same cash.
+    """
+
+    def __init__(self, fetch_fn, reconcile_interval=300.0, name="balances", shared=None):
+        self.fetch_fn = fetch_fn
+        self.reconcile_interval = reconcile_interval
+        self.name = name
+        self.shared = shared
+        self.shared_reservations = {}
+        self.balances = {}
+        self.reservations = {}
+        self.reservation_ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.reconciled_at = None
+        self.drift = {}
+
+    def reserved(self, currency):
+        with self.lock:
+            return sum(amount for reserved_currency, amount in self.reservations.values()
+                       if reserved_currency == currency)
+
+    def is_shared(self, currency):
+        return self.shared is not None and currency in self.shared.currencies
+
+    def amount(self, currency, default=0.0):
+        if self.is_shared(currency.lower()):
+            return self.shared.amount(currency.lower(), default)
+        with self.lock:
+            return self.balances.get(currency.lower(), default)
+
+    def available(self, currency, default=0.0):
+        currency = currency.lower()
+        if self.is_shared(currency):
+            return self.shared.available(currency, default)
+        with self.lock:
+            if currency not in self.balances:
+                return default
+            return self.balances[currency] - self.reserved(currency)
+
+    def reserve(self, currency, amount):
+        """ Returns a reservation id, or None when less than amount is available. """
+        currency = currency.lower()
+        with self.lock:
+            if self.is_shared(currency):
+                shared_reservation = self.shared.reserve(currency, amount)
+                if shared_reservation is None:
+                    return None
+            elif amount > self.available(currency) and not math.isclose(amount, self.available(currency)):
+                return None
+            reservation = next(self.reservation_ids)
+            self.reservations[reservation] = (currency, amount)
+            if self.is_shared(currency):
+                self.shared_reservations[reservation] = shared_reservation
+            return reservation
+
+    def release(self, reservation):
+        with self.lock:
+            self.reservations.pop(reservation, None)
+            shared_reservation = self.shared_reservations.pop(reservation, None)
+            if shared_reservation is not None:
+                self.shared.release(shared_reservation)
+
+    def settle(self, reservation, changes):
+        """ Books the fill of an order, changes maps currency to its signed change, e.g. {"usd": -10.0}. """
+        with self.lock:
+            reserved_currency = self.reservations.pop(reservation, (None, 0.0))[0]
+            shared_reservation = self.shared_reservations.pop(reservation, None)
+            for currency, change in changes.items():
+                currency = currency.lower()
+                self.balances[currency] = self.balances.get(currency, 0.0) + change
+                if self.is_shared(currency):
+                    self.shared.settle(shared_reservation if currency == reserved_currency else None, currency,
+                                       change)
+            if shared_reservation is not None and reserved_currency not in changes:
+                self.shared.release(shared_reservation)
+
+    def load(self):
+        balances = self.fetch_fn()
+        with self.lock:
+            self.balances = {currency.lower(): amount for currency, amount in balances.items()}
+            self.reconciled_at = time.monotonic()
+            if self.shared is not None:
+                for currency in self.shared.currencies:
+                    self.shared.publish(currency, self.balances.get(currency, 0.0))
+
+    def reconcile(self, force=False):
+        """ Called once per cycle, only fetches when the reconcile interval passed. """
+        if self.reconciled_at is None:
+            self.load()
+            return
+        if not force and time.monotonic() - self.reconciled_at < self.reconcile_interval:
+            return
+        try:
+            balances = {currency.lower(): amount for currency, amount in self.fetch_fn().items()}
+        except Exception as e:
+            # keep trading on the local balances, the next cycle tries again
+            print(self.name + ": Balance reconcile failed", e)
+            return
+        with self.lock:
+            self.reconciled_at = time.monotonic()
+            busy = {currency for currency, _ in self.reservations.values()}
+            self.drift = {}
+            for currency in set(balances) | set(self.balances):
+                if currency in busy:
+                    continue
+                local = self.balances.get(currency, 0.0)
+                exchange = balances.get(currency, 0.0)
+                if self.is_shared(currency):
+                    # every process reconciles the shared currencies, the first to adopt a new amount prints the drift
+                    local = self.shared.publish(currency, exchange)
+                    if local is None:
+                        local = exchange
+                if not math.isclose(local, exchange, rel_tol=BALANCE_DRIFT_TOLERANCE, abs_tol=1e-8):
+                    self.drift[currency] = exchange - local
+                    print(self.name + ": Balance drift", currency, "local", local, "exchange", exchange,
+                          "drift", exchange - local)
+                self.balances[currency] = exchange
@@ -0,0 +1,445 @@
+# Trading bot exchange transport
+# Author: Deepak Dasarathan
+
+import asyncio
+import copy
+import functools
+import json
+import math
+import random
+import threading
+import time
+import types
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+
+TRANSPORT_MODES = ("live", "record", "replay", "mock")
+
+# Request classes of the scheduler, most urgent first
+ORDER = 0
+MARKET = 1
+REPORTING = 2
+REQUEST_CLASSES = {ORDER: "order", MARKET: "market", REPORTING: "reporting"}
+
+
+def is_api_call(attribute):
+    return callable(attribute) and not isinstance(attribute, (types.ModuleType, type))
+
+
+class Transport:
+    """ The one path from a bot to its exchange API, e.g. robin_stocks.gemini.
+
+    Bots call the API functions on the transport as they did on the module, transport.order(...) calls
+    backend.order(...). use() swaps the backend: the live module, a RecordingBackend around it, a
+    ReplayBackend of a recorded session or a mock exchange. Attributes that are not API calls (modules like
+    robinhood.helper) pass through untouched. Every call is counted and timed, observers(name, method,
+    elapsed, error) are told about each one. With a scheduler (RequestScheduler) calls wait for their rate
+    budget first and identical reads in flight are made once.
+    """
+
+    def __init__(self, backend, name="exchange"):
+        self.backend = backend
+        self.name = name
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.elapsed = defaultdict(float)
+        self.observers = []
+        self.scheduler = None
+
+    def use(self, backend):
+        """ Swaps the backend, returns the previous one. """
+        previous = self.backend
+        self.backend = backend
+        return previous
+
+    @contextmanager
+    def using(self, backend):
+        previous = self.use(backend)
+        try:
+            yield backend
+        finally:
+            self.use(previous)
+
+    def priority(self, priority):
+        """ Context in which this thread's calls are scheduled no sooner than priority, e.g. REPORTING. """
+        return nullcontext() if self.scheduler is None else self.scheduler.priority(priority)
+
+    def call(self, method, *args, **kwargs):
+        if self.scheduler is not None:
+            return self.scheduler.run(method, args, kwargs, self.timed_call)
+        return self.timed_call(method, args, kwargs)
+
+    def timed_call(self, method, args, kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return getattr(self.backend, method)(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.counts[method] += 1
+                self.elapsed[method] += elapsed
+                if error is not None:
+                    self.errors[method] += 1
+            for observer in self.observers:
+                observer(self.name, method, elapsed, error)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attribute = getattr(self.backend, name)
+        if not is_api_call(attribute):
+            return attribute
+        return functools.partial(self.call, name)
+
+    def stats(self):
+        """ {method: (calls, errors, total seconds)} since the last reset. """
+        with self.lock:
+            return {method: (count, self.errors[method], self.elapsed[method]) for method, count in self.counts.items()}
+
+    def reset_stats(self):
+        with self.lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.elapsed.clear()
+
+    def summary(self):
+        stats = self.stats()
+        calls = sum(count for count, _, _ in stats.values())
+        summary = self.name + " transport: " + str(calls) + " calls " + ", ".join(
+            method + " " + str(count) + " (" + str(round(elapsed / count * 1000.0, 1)) + " ms)"
+            for method, (count, _, elapsed) in sorted(stats.items()))
+        if self.scheduler is not None:
+            summary = summary + "\n" + self.scheduler.summary()
+        return summary
+
+
+def json_key(args, kwargs):
+    return json.dumps([list(args), kwargs], sort_keys=True, default=str)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RequestScheduler:
+    """ Rate budget of an exchange's API, shared by the calls in order of urgency.
+
+    buckets is {bucket: (requests per second, burst)} after the exchange's limits, routes is {method: (bucket,
+    request class)}; methods without a route are not limited. A call takes a token of its bucket, an ORDER call
+    whenever one is left, while MARKET and REPORTING calls leave headroom[class] tokens in the bucket and also
+    wait while a more urgent call is waiting, so reporting never spends the budget of an order. priority() lowers
+    the class of this thread's MARKET calls (print_state runs under REPORTING), ORDER calls keep theirs.
+    A call of a method in shared (reads) that is already in flight with the same arguments is not sent again,
+    it gets a copy of that call's result.
+    """
+
+    def __init__(self, buckets, routes, headroom=None, shared=(), name="scheduler", clock=time.monotonic):
+        self.clock = clock
+        now = clock()
+        self.buckets = {bucket: TokenBucket(rate, burst, now) for bucket, (rate, burst) in buckets.items()}
+        self.routes = routes
+        self.headroom = headroom or {}
+        self.shared = set(shared)
+        self.name = name
+        self.condition = threading.Condition()
+        self.waiting = defaultdict(Counter)
+        self.inflight = {}
+        self.local = threading.local()
+        self.waits = Counter()
+        self.waited = defaultdict(float)
+        self.deduplicated = Counter()
+
+    @contextmanager
+    def priority(self, priority):
+        previous = getattr(self.local, 'priority', ORDER)
+        self.local.priority = max(previous, priority)
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def request_class(self, priority):
+        if priority == ORDER:
+            return priority
+        return max(priority, getattr(self.local, 'priority', ORDER))
+
+    def take(self, bucket, priority):
+        """ Takes a token when priority may have one now, else returns how long to wait. Holds the condition. """
+        tokens = self.buckets[bucket]
+        tokens.refill(self.clock())
+        if any(count > 0 for waiting, count in self.waiting[bucket].items() if waiting < priority):
+            return 1.0 / tokens.rate
+        # a bucket smaller than the headroom (a worker's share of the budget) still serves every class
+        needed = min(1.0 + self.headroom.get(priority, 0), tokens.burst)
+        if tokens.tokens >= needed:
+            tokens.tokens = tokens.tokens - 1.0
+            return 0.0
+        return (needed - tokens.tokens) / tokens.rate
+
+    def wait(self, bucket, priority):
+        """ Blocks until a request of class priority may be sent to bucket. """
+        started = self.clock()
+        with self.condition:
+            delay = self.take(bucket, priority)
+            if delay == 0.0:
+                return
+            self.waiting[bucket][priority] += 1
+            try:
+                while delay > 0.0:
+                    self.condition.wait(delay)
+                    delay = self.take(bucket, priority)
+            finally:
+                self.waiting[bucket][priority] -= 1
+                self.waits[priority] += 1
+                self.waited[priority] += self.clock() - started
+                self.condition.notify_all()
+
+    async def wait_async(self, bucket, priority):
+        """ wait() for a request sent from an event loop, which must not block on the condition. """
+        started = self.clock()
+        with self.condition:
+            delay = self.take(bucket, priority)
+            if delay == 0.0:
+                return
+            self.waiting[bucket][priority] += 1
+        try:
+            while delay > 0.0:
+                await asyncio.sleep(delay)
+                with self.condition:
+                    delay = self.take(bucket, priority)
+        finally:
+            with self.condition:
+                self.waiting[bucket][priority] -= 1
+                self.waits[priority] += 1
+                self.waited[priority] += self.clock() - started
+                self.condition.notify_all()
+
+    def acquire(self, method):
+        """ Waits for the budget of a call of method, for requests that do not go through a Transport. """
+        route = self.routes.get(method)
+        if route is not None:
+            self.wait(route[0], self.request_class(route[1]))
+
+    async def acquire_async(self, method):
+        route = self.routes.get(method)
+        if route is not None:
+            await self.wait_async(route[0], self.request_class(route[1]))
+
+    def run(self, method, args, kwargs, function):
+        """ function(method, args, kwargs) within the method's budget. """
+        if method not in self.routes:
+            return function(method, args, kwargs)
+        if method not in self.shared:
+            self.acquire(method)
+            return function(method, args, kwargs)
+        key = (method, json_key(args, kwargs))
+        with self.condition:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+            else:
+                self.deduplicated[method] += 1
+        if not leader:
+            return copy.deepcopy(future.result())
+        try:
+            self.acquire(method)
+            result = function(method, args, kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.condition:
+                del self.inflight[key]
+
+    def summary(self):
+        with self.condition:
+            return self.name + ": " + ", ".join(
+                REQUEST_CLASSES[priority] + " waited " + str(self.waits[priority]) + " times " +
+                str(round(self.waited[priority], 2)) + " s" for priority in sorted(REQUEST_CLASSES)) + \
+                ", deduplicated " + str(sum(self.deduplicated.values()))
+
+
+class RecordingBackend:
+    """ Calls the wrapped backend and appends every call to record_file as one JSON line:
+        {"time", "method", "args", "kwargs", "elapsed", "result"} or "error" instead of "result".
+    """
+
+    def __init__(self, backend, record_file):
+        self.backend = backend
+        self.record_file = record_file
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attribute = getattr(self.backend, name)
+        if not is_api_call(attribute):
+            return attribute
+        return functools.partial(self.record, name, attribute)
+
+    def record(self, method, function, *args, **kwargs):
+        entry = {'time': time.time(), 'method': method, 'args': list(args), 'kwargs': kwargs}
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            entry['result'] = result
+            return result
+        except Exception as e:
+            entry['error'] = type(e).__name__ + ": " + str(e)
+            raise
+        finally:
+            entry['elapsed'] = time.perf_counter() - started
+            line = json.dumps(entry, default=str)
+            with self.lock:
+                with open(self.record_file, 'a') as f:
+                    f.write(line + "\n")
+
+
+class ReplayBackend:
+    """ Serves the calls of a session recorded by RecordingBackend.
+
+    A call gets the recorded response of the same method and arguments, in recorded order; when the
+    arguments differ (a changed price or quantity) it gets the next unused response of the method. A recorded
+    error is raised again as error. latency_scale times the recorded elapsed time is slept before answering,
+    0.0 replays as fast as possible. Attributes that are not API calls come from local, e.g. the live module.
+    """
+
+    def __init__(self, record_file, local=None, latency_scale=1.0, error=ConnectionError):
+        self.local = local
+        self.latency_scale = latency_scale
+        self.error = error
+        self.lock = threading.Lock()
+        self.by_arguments = defaultdict(deque)
+        self.by_method = defaultdict(deque)
+        with open(record_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry['used'] = False
+                self.by_arguments[(entry['method'], json_key(entry['args'], entry['kwargs']))].append(entry)
+                self.by_method[entry['method']].append(entry)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self.local is not None and hasattr(self.local, name) and not is_api_call(getattr(self.local, name)):
+            return getattr(self.local, name)
+        return functools.partial(self.replay, name)
+
+    def next_entry(self, queue):
+        while queue and queue[0]['used']:
+            queue.popleft()
+        return queue.popleft() if queue else None
+
+    def replay(self, method, *args, **kwargs):
+        with self.lock:
+            entry = self.next_entry(self.by_arguments[(method, json_key(args, kwargs))]) or \
+                    self.next_entry(self.by_method[method])
+            if entry is None:
+                raise LookupError("Replay: no recorded response left for " + method)
+            entry['used'] = True
+        if self.latency_scale > 0.0:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        if 'error' in entry:
+            raise self.error(entry['error'])
+        return entry['result']
+
+
+class MockMarket:
+    """ Random walk prices of a set of symbols, advanced lazily on clock (the wall clock by default).
+
+    Each symbol moves by a normal step of volatility (relative) per step_interval seconds. The 24h open, high
+    and low are tracked from the first price on, hourly closes are kept for historicals. Every symbol draws
+    from its own generator, so with a seed and a virtual clock the prices do not depend on the order in which
+    concurrent callers ask for them.
+    """
+
+    def __init__(self, prices, volatility=0.001, step_interval=1.0, seed=None, clock=time.monotonic):
+        self.volatility = volatility
+        self.step_interval = step_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        now = clock()
+        self.prices = {}
+        for symbol, price in prices.items():
+            self.prices[symbol] = {'price': float(price), 'open': float(price), 'high': float(price),
+                                   'low': float(price), 'updated_at': now, 'hour_started': now,
+                                   'hourly': deque([float(price)], 24 * 7),
+                                   'random': random.Random(None if seed is None else str(seed) + symbol)}
+
+    def advance(self, symbol):
+        with self.lock:
+            state = self.prices[symbol]
+            now = self.clock()
+            steps = (now - state['updated_at']) / self.step_interval
+            if steps >= 1.0:
+                # steps independent normal moves add up to one with sqrt(steps) times the deviation
+                move = state['random'].gauss(0.0, self.volatility * math.sqrt(steps))
+                state['price'] = state['price'] * math.exp(move)
+                state['high'] = max(state['high'], state['price'])
+                state['low'] = min(state['low'], state['price'])
+                state['updated_at'] = now
+                state['hourly'][-1] = state['price']
+            if now - state['hour_started'] >= 60 * 60:
+                state['hourly'].append(state['price'])
+                state['hour_started'] = now
+            snapshot = {key: value for key, value in state.items() if key != 'random'}
+            snapshot['hourly'] = list(state['hourly'])
+            return snapshot
+
+    def price(self, symbol):
+        return self.advance(symbol)['price']
+
+
+class MockExchange:
+    """ Latency and error injection shared by the mock exchanges.
+
+    Every API call of a mock first sleeps latency plus a uniform jitter, then fails with error when the method
+    was scripted to by fail_next() or with probability error_rate (for the methods in error_methods, all of
+    them when it is None).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_methods=None, error=ConnectionError,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_methods = error_methods
+        self.error = error
+        self.fault_random = random.Random(seed)
+        self.scripted_failures = Counter()
+        self.fault_lock = threading.Lock()
+
+    def fail_next(self, method, count=1):
+        with self.fault_lock:
+            self.scripted_failures[method] += count
+
+    def api_call(self, method):
+        delay = self.latency + (self.fault_random.uniform(0.0, self.jitter) if self.jitter > 0.0 else 0.0)
+        if delay > 0.0:
+            time.sleep(delay)
+        with self.fault_lock:
+            if self.scripted_failures[method] > 0:
+                self.scripted_failures[method] -= 1
+                raise self.error("Mock exchange: injected failure of " + method)
+            if self.error_rate > 0.0 and (self.error_methods is None or method in self.error_methods) and \
+                    self.fault_random.random() < self.error_rate:
+                raise self.error("Mock exchange: injected failure of " + method)
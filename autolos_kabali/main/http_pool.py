@@ -0,0 +1,124 @@
+# Trading bot HTTP connection pool
+# Author: Deepak Dasarathan
+
+import importlib.util
+import threading
+import time
+
+import httpx
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_SIZE = 20
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10.0
+# httpx closes idle connections after 5 s by default, shorter than a quiet stream or a Robinhood cycle
+HTTP_KEEPALIVE_EXPIRY = 120.0
+
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+def origin(url):
+    url = httpx.URL(url)
+    return url.scheme + "://" + url.netloc.decode("ascii")
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """ requests adapter with a pool of pool_size keep-alive connections per host and a timeout for requests
+    sent without one (robin_stocks sends most of them without).
+    """
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), pool_size=HTTP_POOL_SIZE):
+        self.timeout = timeout
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+class HttpPool:
+    """ The HTTP connections of a bot, kept alive between calls so each host costs one TLS handshake.
+
+    client(url) returns the one httpx.Client of the url's host (HTTP/2 when http2 and the h2 package is
+    installed), async_client() a new httpx.AsyncClient with the same settings for an event loop. mount()
+    puts a TimeoutHTTPAdapter on a requests session, robin_stocks keeps its own requests.Session and stays on
+    HTTP/1.1. prewarm() opens the connections before the first cycle needs them.
+    """
+
+    def __init__(self, http2=False, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY, name="HTTP"):
+        if http2 and not http2_available():
+            print(name + ": HTTP/2 needs the h2 package, using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self.name = name
+        self.clients = {}
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def limits(self, max_connections=None):
+        max_connections = self.pool_size if max_connections is None else max_connections
+        return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def timeout(self):
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def client(self, url):
+        host = origin(url)
+        with self.lock:
+            client = self.clients.get(host)
+            if client is None:
+                client = self.clients[host] = httpx.Client(http2=self.http2, limits=self.limits(),
+                                                           timeout=self.timeout())
+            return client
+
+    def async_client(self, timeout=None, max_connections=None):
+        return httpx.AsyncClient(http2=self.http2, limits=self.limits(max_connections),
+                                 timeout=self.timeout() if timeout is None else timeout)
+
+    def mount(self, session):
+        adapter = TimeoutHTTPAdapter((self.connect_timeout, self.read_timeout), self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        with self.lock:
+            self.sessions.append(session)
+        return session
+
+    def prewarm(self, urls, session=None):
+        """ HEAD of every url through session, or the host's client, so the connection is open. Any response
+        will do, failures are printed and left to the first real call.
+        """
+        for url in urls:
+            started = time.perf_counter()
+            try:
+                if session is not None:
+                    session.head(url, timeout=(self.connect_timeout, self.read_timeout))
+                else:
+                    self.client(url).head(url)
+                print(self.name + ": connected to", origin(url), "in",
+                      round((time.perf_counter() - started) * 1000.0, 1), "ms")
+            except Exception as e:
+                print(self.name + ": could not prewarm", url, e)
+
+    async def async_prewarm(self, client, urls):
+        for url in urls:
+            started = time.perf_counter()
+            try:
+                await client.head(url)
+                print(self.name + ": connected to", origin(url), "in",
+                      round((time.perf_counter() - started) * 1000.0, 1), "ms")
+            except Exception as e:
+                print(self.name + ": could not prewarm", url, e)
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+        for client in clients:
+            client.close()
@@ -0,0 +1,76 @@
+# Trading bot lot book
+# Author: Deepak Dasarathan
+
+from bisect import bisect_left, bisect_right
+
+
+class LotBook:
+    """ Outstanding lots of one symbol, kept ordered by cost with running totals.
+
+    Behaves like the list it replaces (len, iteration, append, remove, in), so the lot stores and the stats
+    tables need no changes. Lots of equal cost keep their insertion order, so lowest matches the first lot
+    a linear scan would have picked. version counts the changes, for caches of values derived from the book.
+    """
+
+    def __init__(self, lots=()):
+        self._lots = []
+        self._costs = []
+        self.total_amount = 0.0
+        self.total_quantity = 0.0
+        self.version = 0
+        for lot in lots:
+            self.append(lot)
+
+    def append(self, lot):
+        cost = float(lot['cost'])
+        index = bisect_right(self._costs, cost)
+        self._costs.insert(index, cost)
+        self._lots.insert(index, lot)
+        self.total_amount = self.total_amount + float(lot['amount'])
+        self.total_quantity = self.total_quantity + float(lot['quantity'])
+        self.version = self.version + 1
+
+    def remove(self, lot):
+        cost = float(lot['cost'])
+        for index in range(bisect_left(self._costs, cost), bisect_right(self._costs, cost)):
+            if self._lots[index] == lot:
+                del self._costs[index]
+                del self._lots[index]
+                if self._lots:
+                    self.total_amount = self.total_amount - float(lot['amount'])
+                    self.total_quantity = self.total_quantity - float(lot['quantity'])
+                else:
+                    self.total_amount = 0.0
+                    self.total_quantity = 0.0
+                self.version = self.version + 1
+                return
+        raise ValueError("LotBook.remove(lot): lot not in book")
+
+    @property
+    def lowest(self):
+        return self._lots[0] if self._lots else {}
+
+    @property
+    def avg_cost(self):
+        if self.total_quantity > 0.0:
+            return self.total_amount / self.total_quantity
+        return 0.0
+
+    @property
+    def ladder_index(self):
+        return len(self._lots)
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __iter__(self):
+        return iter(self._lots)
+
+    def __getitem__(self, index):
+        return self._lots[index]
+
+    def __contains__(self, lot):
+        return lot in self._lots
+
+    def __repr__(self):
+        return "LotBook(" + repr(self._lots) + ")"
@@ -0,0 +1,377 @@
+# Trading bot lot persistence
+# Author: Deepak Dasarathan
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+LOT_JOURNAL_COMPACT_EVERY = 100
+LOT_STORE_DB_FILE = "lots.db"
+LOT_STORE_BUSY_TIMEOUT_MS = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    order_id TEXT,
+    cost REAL NOT NULL,
+    quantity REAL NOT NULL,
+    amount REAL NOT NULL,
+    created TEXT,
+    lot TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lots_exchange_symbol_cost ON lots (exchange, symbol, cost);
+CREATE INDEX IF NOT EXISTS lots_order_id ON lots (order_id);
+CREATE TABLE IF NOT EXISTS closed_lots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    order_id TEXT,
+    cost REAL NOT NULL,
+    quantity REAL NOT NULL,
+    amount REAL NOT NULL,
+    created TEXT,
+    close_price REAL,
+    closed_at REAL NOT NULL,
+    lot TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS closed_lots_exchange_symbol ON closed_lots (exchange, symbol, closed_at);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied_at REAL NOT NULL
+);
+"""
+
+
+def fsync_directory(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class LotJournal:
+    """ Write-ahead journal for an outstanding lots book.
+
+    Every mutation appends one fsync'd JSON line to <snapshot_file>.journal and is then applied in memory.
+    Every compact_every records the whole book is written atomically to snapshot_file and the journal is
+    truncated. Loading reads the snapshot and replays the journal tail, dropping a torn last line.
+    """
+
+    def __init__(self, snapshot_file, journal_file=None, compact_every=LOT_JOURNAL_COMPACT_EVERY, book_factory=list):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file or snapshot_file + ".journal"
+        self.compact_every = compact_every
+        self.book_factory = book_factory
+        self.lots = defaultdict(book_factory)
+        self.seq = 0
+        self.pending = 0
+        self.lock = threading.RLock()
+
+    def load(self):
+        with self.lock:
+            self.pending = self.read(repair=True)
+            if self.pending > 0:
+                self.compact()
+        return self.lots
+
+    def read(self, repair=False):
+        """ Reads the snapshot and replays the journal into self.lots without writing either, unless repair
+        drops a torn last line. Returns the number of journal records replayed.
+        """
+        with self.lock:
+            self.lots.clear()
+            self.seq = 0
+            if os.path.exists(self.snapshot_file):
+                with open(self.snapshot_file, 'rb') as f:
+                    snapshot = pickle.load(f)
+                if isinstance(snapshot, dict) and 'journal_seq' in snapshot:
+                    self.seq = snapshot['journal_seq']
+                    snapshot = snapshot['lots']
+                for symbol, lots in snapshot.items():
+                    self.lots[symbol] = self.book_factory(lots)
+            return self.replay(repair)
+
+    def replay(self, repair=True):
+        if not os.path.exists(self.journal_file):
+            return 0
+        replayed = 0
+        good_offset = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_offset = good_offset + len(line)
+                if record['seq'] <= self.seq:
+                    # already part of the snapshot, compaction was interrupted before truncating
+                    continue
+                self.apply(record)
+                self.seq = record['seq']
+                replayed = replayed + 1
+        if repair and good_offset < os.path.getsize(self.journal_file):
+            print("Lot journal: dropping torn record at the end of", self.journal_file)
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(good_offset)
+        return replayed
+
+    def apply(self, record):
+        op = record['op']
+        symbol = record['symbol']
+        if op == 'insert':
+            self.lots[symbol].append(record['lot'])
+        elif op == 'remove':
+            if record['lot'] in self.lots[symbol]:
+                self.lots[symbol].remove(record['lot'])
+        elif op == 'remove_coin':
+            self.lots.pop(symbol, None)
+        elif op == 'partial_fill':
+            if 'lot' not in record:
+                self.lots.pop(symbol, None)
+            elif record['lot'] in self.lots[symbol]:
+                self.lots[symbol].remove(record['lot'])
+            if 'remaining_lot' in record:
+                self.lots[symbol].append(record['remaining_lot'])
+        else:
+            raise ValueError("Unknown lot journal operation " + str(op))
+
+    def append(self, record):
+        self.seq = self.seq + 1
+        record['seq'] = self.seq
+        with open(self.journal_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = self.pending + 1
+
+    def record(self, op, symbol, **fields):
+        with self.lock:
+            record = {'op': op, 'symbol': symbol}
+            record.update((key, value) for key, value in fields.items() if value is not None)
+            self.append(record)
+            self.apply(record)
+            if self.pending >= self.compact_every:
+                self.compact()
+
+    def insert(self, symbol, lot):
+        self.record('insert', symbol, lot=lot)
+
+    def remove(self, symbol, lot, close_price=None):
+        self.record('remove', symbol, lot=lot, close_price=close_price)
+
+    def remove_coin(self, symbol, close_price=None):
+        self.record('remove_coin', symbol, close_price=close_price)
+
+    def partial_fill(self, symbol, lot, remaining_lot, close_price=None):
+        """ Closes lot (or every lot of the symbol when lot is None) and books what is left as one record. """
+        self.record('partial_fill', symbol, lot=lot, remaining_lot=remaining_lot, close_price=close_price)
+
+    def compact(self):
+        with self.lock:
+            snapshot = {'journal_seq': self.seq, 'lots': {symbol: list(lots) for symbol, lots in self.lots.items()}}
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            fsync_directory(self.snapshot_file)
+            with open(self.journal_file, 'w') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending = 0
+
+
+class MemoryLotStore(LotJournal):
+    """ Outstanding lots book that is never persisted, for backtests and dry runs. """
+
+    def __init__(self, book_factory=list):
+        super().__init__(None, os.devnull, book_factory=book_factory)
+
+    def load(self):
+        return self.lots
+
+    def append(self, record):
+        self.seq = self.seq + 1
+
+    def compact(self):
+        pass
+
+
+def lot_order_id(lot):
+    # Gemini lots carry 'order_id', Robinhood lots carry 'id'
+    order_id = lot.get('order_id', lot.get('id'))
+    return None if order_id is None else str(order_id)
+
+
+def lot_row(exchange, symbol, lot):
+    return (exchange,
+            symbol,
+            lot_order_id(lot),
+            float(lot['cost']),
+            float(lot['quantity']),
+            float(lot['amount']),
+            str(lot.get('created')),
+            json.dumps(lot, sort_keys=True))
+
+
+class SqliteLotStore:
+    """ Outstanding lots book backed by SQLite in WAL mode.
+
+    Shared by both bots through the exchange column, so dashboards can read it while the traders write.
+    Closed lots move to the closed_lots history table. The in-memory book in self.lots mirrors the table
+    for the trading logic and is only changed after the transaction commits.
+    """
+
+    def __init__(self, db_file, exchange, book_factory=list):
+        self.db_file = db_file
+        self.exchange = exchange
+        self.lots = defaultdict(book_factory)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=" + str(LOT_STORE_BUSY_TIMEOUT_MS))
+        self.connection.executescript(_SCHEMA)
+
+    def transaction(self, operations):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for operation in operations:
+                    operation(cursor)
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def load(self):
+        with self.lock:
+            self.lots.clear()
+            rows = self.connection.execute("SELECT symbol, lot FROM lots WHERE exchange = ? ORDER BY id",
+                                           (self.exchange,))
+            for symbol, lot in rows:
+                self.lots[symbol].append(json.loads(lot))
+        return self.lots
+
+    def migrate_from_lots_file(self, lots_file):
+        """ One-shot import of the pickled (or journaled) lots book, skipped once recorded in migrations. """
+        name = self.exchange + ":" + lots_file
+        with self.lock:
+            applied = self.connection.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone()
+            if applied:
+                return 0
+            # read only, the legacy file is left as it was
+            legacy = LotJournal(lots_file)
+            legacy.read()
+            legacy_lots = legacy.lots
+            rows = [lot_row(self.exchange, symbol, lot) for symbol, lots in legacy_lots.items() for lot in lots]
+
+            def migrate(cursor):
+                cursor.executemany("INSERT INTO lots (exchange, symbol, order_id, cost, quantity, amount, created, lot)"
+                                   " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                cursor.execute("INSERT INTO migrations (name, applied_at) VALUES (?, ?)", (name, time.time()))
+
+            self.transaction([migrate])
+        print("Lot store: migrated", len(rows), "lots from", lots_file)
+        return len(rows)
+
+    def _insert(self, symbol, lot):
+        def insert(cursor):
+            cursor.execute("INSERT INTO lots (exchange, symbol, order_id, cost, quantity, amount, created, lot)"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", lot_row(self.exchange, symbol, lot))
+        return insert
+
+    def _close(self, symbol, lot, close_price):
+        def close(cursor):
+            if lot is None:
+                selected = cursor.execute("SELECT id FROM lots WHERE exchange = ? AND symbol = ?",
+                                          (self.exchange, symbol)).fetchall()
+            else:
+                selected = cursor.execute("SELECT id FROM lots WHERE exchange = ? AND symbol = ? AND order_id IS ?"
+                                          " AND lot = ? ORDER BY id LIMIT 1",
+                                          (self.exchange, symbol, lot_order_id(lot),
+                                           json.dumps(lot, sort_keys=True))).fetchall()
+            closed_at = time.time()
+            cursor.executemany("INSERT INTO closed_lots (exchange, symbol, order_id, cost, quantity, amount, created,"
+                               " close_price, closed_at, lot)"
+                               " SELECT exchange, symbol, order_id, cost, quantity, amount, created, ?, ?, lot"
+                               " FROM lots WHERE id = ?",
+                               [(close_price, closed_at, row_id) for row_id, in selected])
+            cursor.executemany("DELETE FROM lots WHERE id = ?", [(row_id,) for row_id, in selected])
+        return close
+
+    def insert(self, symbol, lot):
+        with self.lock:
+            self.transaction([self._insert(symbol, lot)])
+            self.lots[symbol].append(lot)
+
+    def remove(self, symbol, lot, close_price=None):
+        with self.lock:
+            self.transaction([self._close(symbol, lot, close_price)])
+            # like LotJournal.apply, a lot the book no longer holds is already closed in memory
+            if lot in self.lots[symbol]:
+                self.lots[symbol].remove(lot)
+
+    def remove_coin(self, symbol, close_price=None):
+        with self.lock:
+            self.transaction([self._close(symbol, None, close_price)])
+            self.lots.pop(symbol, None)
+
+    def partial_fill(self, symbol, lot, remaining_lot, close_price=None):
+        """ Closes lot (or every lot of the symbol when lot is None) and books what is left in one transaction. """
+        with self.lock:
+            operations = [self._close(symbol, lot, close_price)]
+            if remaining_lot is not None:
+                operations.append(self._insert(symbol, remaining_lot))
+            self.transaction(operations)
+            if lot is None:
+                self.lots.pop(symbol, None)
+            elif lot in self.lots[symbol]:
+                self.lots[symbol].remove(lot)
+            if remaining_lot is not None:
+                self.lots[symbol].append(remaining_lot)
+
+    def closed_lots(self, symbol=None):
+        query = "SELECT lot, close_price, closed_at FROM closed_lots WHERE exchange = ?"
+        parameters = [self.exchange]
+        if symbol is not None:
+            query = query + " AND symbol = ?"
+            parameters.append(symbol)
+        with self.lock:
+            rows = self.connection.execute(query + " ORDER BY closed_at", parameters).fetchall()
+        return [dict(json.loads(lot), close_price=close_price, closed_at=closed_at)
+                for lot, close_price, closed_at in rows]
+
+    def compact(self):
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def open_lot_store(backend, lots_file, exchange, db_file=LOT_STORE_DB_FILE, book_factory=list):
+    if backend == "sqlite":
+        store = SqliteLotStore(db_file, exchange, book_factory=book_factory)
+        store.migrate_from_lots_file(lots_file)
+        return store
+    elif backend == "journal":
+        return LotJournal(lots_file, book_factory=book_factory)
+    elif backend == "memory":
+        return MemoryLotStore(book_factory=book_factory)
+    else:
+        raise ValueError("Unknown lot store backend " + str(backend))
@@ -1,16 +1,29 @@
 # Robinhood Trading bot
 # Author: Deepak Dasarathan
+import json
 import math
 import os.path
-import pickle
-import sys
+import threading
 import time
-from collections import defaultdict
-from notion_helper import update_notion_stats
+from balance_ledger import BalanceLedger
+from exchange_transport import MARKET, ORDER, REPORTING, Transport, RecordingBackend, ReplayBackend, \
+    RequestScheduler
+from http_pool import HttpPool
+from lot_book import LotBook
+from lot_store import open_lot_store
+from metrics import Metrics
+from notion_helper import NOTION, NOTION_SYNC, update_notion_stats
+from notion_sync import LocalNotionClient
+from order_tracker import OrderTracker
+from poll_cadence import PollCadence, trigger_distance
 from pprint import pformat
 from prettytable import PrettyTable
-from robin_stocks import robinhood as r
+from rolling_high import RollingHigh
+from robin_stocks import robinhood as robinhood_api
+from robin_stocks.robinhood.globals import SESSION as ROBINHOOD_SESSION
+from robinhood_mock import MockRobinhoodExchange
 from requests import exceptions
+from state_reporter import StateReporter
 from termcolor import colored
 
 _email = os.environ.get('ROBINHOOD_EMAIL')
@@ -18,6 +31,49 @@ _password = os.environ.get('ROBINHOOD_PASSWORD')
 DRY_RUN = False
 VERBOSE = False
 MAX_RETRIES = 100
+ORDER_POLL_INTERVAL = 0.1
+ORDER_TIMEOUT = MAX_RETRIES * ORDER_POLL_INTERVAL
+ASYNC_ORDERS = True
+# "live" calls Robinhood, "record" also appends every call to TRANSPORT_FILE, "replay" serves the calls from that
+# file and "mock" trades against robinhood_mock
+TRANSPORT_MODE = os.environ.get('ROBINHOOD_TRANSPORT', "live")
+TRANSPORT_FILE = os.environ.get('ROBINHOOD_TRANSPORT_FILE', "transport_robinhood.jsonl")
+REPLAY_LATENCY_SCALE = 1.0
+# Robinhood does not publish its limits, these are conservative guesses. Orders are never held back
+# by market data or print_state, which leave headroom tokens in the bucket.
+REQUEST_SCHEDULER = TRANSPORT_MODE != "replay"
+RATE_LIMITS = {'api': (5.0, 15)}
+REQUEST_ROUTES = {'order_buy_crypto_limit_by_price': ('api', ORDER),
+                  'order_sell_crypto_limit': ('api', ORDER),
+                  'get_crypto_order_info': ('api', ORDER),
+                  'cancel_crypto_order': ('api', ORDER),
+                  'get_crypto_quote': ('api', MARKET),
+                  'get_crypto_historicals': ('api', MARKET),
+                  'load_portfolio_profile': ('api', MARKET),
+                  'get_crypto_positions': ('api', MARKET)}
+REQUEST_HEADROOM = {MARKET: 3, REPORTING: 6}
+SHARED_REQUESTS = ['get_crypto_order_info', 'get_crypto_quote', 'get_crypto_historicals', 'load_portfolio_profile',
+                   'get_crypto_positions']
+# Call latencies, symbol and cycle times, served as Prometheus text on METRICS_PORT (None to not serve) and written
+# per cycle to METRICS_FILE. ROBINHOOD_METRICS=off turns every hook into a flag check.
+METRICS_ENABLED = os.environ.get('ROBINHOOD_METRICS', "on") != "off"
+METRICS_PORT = 9109
+METRICS_FILE = "metrics_robinhood.jsonl"
+# Keep-alive connections per host for the Robinhood and Notion traffic, opened before the first cycle. HTTP/2 applies
+# to the Notion client (robin_stocks is on requests) and needs the h2 package.
+HTTP2 = os.environ.get('ROBINHOOD_HTTP2', "off") == "on"
+HTTP_PREWARM = TRANSPORT_MODE in ("live", "record")
+ROBINHOOD_URLS = ["https://api.robinhood.com/", "https://nummus.robinhood.com/"]
+NOTION_URL = "https://api.notion.com/v1/"
+BALANCE_RECONCILE_INTERVAL = 5 * 60
+# Symbols far from their buy and sell triggers, relative to their 24h range, are traded less often, between every
+# POLL_FAST and POLL_SLOW seconds and at most POLL_BUDGET symbols a second in all. Record and replay trade every
+# symbol every pass, the recorded calls depend on it.
+POLL_CADENCE = os.environ.get('ROBINHOOD_POLL_CADENCE', "on") != "off" and TRANSPORT_MODE not in ("record", "replay")
+POLL_FAST = 5.0
+POLL_SLOW = 120.0
+POLL_BUDGET = 0.5
+POLL_BATCH = 2.0
 STARTING_AMOUNT = 1.0
 STARTING_PERCENTAGE = 1.0
 RAMPED_PERCENTAGE = 2.5
@@ -30,10 +86,33 @@ NO_OF_OUTSTANDING_TRADES = 9
 CRYPTO_LIST = ["BCH", "BSV", "BTC", "DOGE", "ETC", "ETH", "LTC"]
 NEW_STRATEGY = ["BCH", "BSV", "BTC", "DOGE", "ETC", "ETH", "LTC"]
 BUY_ONLY = ["BSV", "ETC"]
-OUTSTANDING_TRADE_LOTS = defaultdict(list)
 OUTSTANDING_TRADE_LOTS_FILE = "outstanding_lots"
+LOT_STORE_BACKEND = "journal"
+LOT_STORE = open_lot_store(LOT_STORE_BACKEND, OUTSTANDING_TRADE_LOTS_FILE, "robinhood", book_factory=LotBook)
+OUTSTANDING_TRADE_LOTS = LOT_STORE.lots
 PERCENTAGES = [1, 1.5, 1.75, 2, 2.5, 3.5, 4.5, 5, 5]
 PURCHASE_AMOUNTS = [1.0, 2.0, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 320.0]
+# A ladder file written by gemini_sweep --exchange robinhood replaces the two ladders above
+LADDER_FILE = os.environ.get('LADDER_FILE')
+if LADDER_FILE is not None:
+    with open(LADDER_FILE) as f:
+        _ladder = json.load(f)
+    PERCENTAGES = _ladder['PERCENTAGES']
+    PURCHASE_AMOUNTS = _ladder['PURCHASE_AMOUNTS']
+# Every robin_stocks.robinhood call goes through the transport
+r = Transport(robinhood_api, "Robinhood")
+# Disabled until init_metrics()
+METRICS = Metrics("robinhood")
+HTTP_POOL = HttpPool(HTTP2, name="Robinhood HTTP")
+# Held by the trading pass, print_state and the order tracker callbacks, which all read or change the lots
+BOOK_LOCK = threading.RLock()
+# High of the last HIGH_HISTORICAL_WINDOW hourly candles per symbol, historicals are fetched once an hour
+HIGH_TRACKERS = {symbol: RollingHigh(HIGH_HISTORICAL_WINDOW) for symbol in CRYPTO_LIST}
+CADENCE = PollCadence(CRYPTO_LIST, POLL_FAST, POLL_SLOW, POLL_BUDGET, POLL_BATCH)
+# (quote, high price) of every symbol as last fetched by the trading pass, print_state reports from these
+CYCLE_MARKET_DATA = {}
+# Last row sent to Notion per symbol, unchanged rows are not sent again
+NOTION_ROWS = {}
 lot_stats = PrettyTable()
 lot_stats.field_names = ["Coin", "Amount", "Cost", "Quantity", "Trade Id", "Order Placed"]
 quote_stats = PrettyTable()
@@ -45,32 +124,22 @@ break_even_and_profit_stats.field_names = ["Coin", "Total Amount", "Total Quanti
 
 
 def get_lowest_outstanding_trade(symbol):
-    outstanding_lots = OUTSTANDING_TRADE_LOTS[symbol]
-    lowest_outstanding_lot = {}
-    lowest_cost = float(sys.maxsize)
-    for lot in outstanding_lots:
-        if float(lot['cost']) < lowest_cost:
-            lowest_cost = float(lot['cost'])
-            lowest_outstanding_lot = lot
-    return lowest_outstanding_lot
+    return OUTSTANDING_TRADE_LOTS[symbol].lowest
 
 
 def insert_recent_trade(symbol, trade_details):
-    OUTSTANDING_TRADE_LOTS[symbol].append(trade_details)
-    pickle.dump(OUTSTANDING_TRADE_LOTS, open(OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
-    print_state()
+    LOT_STORE.insert(symbol, trade_details)
+    STATE_REPORTER.request()
 
 
-def remove_matched_trade(symbol, trade_details):
-    OUTSTANDING_TRADE_LOTS[symbol].remove(trade_details)
-    pickle.dump(OUTSTANDING_TRADE_LOTS, open(OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
-    print_state()
+def remove_matched_trade(symbol, trade_details, close_price=None):
+    LOT_STORE.remove(symbol, trade_details, close_price)
+    STATE_REPORTER.request()
 
 
-def remove_coin(symbol):
-    del OUTSTANDING_TRADE_LOTS[symbol]
-    pickle.dump(OUTSTANDING_TRADE_LOTS, open(OUTSTANDING_TRADE_LOTS_FILE, 'wb'))
-    print_state()
+def remove_coin(symbol, close_price=None):
+    LOT_STORE.remove_coin(symbol, close_price)
+    STATE_REPORTER.request()
 
 
 def create_trade_details(symbol, order_id, quantity, cost, amount, created, updated):
@@ -119,6 +188,75 @@ def check_order_executed_or_cancel(symbol, order_type, order_id):
     return filled_order, canceled
 
 
+def cancel_order(order_id):
+    r.cancel_crypto_order(order_id)
+    return None
+
+
+ORDER_TRACKER = OrderTracker(lambda order: order['state'],
+                             ["filled", "canceled", "rejected", "failed"],
+                             ORDER_POLL_INTERVAL,
+                             "Robinhood")
+
+
+def fetch_balances():
+    balances = {'usd': float(r.load_portfolio_profile()['equity'])}
+    for position in r.get_crypto_positions():
+        balances[position['currency']['code']] = float(position['quantity'])
+    return balances
+
+
+BALANCES = BalanceLedger(fetch_balances, BALANCE_RECONCILE_INTERVAL, "Robinhood")
+
+
+def settle_order_balance(reservation, symbol, filled_order):
+    quantity = float(filled_order.get('cumulative_quantity') or 0.0)
+    dollars = quantity * float(filled_order.get('average_price') or 0.0)
+    if filled_order.get('side') == "sell":
+        BALANCES.settle(reservation, {'usd': dollars, symbol: -quantity})
+    else:
+        BALANCES.settle(reservation, {'usd': -dollars, symbol: quantity})
+
+
+def place_reserved_order(reservation, order_fn, *args):
+    # a reservation left behind would hold the balance and stop it from ever reconciling
+    try:
+        return order_fn(*args)
+    except Exception:
+        BALANCES.release(reservation)
+        raise
+
+
+def submit_order(symbol, order_type, placed_order, on_done, reservation=None):
+    """ Hands the final state of a placed order to on_done(filled_order, canceled).
+        The fill is booked in BALANCES, which also drops the reservation taken before the order was placed.
+        With ASYNC_ORDERS the order rests in ORDER_TRACKER and on_done runs on its thread,
+        otherwise this blocks in check_order_executed_or_cancel.
+    """
+    try:
+        if not ASYNC_ORDERS:
+            filled_order, canceled = check_order_executed_or_cancel(symbol, order_type, placed_order['id'])
+            settle_order_balance(reservation, symbol, filled_order)
+            on_done(filled_order, canceled)
+            return
+
+        def on_order_done(filled_order):
+            settle_order_balance(reservation, symbol, filled_order)
+            with BOOK_LOCK:
+                on_done(filled_order, filled_order['state'] != "filled")
+
+        ORDER_TRACKER.track(placed_order['id'],
+                            placed_order,
+                            symbol,
+                            r.get_crypto_order_info,
+                            cancel_order,
+                            on_order_done,
+                            ORDER_TIMEOUT)
+    except Exception:
+        BALANCES.release(reservation)
+        raise
+
+
 def evaluate_trading_amount(symbol):
     outstanding_lots = OUTSTANDING_TRADE_LOTS[symbol]
     if len(outstanding_lots) <= 5:
@@ -136,18 +274,20 @@ def evaluate_closeness_percentage(symbol):
         return RAMPED_PERCENTAGE
 
 
+def refresh_high_price(symbol):
+    HIGH_TRACKERS[symbol].load(r.get_crypto_historicals(symbol=symbol))
+
+
 def get_high_price(symbol, current_quote):
-    historical_quotes = r.get_crypto_historicals(symbol=symbol)
-    high_price = float(-1.0)
-    for historical in historical_quotes[-HIGH_HISTORICAL_WINDOW:]:
-        if float(historical['high_price']) > high_price:
-            high_price = float(historical['high_price'])
-    return max(high_price, float(current_quote['high_price']))
+    tracker = HIGH_TRACKERS[symbol]
+    if tracker.stale():
+        refresh_high_price(symbol)
+    tracker.observe(float(current_quote['mark_price']))
+    return max(tracker.high, float(current_quote['high_price']))
 
 
 def evaluate_exponential_trading_closeness_values(symbol):
-    outstanding_lots = OUTSTANDING_TRADE_LOTS[symbol]
-    index = len(outstanding_lots)
+    index = OUTSTANDING_TRADE_LOTS[symbol].ladder_index
     if index < len(PURCHASE_AMOUNTS):
         trading_amount = PURCHASE_AMOUNTS[index]
         closeness_percentage = PERCENTAGES[index]
@@ -192,15 +332,15 @@ def buy_trade_logic(symbol, quote, high_price):
         if buy:
 
             #    then place an order at ask_price
-            available_balance = float(r.load_portfolio_profile()['equity'])
-            if float(trading_amount_dollars) > available_balance:
+            reservation = BALANCES.reserve('usd', float(trading_amount_dollars))
+            if reservation is None:
                 if VERBOSE:
-                    print("Buy:", symbol, "Insufficient funds, Available Balance:", available_balance,
+                    print("Buy:", symbol, "Insufficient funds, Available Balance:", BALANCES.available('usd'),
                           "Trading Amount:", trading_amount_dollars, "Current Ask Price:", current_ask_price)
                 return
 
-            placed_buy_order = r.order_buy_crypto_limit_by_price(symbol, trading_amount_dollars,
-                                                                 r.helper.round_price(current_ask_price))
+            placed_buy_order = place_reserved_order(reservation, r.order_buy_crypto_limit_by_price, symbol,
+                                                    trading_amount_dollars, r.helper.round_price(current_ask_price))
 
             try:
                 if bool(lowest_outstanding_lot):
@@ -211,31 +351,27 @@ def buy_trade_logic(symbol, quote, high_price):
             except Exception as e:
                 print("Buy:", symbol, "Caught exception when printing", e)
 
-            filled_buy_order, canceled = check_order_executed_or_cancel(symbol, "Buy", placed_buy_order['id'])
+            def on_done(filled_buy_order, canceled):
+                # ensure cancel went through
+                if not canceled:
+                    placed_buy_trade = create_trade_details(symbol, filled_buy_order['id'],
+                                                            filled_buy_order['cumulative_quantity'],
+                                                            filled_buy_order['average_price'],
+                                                            filled_buy_order['entered_price'],
+                                                            filled_buy_order['created_at'],
+                                                            filled_buy_order['updated_at'])
+                    insert_recent_trade(symbol, placed_buy_trade)
+                else:
+                    STATE_REPORTER.request()
 
-            # ensure cancel went through
-            if not canceled:
-                placed_buy_trade = create_trade_details(symbol, filled_buy_order['id'],
-                                                        filled_buy_order['cumulative_quantity'],
-                                                        filled_buy_order['average_price'],
-                                                        filled_buy_order['entered_price'],
-                                                        filled_buy_order['created_at'],
-                                                        filled_buy_order['updated_at'])
-                insert_recent_trade(symbol, placed_buy_trade)
-            else:
-                print_state()
+            submit_order(symbol, "Buy", placed_buy_order, on_done, reservation)
 
 
 def evaluate_break_even_and_profit(symbol, current_quote):
-    outstanding_lots = OUTSTANDING_TRADE_LOTS[symbol]
-    total_amount = 0.0
-    total_quantity = 0.0
-    total_cost = 0.0
-    for lot in outstanding_lots:
-        total_amount = total_amount + float(lot['amount'])
-        total_quantity = total_quantity + float(lot['quantity'])
-    if total_quantity > 0.0:
-        total_cost = total_amount / total_quantity
+    lot_book = OUTSTANDING_TRADE_LOTS[symbol]
+    total_amount = lot_book.total_amount
+    total_quantity = lot_book.total_quantity
+    total_cost = lot_book.avg_cost
     current_bid_price = float(current_quote['bid_price'])
     break_even = percentage_break_even(current_bid_price, total_cost)
     return total_amount, total_cost, total_quantity, current_bid_price, break_even
@@ -264,14 +400,10 @@ def sell_trade_logic_close_all(symbol, quote):
         total_amount, total_cost, total_quantity, current_bid_price, break_even = evaluate_break_even_and_profit(symbol,
                                                                                                                  quote)
         percentage_up = percentage_break_even(total_cost, current_bid_price)
-        positions = r.get_crypto_positions()
-        quantity = -1.0
-        for position in positions:
-            if position['currency']['code'] == symbol:
-                quantity = float(position['quantity'])
-                if VERBOSE:
-                    print("New Strategy Sell:", symbol, "Found symbol, quantity", quantity)
-                    print()
+        quantity = BALANCES.available(symbol, -1.0)
+        if VERBOSE:
+            print("New Strategy Sell:", symbol, "Found symbol, quantity", quantity)
+            print()
 
         if not math.isclose(total_quantity, quantity):
             print("New Strategy Sell:", symbol, "Total Quantity:", total_quantity, "Quantity in Robinhood:", quantity)
@@ -281,24 +413,28 @@ def sell_trade_logic_close_all(symbol, quote):
         if quantity > 0:
             if not DRY_RUN:
                 if percentage_up > volatility_percentage:
+                    reservation = BALANCES.reserve(symbol, quantity)
+                    if reservation is None:
+                        print("New Strategy Sell:", symbol, "Quantity not available", quantity,
+                              BALANCES.available(symbol))
+                        return
                     #   then place a sell order at bid_price
-                    placed_sell_order = r.order_sell_crypto_limit(symbol, float(quantity),
-                                                                  r.helper.round_price(current_bid_price))
+                    placed_sell_order = place_reserved_order(reservation, r.order_sell_crypto_limit, symbol,
+                                                             float(quantity), r.helper.round_price(current_bid_price))
                     try:
                         print("New Strategy Sell:", symbol, "Percentage Up", percentage_up)
                         print("New Strategy Sell:", symbol, "Order placed", pformat(placed_sell_order))
                     except Exception as e:
                         print("New Strategy Sell: Caught exception when printing", e)
 
-                    filled_sell_order, canceled = check_order_executed_or_cancel(symbol,
-                                                                                 "New Strategy Sell",
-                                                                                 placed_sell_order['id'])
+                    def on_done(filled_sell_order, canceled):
+                        # ensure cancel went through
+                        if not canceled:
+                            remove_coin(symbol, filled_sell_order.get('average_price'))
+                        else:
+                            STATE_REPORTER.request()
 
-                    # ensure cancel went through
-                    if not canceled:
-                        remove_coin(symbol)
-                    else:
-                        print_state()
+                    submit_order(symbol, "New Strategy Sell", placed_sell_order, on_done, reservation)
         else:
             if math.isclose(quantity, 0.0):
                 print("New Strategy Sell:", symbol, "Quantity not found. Cleanup coin lot")
@@ -320,36 +456,81 @@ def sell_trade_logic_last_trade(symbol, current_quote):
     if not DRY_RUN:
         if (bool(lowest_outstanding_lot) and
                 percentage_up > volatility_percentage):
+            reservation = BALANCES.reserve(symbol, float(lowest_outstanding_lot['quantity']))
+            if reservation is None:
+                print("Sell:", symbol, "Lot quantity not available", lowest_outstanding_lot['quantity'],
+                      BALANCES.available(symbol))
+                return
             #   then place a sell order at bid_price
-            placed_sell_order = r.order_sell_crypto_limit(symbol, float(lowest_outstanding_lot['quantity']),
-                                                          r.helper.round_price(current_bid_price))
+            placed_sell_order = place_reserved_order(reservation, r.order_sell_crypto_limit, symbol,
+                                                     float(lowest_outstanding_lot['quantity']),
+                                                     r.helper.round_price(current_bid_price))
             print("Sell:", symbol, "Lowest lot", lowest_outstanding_lot)
             print("Sell:", symbol, "Percentage Up", percentage_up)
             print("Sell:", symbol, "Order placed", placed_sell_order)
 
-            filled_sell_order, canceled = check_order_executed_or_cancel(symbol, "Sell", placed_sell_order['id'])
+            def on_done(filled_sell_order, canceled):
+                # ensure cancel went through
+                if not canceled:
+                    remove_matched_trade(symbol, lowest_outstanding_lot, filled_sell_order.get('average_price'))
+                else:
+                    STATE_REPORTER.request()
 
-            # ensure cancel went through
-            if not canceled:
-                remove_matched_trade(symbol, lowest_outstanding_lot)
-            else:
-                print_state()
+            submit_order(symbol, "Sell", placed_sell_order, on_done, reservation)
 
 
 def crypto_trading_logic(symbol):
+    if ORDER_TRACKER.has_open_order(symbol):
+        # the order tracker books the result, the lot book is not final until then
+        return
+    with METRICS.timer('symbol_seconds', symbol=symbol), BOOK_LOCK:
+        trade_symbol(symbol)
+        if POLL_CADENCE:
+            update_cadence(symbol)
+
+
+def update_cadence(symbol):
+    """ Reschedules symbol from the quote of its trading pass, an order in flight keeps it at the fastest cadence. """
+    market_data = CYCLE_MARKET_DATA.get(symbol)
+    if market_data is None or ORDER_TRACKER.has_open_order(symbol):
+        interval = CADENCE.update(symbol, 0.0, 0.0)
+    else:
+        quote, high_price = market_data
+        buy_at = None
+        lowest_outstanding_lot = get_lowest_outstanding_trade(symbol)
+        if symbol in BUY_ONLY and len(OUTSTANDING_TRADE_LOTS[symbol]) < NO_OF_OUTSTANDING_TRADES:
+            trading_amount_dollars, closeness_percentage = evaluate_exponential_trading_closeness_values(symbol)
+            reference = float(lowest_outstanding_lot['cost']) if bool(lowest_outstanding_lot) else high_price
+            buy_at = reference * (1.0 - float(closeness_percentage) / 100.0)
+        sell_at = None
+        if len(OUTSTANDING_TRADE_LOTS[symbol]) > 0:
+            sell_at = OUTSTANDING_TRADE_LOTS[symbol].avg_cost * (1.0 + get_volatility_percentage_latest(symbol) / 100.0)
+        mark_price = float(quote['mark_price'])
+        volatility = (float(quote['high_price']) - float(quote['low_price'])) / mark_price if mark_price > 0.0 else 0.0
+        interval = CADENCE.update(symbol, trigger_distance(float(quote['ask_price']), buy_at, float(quote['bid_price']),
+                                                           sell_at), volatility)
+    METRICS.set_gauge('poll_interval_seconds', interval, symbol=symbol)
+
+
+def trade_symbol(symbol):
     try:
 
         # get the current quote for the crypto
         current_quote = r.get_crypto_quote(symbol)
 
         high_price = get_high_price(symbol, current_quote)
+        CYCLE_MARKET_DATA[symbol] = (current_quote, high_price)
 
         # Run the buy algorithm
         if symbol in BUY_ONLY:
             buy_trade_logic(symbol, current_quote, high_price)
 
+        if ORDER_TRACKER.has_open_order(symbol):
+            return
+
         # get the current quote for the crypto: uptodate
         current_quote = r.get_crypto_quote(symbol)
+        CYCLE_MARKET_DATA[symbol] = (current_quote, high_price)
 
         # Run the sell algorithm
         if symbol in NEW_STRATEGY:
@@ -379,6 +560,47 @@ def crypto_trading_logic(symbol):
         return
 
 
+def init_transport(mode=TRANSPORT_MODE, transport_file=TRANSPORT_FILE):
+    if mode == "record":
+        r.use(RecordingBackend(robinhood_api, transport_file))
+    elif mode == "replay":
+        r.use(ReplayBackend(transport_file, robinhood_api, REPLAY_LATENCY_SCALE, exceptions.ConnectionError))
+    elif mode == "mock":
+        r.use(MockRobinhoodExchange(CRYPTO_LIST, error=exceptions.ConnectionError))
+    elif mode != "live":
+        raise ValueError("Unknown Robinhood transport mode " + mode)
+    if REQUEST_SCHEDULER:
+        r.scheduler = RequestScheduler(RATE_LIMITS, REQUEST_ROUTES, REQUEST_HEADROOM, SHARED_REQUESTS,
+                                       "Robinhood scheduler")
+    print("Robinhood transport:", mode)
+
+
+def init_metrics(enabled=METRICS_ENABLED, port=METRICS_PORT, metrics_file=METRICS_FILE):
+    if not enabled:
+        return
+    METRICS.enable()
+    r.observers.append(METRICS.observe_call)
+    NOTION_SYNC.observers.append(METRICS.observe_call)
+    if metrics_file is not None:
+        METRICS.open_file(metrics_file)
+    if port is not None:
+        METRICS.serve(port=port)
+
+
+def init_http_pool(prewarm=HTTP_PREWARM):
+    HTTP_POOL.mount(ROBINHOOD_SESSION)
+    urls = []
+    if not isinstance(NOTION, LocalNotionClient):
+        # notion_client sets its base URL and headers on the client it is given
+        previous = NOTION.client
+        NOTION.client = HTTP_POOL.client(NOTION_URL)
+        previous.close()
+        urls.append(NOTION_URL)
+    if prewarm:
+        HTTP_POOL.prewarm(ROBINHOOD_URLS, ROBINHOOD_SESSION)
+        HTTP_POOL.prewarm(urls)
+
+
 def login_to_robinhood(email, password):
     try:
         r.login(username=email, password=password, store_session=True, pickle_name="aarthika")
@@ -436,12 +658,40 @@ def print_break_even_and_profit_stats(symbol, quote, high_price):
     return total_amount, total_cost, total_quantity, current_bid_price, break_even, sell_at, buy_at
 
 
+def get_cycle_market_data(symbol, fetch):
+    market_data = CYCLE_MARKET_DATA.get(symbol)
+    if market_data is None and fetch:
+        current_quote = r.get_crypto_quote(symbol)
+        market_data = (current_quote, get_high_price(symbol, current_quote))
+        CYCLE_MARKET_DATA[symbol] = market_data
+    return market_data
+
+
+def report_notion_stats(symbol, *row):
+    if NOTION_ROWS.get(symbol) != row:
+        NOTION_ROWS[symbol] = row
+        update_notion_stats(symbol, *row)
+
+
 def print_state(print_stdout=True):
+    # the quotes print_state fetches wait behind the trading pass' requests
+    with BOOK_LOCK, r.priority(REPORTING):
+        print_state_impl(print_stdout)
+
+
+# The order tracker's callbacks hand their report to this thread, so polling and cancelling never wait on it
+STATE_REPORTER = StateReporter(print_state, "robinhood-state")
+
+
+def print_state_impl(print_stdout):
     try:
         total_crypto_bought_dollars = 0.0
         for c in CRYPTO_LIST:
-            current_quote = r.get_crypto_quote(c)
-            high_price = get_high_price(c, current_quote)
+            # only printing may hit the network, for a symbol the trading pass has not quoted yet
+            market_data = get_cycle_market_data(c, print_stdout)
+            if market_data is None:
+                continue
+            current_quote, high_price = market_data
 
             current_ask_price, percentage_dip, lowest_outstanding_lot, closeness_to_lowest_trade, percentage_up = \
                 get_signals(c, current_quote, high_price)
@@ -450,7 +700,7 @@ def print_state(print_stdout=True):
                 print_break_even_and_profit_stats(c, current_quote, high_price)
 
             print_signals(c, current_quote, percentage_dip, percentage_up, high_price, closeness_to_lowest_trade)
-            update_notion_stats(c,
+            report_notion_stats(c,
                                 round(float(total_amount), 2),
                                 round(float(total_quantity), 6),
                                 round(float(total_cost), 4),
@@ -472,7 +722,7 @@ def print_state(print_stdout=True):
             if len(OUTSTANDING_TRADE_LOTS[c]) > 0:
                 lot_stats.add_row(['*' * 6, '*' * 9, '*' * 18, '*' * 13, '*' * 40, '*' * 34])
 
-        cash_balance = float(r.load_portfolio_profile()['equity'])
+        cash_balance = BALANCES.available('usd')
         total_equity = total_crypto_bought_dollars + cash_balance
         if print_stdout:
             print(lot_stats.get_string())
@@ -506,20 +756,32 @@ def print_state(print_stdout=True):
 
 if __name__ == '__main__':
 
+    init_transport()
+    init_metrics()
+    init_http_pool()
     login_to_robinhood(_email, _password)
 
     # Read initial state
-    if os.path.exists(OUTSTANDING_TRADE_LOTS_FILE):
-        OUTSTANDING_TRADE_LOTS = pickle.load(open(OUTSTANDING_TRADE_LOTS_FILE, 'rb'))
+    LOT_STORE.load()
+    BALANCES.load()
+    for crypto in CRYPTO_LIST:
+        refresh_high_price(crypto)
     print_state()
     run_count = 0
     while True:
-        for crypto in CRYPTO_LIST:
+        started = time.monotonic()
+        BALANCES.reconcile()
+        symbols = CADENCE.due() if POLL_CADENCE else CRYPTO_LIST
+        for crypto in symbols:
             crypto_trading_logic(crypto)
+        if symbols:
+            METRICS.end_cycle(time.monotonic() - started)
         time.sleep(1)
         run_count = run_count + 1
         if run_count % 50 == 0:
             print("Run count:", run_count)
+            if TRANSPORT_MODE != "live":
+                print(r.summary())
             print_state()
         else:
             print_state(False)
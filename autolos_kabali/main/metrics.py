@@ -0,0 +1,216 @@
+# Trading bot metrics
+# Author: Deepak Dasarathan
+
+import bisect
+import contextlib
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_FILE_MAX_BYTES = 10 * 1024 * 1024
+METRICS_FILE_BACKUPS = 3
+
+_DISABLED = contextlib.nullcontext()
+
+
+class Histogram:
+    """ Prometheus style histogram, counts[i] is the number of observations <= buckets[i] (not cumulative). """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+class Metrics:
+    """ Latency histograms, counters and gauges of a bot, kept in memory while enabled.
+
+    A Metrics starts disabled and costs a flag check per hook until enable(). observe_call(service, method,
+    elapsed, error) is a Transport (and NotionSyncWorker) observer: it times every call and counts errors per
+    service and method. timer('symbol_seconds', symbol=...) times a symbol's evaluation, observations labelled
+    with a symbol also add up per cycle. end_cycle() closes a trading cycle: its time goes to a histogram and,
+    with open_file(), its time, API calls and symbol times are written as one JSON line to a size rotated file.
+    serve() exposes everything as Prometheus text on GET /metrics.
+    """
+
+    def __init__(self, prefix, buckets=METRICS_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.cycle_calls = Counter()
+        self.cycle_errors = Counter()
+        self.cycle_elapsed = defaultdict(float)
+        self.cycle_symbols = defaultdict(float)
+        self.log = None
+        self.server = None
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        return self
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+            if 'symbol' in labels:
+                self.cycle_symbols[labels['symbol']] += value
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _DISABLED
+        return Timer(self, name, labels)
+
+    def observe_call(self, service, method, elapsed, error):
+        if not self.enabled:
+            return
+        self.observe('call_seconds', elapsed, service=service, method=method)
+        call = service + "." + method
+        with self.lock:
+            self.cycle_calls[call] += 1
+            self.cycle_elapsed[call] += elapsed
+            if error is not None:
+                self.cycle_errors[call] += 1
+                self.counters[('call_errors_total', (('error', type(error).__name__), ('method', method),
+                                                     ('service', service)))] += 1
+
+    def end_cycle(self, elapsed):
+        """ Closes a trading cycle that took elapsed seconds. """
+        if not self.enabled:
+            return
+        with self.lock:
+            calls, errors, call_seconds, symbols = \
+                self.cycle_calls, self.cycle_errors, self.cycle_elapsed, self.cycle_symbols
+            self.cycle_calls = Counter()
+            self.cycle_errors = Counter()
+            self.cycle_elapsed = defaultdict(float)
+            self.cycle_symbols = defaultdict(float)
+            self.counters[('cycles_total', ())] += 1
+            self.gauges[('cycle_calls', ())] = sum(calls.values())
+        self.observe('cycle_seconds', elapsed)
+        if self.log is not None:
+            self.log.info(json.dumps({'time': time.time(),
+                                      'cycle_seconds': round(elapsed, 6),
+                                      'calls': dict(calls),
+                                      'errors': dict(errors),
+                                      'call_seconds': {call: round(seconds, 6)
+                                                       for call, seconds in call_seconds.items()},
+                                      'symbol_seconds': {symbol: round(seconds, 6)
+                                                         for symbol, seconds in symbols.items()}}))
+
+    def open_file(self, metrics_file, max_bytes=METRICS_FILE_MAX_BYTES, backups=METRICS_FILE_BACKUPS):
+        """ Writes a JSON line per cycle to metrics_file, rolled over to metrics_file.1 .. .backups at max_bytes. """
+        handler = RotatingFileHandler(metrics_file, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.log = logging.getLogger("metrics." + self.prefix)
+        self.log.setLevel(logging.INFO)
+        self.log.propagate = False
+        self.log.addHandler(handler)
+
+    @staticmethod
+    def label_text(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                              for name, value in labels) + "}"
+
+    def prometheus_text(self):
+        with self.lock:
+            histograms = {key: (list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        lines = []
+        typed = set()
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            metric = self.prefix + "_" + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE " + metric + " histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative = cumulative + bucket_count
+                lines.append(metric + "_bucket" + self.label_text(labels, [('le', repr(bound))]) + " " +
+                             str(cumulative))
+            lines.append(metric + "_bucket" + self.label_text(labels, [('le', "+Inf")]) + " " + str(count))
+            lines.append(metric + "_sum" + self.label_text(labels) + " " + repr(total))
+            lines.append(metric + "_count" + self.label_text(labels) + " " + str(count))
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in sorted(values.items()):
+                metric = self.prefix + "_" + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append("# TYPE " + metric + " " + kind)
+                lines.append(metric + self.label_text(labels) + " " + str(value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="localhost", port=9108):
+        """ Serves GET /metrics on a background thread, returns the server. """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name=self.prefix + "-metrics", daemon=True).start()
+        print("Metrics: serving on http://" + host + ":" + str(self.server.server_port) + "/metrics")
+        return self.server
@@ -3,6 +3,7 @@
 
 import os.path
 from notion_client import Client
+from notion_sync import LocalNotionClient, NotionSyncWorker
 
 NOTION_PAGES = {
     "BCH": "0729e4f71ccf41a0b768b7e8d2e2b03c",
@@ -15,7 +16,9 @@ NOTION_PAGES = {
 }
 
 _notion_api = os.environ.get('NOTION_API_KEY')
-NOTION = Client(auth=_notion_api)
+# without an API key the dashboard is kept in memory, so the bot runs offline
+NOTION = Client(auth=_notion_api) if _notion_api else LocalNotionClient()
+NOTION_SYNC = NotionSyncWorker(NOTION)
 
 
 def update_notion_stats(symbol, total_amount, total_quantity, avg_cost, high, ask, bid, sell_at, buy_at):
@@ -30,7 +33,7 @@ def update_notion_stats(symbol, total_amount, total_quantity, avg_cost, high, as
             "Sell @": {"number": sell_at},
             "Buy @": {"number": buy_at}
         }
-    NOTION.pages.update(page_id, properties=data)
+    NOTION_SYNC.submit(page_id, data)
 
 
 if __name__ == '__main__':
@@ -39,3 +42,4 @@ if __name__ == '__main__':
         print(crypto)
         # pprint(notion.pages.retrieve(NOTION_PAGES[crypto]))
         update_notion_stats(crypto, 1.1, 1.1, 1.1, 1.1, 1.1, 1.1, 1.1)
+    NOTION_SYNC.flush()
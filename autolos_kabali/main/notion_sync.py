@@ -0,0 +1,162 @@
+# Trading bot Notion sync
+# Author: Deepak Dasarathan
+
+import threading
+import time
+from collections import OrderedDict
+
+NOTION_REQUESTS_PER_SECOND = 2.5
+NOTION_MAX_RETRIES = 5
+NOTION_RETRY_DELAY = 1.0
+NOTION_MAX_RETRY_DELAY = 60.0
+
+
+class LocalPages:
+    def __init__(self, client):
+        self.client = client
+
+    def update(self, page_id, properties):
+        return self.client.update_page(page_id, properties)
+
+
+class LocalNotionClient:
+    """ Offline stand-in for notion_client.Client, keeps the pages in memory.
+
+    Only pages.update is served. latency delays every call and fail_first fails that many calls before
+    succeeding, to exercise the worker's rate budget and retries without the Notion API.
+    """
+
+    def __init__(self, latency=0.0, fail_first=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.pages = LocalPages(self)
+        self.store = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def update_page(self, page_id, properties):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((time.monotonic(), page_id))
+            if self.fail_first > 0:
+                self.fail_first = self.fail_first - 1
+                raise ConnectionError("Local Notion client: injected failure")
+            self.store[page_id] = dict(properties)
+        return {'object': 'page', 'id': page_id, 'properties': properties}
+
+
+class NotionSyncWorker:
+    """ Pushes dashboard rows to Notion from a background thread, trading never waits on it.
+
+    submit() only records the latest properties of a page: a page already queued is overwritten in place, and
+    a page whose properties equal what was last synced is not queued at all (callers round the numbers, so
+    quote noise below the displayed precision costs no request). The thread sends at most requests_per_second
+    updates and retries a failed page with exponential backoff, unless a newer snapshot replaced it meanwhile.
+    observers(name, 'pages.update', elapsed, error) are told about every request, like Transport observers.
+    """
+
+    def __init__(self, client, requests_per_second=NOTION_REQUESTS_PER_SECOND, max_retries=NOTION_MAX_RETRIES,
+                 retry_delay=NOTION_RETRY_DELAY, max_retry_delay=NOTION_MAX_RETRY_DELAY, name="notion"):
+        self.client = client
+        self.interval = 1.0 / requests_per_second
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.name = name
+        self.pending = OrderedDict()
+        self.synced = {}
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.sending = None
+        self.thread = None
+        self.next_request_at = 0.0
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+        self.observers = []
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=self.name + "-sync", daemon=True)
+                self.thread.start()
+
+    def submit(self, page_id, properties):
+        with self.lock:
+            if page_id not in self.pending and self.synced.get(page_id) == properties:
+                self.skipped = self.skipped + 1
+                return False
+            self.pending[page_id] = properties
+            # flush() waits on the same condition, a single notify could wake it instead of the worker
+            self.wakeup.notify_all()
+        self.start()
+        return True
+
+    def flush(self, timeout=None):
+        """ Waits until every queued page was sent or given up on, returns False on timeout. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self.pending or self.sending is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.wakeup.wait(remaining)
+        return True
+
+    def next_page(self):
+        with self.lock:
+            while not self.pending:
+                self.wakeup.wait()
+            page_id, properties = self.pending.popitem(last=False)
+            self.sending = page_id
+            return page_id, properties
+
+    def send(self, page_id, properties):
+        delay = self.next_request_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_request_at = time.monotonic() + self.interval
+        started = time.perf_counter()
+        error = None
+        try:
+            self.client.pages.update(page_id, properties=properties)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            for observer in self.observers:
+                observer(self.name, 'pages.update', elapsed, error)
+
+    def run(self):
+        while True:
+            page_id, properties = self.next_page()
+            retry_in = None
+            try:
+                if self.synced.get(page_id) != properties:
+                    self.send(page_id, properties)
+                    with self.lock:
+                        self.synced[page_id] = properties
+                        self.sent = self.sent + 1
+                self.attempts.pop(page_id, None)
+            except Exception as e:
+                attempts = self.attempts.get(page_id, 0) + 1
+                if attempts > self.max_retries:
+                    print(self.name + ": Giving up on page", page_id, "after", attempts, "attempts", e)
+                    self.attempts.pop(page_id, None)
+                    self.failed = self.failed + 1
+                else:
+                    print(self.name + ": Update of page", page_id, "failed, attempt", attempts, e)
+                    self.attempts[page_id] = attempts
+                    retry_in = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            if retry_in is not None:
+                # Notion is rate limiting or down, hold every page back
+                time.sleep(retry_in)
+            with self.lock:
+                # a newer snapshot queued during the backoff wins over the failed one
+                if retry_in is not None and page_id not in self.pending:
+                    self.pending[page_id] = properties
+                    self.pending.move_to_end(page_id, last=False)
+                self.sending = None
+                self.wakeup.notify_all()
@@ -0,0 +1,142 @@
+# Trading bot order tracking
+# Author: Deepak Dasarathan
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+EARLY_UPDATES_LIMIT = 1000
+
+
+@dataclass
+class TrackedOrder:
+    order_id: str
+    symbol: str
+    status: dict
+    state: object
+    refresh: object
+    cancel: object
+    on_done: object
+    timeout: float
+    placed_at: float = field(default_factory=time.monotonic)
+    cancel_requested: bool = False
+
+
+class OrderTracker:
+    """ Follows placed orders in the background until they reach a terminal state.
+
+    state_fn maps an exchange order status to a state, terminal_states ends tracking. Orders still open after
+    their timeout are cancelled once and followed until the cancel lands. on_done(status) runs on the tracker
+    thread, so callbacks take the same locks as the strategy before touching the lot book, and refresh and
+    cancel run there too, so they must be safe to call alongside the strategy's own exchange calls.
+
+    Statuses pushed through update() by an order events stream are used as-is. While the stream reports itself
+    connected through set_push_connected() no order is polled, when it drops polling takes over, and when it
+    comes back every open order is polled once to pick up events missed in between. A status pushed before
+    its order was tracked (a fill can beat the order response) is kept and applied on track().
+    """
+
+    def __init__(self, state_fn, terminal_states, poll_interval=0.2, name="orders"):
+        self.state_fn = state_fn
+        self.terminal_states = set(terminal_states)
+        self.poll_interval = poll_interval
+        self.name = name
+        self.orders = {}
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.push_connected = False
+        self.resync = False
+        self.early_updates = OrderedDict()
+
+    def track(self, order_id, status, symbol, refresh, cancel, on_done, timeout):
+        order = TrackedOrder(order_id, symbol, status, self.state_fn(status), refresh, cancel, on_done, timeout)
+        with self.lock:
+            self.orders[order_id] = order
+            early_status = self.early_updates.pop(order_id, None)
+            self.start()
+        # an order can already be final when placed (maker-or-cancel) or by the time it is tracked
+        self.transition(order, status if early_status is None else early_status)
+        self.wakeup.set()
+        return order
+
+    def set_push_connected(self, connected):
+        with self.lock:
+            if connected and not self.push_connected:
+                self.resync = True
+            self.push_connected = connected
+        self.wakeup.set()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=self.name + "-tracker", daemon=True)
+                self.thread.start()
+
+    def has_open_order(self, symbol):
+        with self.lock:
+            return any(order.symbol == symbol for order in self.orders.values())
+
+    def open_orders(self):
+        with self.lock:
+            return list(self.orders.values())
+
+    def update(self, order_id, status):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                self.early_updates[order_id] = status
+                while len(self.early_updates) > EARLY_UPDATES_LIMIT:
+                    self.early_updates.popitem(last=False)
+                return False
+        self.transition(order, status)
+        return True
+
+    def transition(self, order, status):
+        state = self.state_fn(status)
+        with self.lock:
+            if order.order_id not in self.orders:
+                return
+            if state != order.state:
+                print(self.name + ":", order.symbol, "Order", order.order_id, order.state, "->", state)
+            order.status = status
+            order.state = state
+            if state not in self.terminal_states:
+                return
+            del self.orders[order.order_id]
+        try:
+            order.on_done(status)
+        except Exception as e:
+            print(self.name + ":", order.symbol, "Order", order.order_id, "callback failed", e)
+            print(traceback.format_exc())
+
+    def poll_order(self, order, refresh):
+        if not order.cancel_requested and time.monotonic() - order.placed_at >= order.timeout:
+            order.cancel_requested = True
+            print(self.name + ":", order.symbol, "Order", order.order_id, "still open after", order.timeout,
+                  "s. Canceling!")
+            status = order.cancel(order.order_id)
+            if status:
+                self.transition(order, status)
+                if order.order_id not in self.orders:
+                    return
+        if refresh:
+            self.transition(order, order.refresh(order.order_id))
+
+    def poll_once(self):
+        with self.lock:
+            refresh = not self.push_connected or self.resync
+            self.resync = False
+        for order in self.open_orders():
+            try:
+                self.poll_order(order, refresh)
+            except Exception as e:
+                print(self.name + ":", order.symbol, "Order", order.order_id, "refresh failed", e)
+
+    def run(self):
+        while True:
+            self.poll_once()
+            self.wakeup.wait(self.poll_interval if self.orders else None)
+            self.wakeup.clear()
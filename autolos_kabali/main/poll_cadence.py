@@ -0,0 +1,85 @@
+# Trading bot poll cadence
+# Author: Deepak Dasarathan
+
+import math
+import threading
+import time
+
+DAY = 24 * 60 * 60
+
+
+def trigger_distance(ask, buy_at=None, bid=None, sell_at=None):
+    """ Fraction the price has to move for the nearest trigger to fire: the ask down to buy_at or the bid up to
+    sell_at, None for a trigger that cannot fire. 0 at or past a trigger, infinite without any.
+    """
+    distance = math.inf
+    if buy_at is not None and ask > 0.0:
+        distance = min(distance, max(ask - buy_at, 0.0) / ask)
+    if sell_at is not None and bid is not None and bid > 0.0:
+        distance = min(distance, max(sell_at - bid, 0.0) / bid)
+    return distance
+
+
+class PollCadence:
+    """ When each symbol is evaluated next, sooner the closer its price is to a trigger.
+
+    update(symbol, distance, volatility) takes the fraction the price has to move for the symbol's nearest
+    trigger and the fraction it moved over the last horizon seconds, e.g. the 24h range over the price. With
+    prices moving like a random walk the move expected in t seconds is volatility * sqrt(t / horizon), so the
+    symbol is due again once safety of those could have reached the trigger, clamped to [fast, slow].
+    due() returns the symbols due now and those due within batch seconds, so they share a market data refresh.
+    When the intervals ask for more than budget evaluations a second over all symbols, they are all stretched
+    by the same factor.
+    """
+
+    def __init__(self, symbols, fast, slow, budget, batch=0.0, horizon=DAY, safety=2.0, clock=time.monotonic):
+        self.fast = fast
+        self.slow = slow
+        self.budget = budget
+        self.batch = batch
+        self.horizon = horizon
+        self.safety = safety
+        self.clock = clock
+        self.intervals = {symbol: fast for symbol in symbols}
+        self.evaluated = {symbol: None for symbol in symbols}
+        self.lock = threading.Lock()
+
+    def interval(self, distance, volatility):
+        if distance <= 0.0 or volatility <= 0.0:
+            return self.fast
+        if math.isinf(distance):
+            return self.slow
+        interval = self.horizon * (distance / (self.safety * volatility)) ** 2
+        return min(max(interval, self.fast), self.slow)
+
+    def update(self, symbol, distance, volatility, now=None):
+        """ Reschedules symbol after an evaluation, returns its new interval. """
+        interval = self.interval(distance, volatility)
+        with self.lock:
+            self.intervals[symbol] = interval
+            self.evaluated[symbol] = self.clock() if now is None else now
+        return interval
+
+    def stretch(self):
+        demand = sum(1.0 / interval for interval in self.intervals.values())
+        return max(demand / self.budget, 1.0)
+
+    def due_at(self, symbol, stretch):
+        evaluated = self.evaluated[symbol]
+        return -math.inf if evaluated is None else evaluated + self.intervals[symbol] * stretch
+
+    def due(self, now=None):
+        """ Symbols due by now + batch, the most overdue first. """
+        now = self.clock() if now is None else now
+        with self.lock:
+            stretch = self.stretch()
+            due_at = {symbol: self.due_at(symbol, stretch) for symbol in self.intervals}
+        return sorted((symbol for symbol, at in due_at.items() if at <= now + self.batch), key=due_at.get)
+
+    def wait(self, now=None):
+        """ Seconds until the next symbol is due. """
+        now = self.clock() if now is None else now
+        with self.lock:
+            stretch = self.stretch()
+            next_due = min((self.due_at(symbol, stretch) for symbol in self.intervals), default=now)
+        return max(next_due - now, 0.0)
@@ -0,0 +1,185 @@
+# Trading bot Robinhood mock exchange
+# Author: Deepak Dasarathan
+
+import datetime
+import itertools
+import math
+import threading
+import time
+import types
+import uuid
+
+from exchange_transport import MockExchange, MockMarket
+
+
+def round_price(price):
+    """ Same rounding as robin_stocks.robinhood.helper.round_price. """
+    price = float(price)
+    if price <= 1e-2:
+        return round(price, 6)
+    elif price < 1e0:
+        return round(price, 4)
+    return round(price, 2)
+
+
+def iso_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class MockRobinhoodExchange(MockExchange):
+    """ Local stand-in for the robin_stocks.robinhood crypto calls main.py makes.
+
+    Prices are a random walk per symbol, the ask is spread (relative) above the bid. Limit orders are accepted
+    when the balance covers them, or rejected with reject_rate. An order resting in "confirmed" fills on a
+    get_crypto_order_info poll with probability fill_probability, the first fill taking partial_fill_ratio of it
+    when that is set. load_portfolio_profile reports the cash as equity, which is how main.py reads it.
+    """
+
+    def __init__(self, symbols, prices=None, starting_cash=5000.0, spread=0.001, fill_probability=1.0,
+                 partial_fill_ratio=0.0, reject_rate=0.0, volatility=0.001, step_interval=1.0, latency=0.0,
+                 jitter=0.0, error_rate=0.0, error_methods=None, error=ConnectionError, seed=None,
+                 clock=time.monotonic):
+        super().__init__(latency, jitter, error_rate, error_methods, error, seed)
+        self.symbols = list(symbols)
+        self.market = MockMarket({symbol: (prices or {}).get(symbol, 100.0) for symbol in self.symbols},
+                                 volatility, step_interval, seed, clock)
+        self.spread = spread
+        self.fill_probability = fill_probability
+        self.partial_fill_ratio = partial_fill_ratio
+        self.reject_rate = reject_rate
+        self.balances = {'usd': starting_cash}
+        self.orders = {}
+        self.sequence = itertools.count(1)
+        self.lock = threading.RLock()
+        self.helper = types.SimpleNamespace(round_price=round_price)
+
+    def login(self, username=None, password=None, expiresIn=86400, scope='internal', store_session=True,
+              mfa_code=None, pickle_path="", pickle_name=""):
+        self.api_call('login')
+        return {'access_token': "mock", 'token_type': "Bearer", 'detail': "logged in to the mock exchange"}
+
+    def get_crypto_quote(self, symbol, info=None):
+        self.api_call('get_crypto_quote')
+        return self.quote(symbol)
+
+    def get_crypto_historicals(self, symbol, interval='hour', span='week', bounds='24_7', info=None):
+        self.api_call('get_crypto_historicals')
+        state = self.market.advance(symbol)
+        now = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        hourly = state['hourly']
+        historicals = []
+        for index, close in enumerate(hourly):
+            begins_at = now - datetime.timedelta(hours=len(hourly) - 1 - index)
+            open_price = hourly[index - 1] if index > 0 else close
+            historicals.append({'begins_at': begins_at.isoformat(),
+                                'open_price': str(open_price),
+                                'close_price': str(close),
+                                'high_price': str(max(open_price, close)),
+                                'low_price': str(min(open_price, close)),
+                                'volume': 0,
+                                'session': "reg",
+                                'interpolated': False,
+                                'symbol': symbol + "USD"})
+        return historicals
+
+    def load_portfolio_profile(self, account_number=None, info=None):
+        self.api_call('load_portfolio_profile')
+        with self.lock:
+            return {'equity': str(self.balances['usd']), 'withdrawable_amount': str(self.balances['usd'])}
+
+    def get_crypto_positions(self, info=None):
+        self.api_call('get_crypto_positions')
+        with self.lock:
+            return [{'currency': {'code': currency, 'name': currency}, 'quantity': str(quantity),
+                     'quantity_available': str(quantity)}
+                    for currency, quantity in self.balances.items() if currency != 'usd']
+
+    def order_buy_crypto_limit_by_price(self, symbol, amountInDollars, limitPrice, timeInForce='gtc', jsonify=True):
+        self.api_call('order_buy_crypto_limit_by_price')
+        price = float(limitPrice)
+        return self.place(symbol, "buy", round(float(amountInDollars) / price, 8), price)
+
+    def order_sell_crypto_limit(self, symbol, quantity, limitPrice, timeInForce='gtc', jsonify=True):
+        self.api_call('order_sell_crypto_limit')
+        return self.place(symbol, "sell", float(quantity), float(limitPrice))
+
+    def get_crypto_order_info(self, order_id):
+        self.api_call('get_crypto_order_info')
+        with self.lock:
+            order = self.orders[order_id]
+            if order['state'] in ("confirmed", "partially_filled") and \
+                    self.fault_random.random() < self.fill_probability:
+                self.fill(order)
+            return dict(order)
+
+    def cancel_crypto_order(self, orderID):
+        self.api_call('cancel_crypto_order')
+        with self.lock:
+            order = self.orders[orderID]
+            if order['state'] in ("confirmed", "partially_filled"):
+                order['state'] = "canceled"
+                order['updated_at'] = iso_now()
+            return {}
+
+    # matching
+
+    def quote(self, symbol):
+        state = self.market.advance(symbol)
+        bid = state['price']
+        ask = bid * (1.0 + self.spread)
+        return {'symbol': symbol + "USD",
+                'id': str(uuid.uuid5(uuid.NAMESPACE_URL, symbol)),
+                'ask_price': str(ask),
+                'bid_price': str(bid),
+                'mark_price': str((ask + bid) / 2.0),
+                'high_price': str(state['high']),
+                'low_price': str(state['low']),
+                'open_price': str(state['open']),
+                'volume': "0.0"}
+
+    def place(self, symbol, side, quantity, price):
+        with self.lock:
+            now = iso_now()
+            order = {'id': str(uuid.UUID(int=next(self.sequence))),
+                     'symbol': symbol,
+                     'side': side,
+                     'type': "limit",
+                     'time_in_force': "gtc",
+                     'state': "confirmed",
+                     'quantity': str(quantity),
+                     'cumulative_quantity': "0.0",
+                     'price': str(price),
+                     'entered_price': str(round(quantity * price, 2)),
+                     'average_price': None,
+                     'created_at': now,
+                     'updated_at': now}
+            self.orders[order['id']] = order
+            if side == "buy" and quantity * price > self.balances['usd'] + 1e-9:
+                order['state'] = "rejected"
+            elif side == "sell" and quantity > self.balances.get(symbol, 0.0) + 1e-12:
+                order['state'] = "rejected"
+            elif self.reject_rate > 0.0 and self.fault_random.random() < self.reject_rate:
+                order['state'] = "rejected"
+            return dict(order)
+
+    def fill(self, order):
+        original = float(order['quantity'])
+        executed = float(order['cumulative_quantity'])
+        quantity = original - executed
+        if executed == 0.0 and self.partial_fill_ratio > 0.0:
+            quantity = math.floor(original * self.partial_fill_ratio * 1e8) / 1e8
+        if quantity <= 0.0:
+            return
+        symbol = order['symbol']
+        dollars = quantity * float(order['price'])
+        if order['side'] == "buy":
+            self.balances['usd'] = self.balances['usd'] - dollars
+            self.balances[symbol] = self.balances.get(symbol, 0.0) + quantity
+        else:
+            self.balances['usd'] = self.balances['usd'] + dollars
+            self.balances[symbol] = self.balances.get(symbol, 0.0) - quantity
+        executed = executed + quantity
+        order['cumulative_quantity'] = str(executed)
+        order['average_price'] = order['price']
+        order['state'] = "filled" if math.isclose(executed, original) else "partially_filled"
+        order['updated_at'] = iso_now()
@@ -0,0 +1,68 @@
+# Trading bot rolling high
+# Author: Deepak Dasarathan
+
+import datetime
+import math
+import threading
+import time
+from collections import deque
+
+HOUR = 60 * 60
+
+
+def candle_start(timestamp, interval=HOUR):
+    return math.floor(timestamp / interval) * interval
+
+
+def parse_time(begins_at):
+    return datetime.datetime.fromisoformat(begins_at.replace('Z', '+00:00')).timestamp()
+
+
+class RollingHigh:
+    """ High of the last window candles of a symbol, the newest one still forming from the quotes seen.
+
+    load() takes the historicals, only candles newer than the last one seen are added. Highs are kept in a
+    monotonic deque (candle start, high) with decreasing highs, so high is the front entry and adding a candle
+    or a quote and dropping the candle that left the window are O(1) amortised. stale() is true once a candle
+    boundary passed since the last load, when the historicals are due to be fetched again.
+    """
+
+    def __init__(self, window, interval=HOUR):
+        self.window = window
+        self.interval = interval
+        self.highs = deque()
+        self.latest = None
+        self.refresh_at = 0.0
+        self.lock = threading.Lock()
+
+    def push(self, start, high):
+        if self.latest is not None and start < self.latest:
+            return
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append((start, high))
+        self.latest = start
+        oldest = start - (self.window - 1) * self.interval
+        while self.highs[0][0] < oldest:
+            self.highs.popleft()
+
+    def load(self, historicals, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for historical in historicals:
+                self.push(parse_time(historical['begins_at']), float(historical['high_price']))
+            self.refresh_at = candle_start(now, self.interval) + self.interval
+
+    def observe(self, price, now=None):
+        """ Adds a quote to the candle forming now. """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.push(candle_start(now, self.interval), price)
+
+    def stale(self, now=None):
+        return (time.time() if now is None else now) >= self.refresh_at
+
+    @property
+    def high(self):
+        with self.lock:
+            return self.highs[0][1] if self.highs else -1.0
@@ -0,0 +1,46 @@
+# Trading bot state reports
+# Author: Deepak Dasarathan
+
+import threading
+import traceback
+
+
+class StateReporter:
+    """ Runs report(print_stdout) on a background thread, so order callbacks only book the fill.
+
+    The order tracker runs every callback on its one thread, and a report can wait behind the rate budget for
+    quotes (or sleep after an error), during which no other order would be polled or cancelled. request()
+    returns at once. Requests made while a report runs fold into one more report, which prints if any of them
+    asked to print.
+    """
+
+    def __init__(self, report, name="state"):
+        self.report = report
+        self.name = name
+        self.requested = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+        self.reports = 0
+
+    def request(self, print_stdout=True):
+        with self.lock:
+            self.requested = bool(self.requested) or print_stdout
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=self.name + "-reporter", daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.requested is None:
+                    self.wakeup.wait()
+                print_stdout = self.requested
+                self.requested = None
+            try:
+                self.report(print_stdout)
+            except Exception as e:
+                print(self.name + ": report failed", e)
+                print(traceback.format_exc())
+            self.reports = self.reports + 1
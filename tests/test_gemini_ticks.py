@@ -0,0 +1,131 @@
+# Gemini Trading bot
+# Author: Deepak Dasarathan
+
+import math
+import random
+import unittest
+from decimal import Decimal
+
+import numpy as np
+
+from autolos_kabali.gemini.gemini_ticks import TickGrid, notional, quantity_ticks
+
+SAMPLES = 2000
+INCREMENTS = [0.01, 0.001, 0.0001, 1e-05, 1e-06, 1e-09, 0.05, 1, 5]
+
+
+def old_gemini_round(tick_size, value):
+    """ gemini_round before the tick grids, correct for the tick sizes it knew. """
+    value_f = float(value)
+    if math.isclose(tick_size, 1e-8):
+        return round(value_f, 8)
+    elif math.isclose(tick_size, 1e-6):
+        return round(value_f, 6)
+    elif math.isclose(tick_size, 1e-5):
+        return round(value_f, 5)
+    return round(value_f, 2)
+
+
+def increment_of(grid):
+    return Decimal(grid.step).scaleb(-grid.places)
+
+
+def grid_strings(grid, rng):
+    """ Prices on the grid as the exchange writes them, with the carry boundaries among them. """
+    ticks = [rng.randint(1, 10 ** 9) for _ in range(SAMPLES)] + [1, 2]
+    for whole in (1, 9, 10, 99, 100, 999, 1000):
+        # the whole prices and the prices a tick either side of them, e.g. 99.99, 100.00 and 100.01
+        if (whole * grid.scale) % grid.step == 0:
+            at = whole * grid.scale // grid.step
+            ticks.extend([at - 1, at, at + 1])
+    return [grid.to_string(tick) for tick in ticks if tick >= 1]
+
+
+class TickGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(20261018)
+
+    def test_to_string_round_trips(self):
+        for increment in INCREMENTS:
+            grid = TickGrid(increment)
+            for price in grid_strings(grid, self.rng):
+                self.assertEqual(grid.to_string(grid.to_ticks(price)), price)
+                self.assertEqual(Decimal(price) % increment_of(grid), 0)
+
+    def test_below_and_above_step_one_tick(self):
+        for increment in INCREMENTS:
+            grid = TickGrid(increment)
+            tick = increment_of(grid)
+            for price in grid_strings(grid, self.rng):
+                above = Decimal(grid.to_string(grid.above(price)))
+                self.assertEqual(above, Decimal(price) + tick, price)
+                below = grid.below(price)
+                if Decimal(price) > tick:
+                    self.assertEqual(Decimal(grid.to_string(below)), Decimal(price) - tick, price)
+                else:
+                    self.assertIsNone(below, price)
+
+    def test_below_and_above_without_a_point(self):
+        grid = TickGrid(0.01)
+        self.assertEqual(grid.to_string(grid.below("100")), "99.99")
+        self.assertEqual(grid.to_string(grid.above("100")), "100.01")
+        self.assertEqual(grid.to_string(grid.below("1")), "0.99")
+        whole = TickGrid(1)
+        self.assertEqual(whole.to_string(whole.below("100")), "99")
+        self.assertEqual(whole.to_string(whole.above("100")), "101")
+
+    def test_below_and_above_off_the_grid(self):
+        for increment in INCREMENTS:
+            grid = TickGrid(increment)
+            tick = increment_of(grid)
+            for price in grid_strings(grid, self.rng):
+                off_grid = Decimal(price) + tick / 3
+                below = grid.below(str(off_grid))
+                self.assertEqual(Decimal(grid.to_string(below)), Decimal(price))
+                self.assertEqual(Decimal(grid.to_string(grid.above(str(off_grid)))), Decimal(price) + tick)
+
+    def test_array_operations_agree_with_the_scalar_ones(self):
+        for increment in INCREMENTS:
+            grid = TickGrid(increment)
+            on_grid = [float(price) for price in grid_strings(grid, self.rng)]
+            # prices a third of a tick off the grid and exact ties between two ticks
+            off_grid = [grid.to_float(self.rng.randint(1, 10 ** 9) * 3 + 1) / 3 for _ in range(SAMPLES)]
+            ties = [float(grid.to_string(self.rng.randint(1, 10 ** 6)) + '5') for _ in range(SAMPLES)]
+            values = np.array(on_grid + off_grid + ties)
+            below = grid.below_ticks(values)
+            self.assertEqual(list(grid.above_ticks(values)), [grid.above(value) for value in values])
+            self.assertEqual(list(grid.round_ticks(values)), [grid.to_ticks(value) for value in values])
+            self.assertEqual([tick if tick >= 1 else None for tick in below], [grid.below(value) for value in values])
+
+    def test_below_under_one_tick(self):
+        grid = TickGrid(0.01)
+        self.assertIsNone(grid.below("0.01"))
+        self.assertIsNone(grid.below("0.005"))
+        self.assertEqual(grid.to_string(grid.below("0.02")), "0.01")
+
+    def test_round_agrees_with_old_gemini_round(self):
+        for tick_size in (1e-8, 1e-6, 1e-5):
+            grid = TickGrid(tick_size)
+            for _ in range(SAMPLES):
+                value = self.rng.uniform(0.0, 1000.0) * 10.0 ** self.rng.randint(-6, 0)
+                self.assertEqual(grid.round(value), old_gemini_round(tick_size, value), value)
+                self.assertEqual(grid.round(repr(value)), old_gemini_round(tick_size, value), value)
+
+    def test_quantity_stays_within_half_a_tick_of_the_amount(self):
+        for price_increment, tick_size in ((0.01, 1e-8), (0.00001, 1e-6), (1e-09, 1e-6), (0.05, 1e-5)):
+            prices = TickGrid(price_increment)
+            quantities = TickGrid(tick_size)
+            quantity_tick = increment_of(quantities)
+            for _ in range(SAMPLES):
+                amount = self.rng.choice([5.0, 10.0, 12.5, 33.33, 100.0, 2500.0])
+                price_ticks = self.rng.randint(1, 10 ** 8)
+                price = Decimal(prices.to_string(price_ticks))
+                quantity = quantity_ticks(amount, price_ticks, prices, quantities)
+                spent = Decimal(quantity) * quantity_tick * price
+                self.assertLessEqual(abs(spent - Decimal(repr(amount))), price * quantity_tick / 2)
+                self.assertEqual(notional(price_ticks, prices, quantity, quantities), float(spent))
+
+
+if __name__ == '__main__':
+    unittest.main()